@@ -0,0 +1,386 @@
+##############################################################################################################################
+# Minimum arborescence (rooted directed minimum spanning tree) on integer node IDs.
+# Graphs are edge lists: src[e] -> dst[e] with weight[e], nodes 0..n-1.
+# Besides the tree, the solvers return the dual solution of the contraction: every node or
+# contracted cycle S gets y[S] >= 0, and a tree is optimal when every edge (u, v) satisfies
+#     weight(u, v) >= sum of y[S] over the sets S that contain v but not u
+# (tree edges meet it with equality). This lets a tree solved on a subset of the edges be
+# proven optimal for the full graph.
+##############################################################################################################################
+
+
+def edmonds(n, root, src, dst, weight):
+    """
+    Chu-Liu/Edmonds with all cycles of a round contracted together.
+    Returns (in_edge, up, y):
+      in_edge[v]  edge index entering v in the arborescence (-1 for root)
+      up[S]       enclosing contracted set of node/set S (-1 at the top), sets n.. are cycles
+      y[S]        dual value of node/set S
+    Raises ValueError when some node cannot be reached from root.
+    """
+    up = [-1] * n
+    y = [0] * n
+    children = [[] for v in range(0, n)]
+    cycle_edge = [-1] * n
+    comp = list(range(0, n))          # original node -> current top set
+    members = [[v] for v in range(0, n)]
+    reduced = list(weight)
+    alive = [e for e in range(0, len(src)) if dst[e] != root and src[e] != dst[e]]
+
+    while True:
+        best = {}
+        for e in alive:
+            d = comp[dst[e]]
+            if d not in best or reduced[e] < reduced[best[d]]:
+                best[d] = e
+        tops = set(comp)
+        tops.discard(comp[root])
+        for d in tops:
+            if d not in best:
+                raise ValueError("node {} is not reachable from the root".format(members[d][0]))
+        least = dict((d, reduced[best[d]]) for d in tops)
+        for e in alive:
+            reduced[e] -= least[comp[dst[e]]]
+        for d in tops:
+            y[d] += least[d]
+
+        # the chosen edges form a functional graph (one in-edge per top set), find all its cycles
+        cycles = []
+        state = {}
+        for start in tops:
+            path = []
+            d = start
+            while d in best and d not in state:
+                state[d] = start
+                path.append(d)
+                d = comp[src[best[d]]]
+            if d in best and state[d] == start:
+                cycles.append(path[path.index(d):])
+        if not cycles:
+            break
+
+        for cycle in cycles:
+            c = len(up)
+            up.append(-1)
+            y.append(0)
+            children.append(cycle)
+            cycle_edge.append(-1)
+            members.append([])
+            for s in cycle:
+                up[s] = c
+                cycle_edge[s] = best[s]
+                members[c].extend(members[s])
+            for v in members[c]:
+                comp[v] = c
+        alive = [e for e in alive if comp[src[e]] != comp[dst[e]]]
+
+    # expand: a cycle's in-edge enters one member, the others keep their cycle edge
+    in_set = dict((d, best[d]) for d in best if up[d] == -1)
+    for c in range(len(up) - 1, n - 1, -1):
+        e = in_set[c]
+        x = dst[e]
+        while up[x] != c:
+            x = up[x]
+        for s in children[c]:
+            in_set[s] = e if s == x else cycle_edge[s]
+    in_edge = [in_set.get(v, -1) for v in range(0, n)]
+    in_edge[root] = -1
+    return in_edge, up, y
+
+
+def dual_intervals(n, up, y):
+    """
+    Lays the contracted sets out as intervals of one node ordering (children of a set are
+    contiguous). Returns (pos, lo, hi, acc): pos[v] is the place of node v, set S covers
+    places lo[S]:hi[S], acc[S] is y of S plus all sets enclosing it.
+    """
+    sets = len(up)
+    kids = [[] for s in range(0, sets)]
+    for s in range(0, sets):
+        if up[s] >= 0:
+            kids[up[s]].append(s)
+    pos = [0] * n
+    lo = [0] * sets
+    hi = [0] * sets
+    acc = [0] * sets
+    place = 0
+    for top in range(0, sets):
+        if up[top] != -1:
+            continue
+        acc[top] = y[top]
+        stack = [(top, False)]
+        while stack:
+            (s, done) = stack.pop()
+            if done:
+                hi[s] = place
+                continue
+            lo[s] = place
+            if s < n:
+                pos[s] = place
+                place += 1
+                hi[s] = place
+                continue
+            stack.append((s, True))
+            for k in kids[s]:
+                acc[k] = acc[s] + y[k]
+                stack.append((k, False))
+    return pos, lo, hi, acc
+
+
+def chain(v, up):
+    """v and the sets enclosing it, innermost first"""
+    sets = [v]
+    while up[sets[-1]] != -1:
+        sets.append(up[sets[-1]])
+    return sets
+
+
+##############################################################################################################################
+# Tarjan's O(E log V) arborescence: one skew heap of incoming edges per (contracted) node,
+# lazy weight offsets instead of rewriting the reduced weights, and a union-find that is
+# rolled back cycle by cycle to expand the tree. Heap nodes are [weight, edge, left, right, lazy];
+# the initial heaps are built in bulk, one sort of the incoming edges per node.
+##############################################################################################################################
+def _push(h):
+    if h[4]:
+        h[0] += h[4]
+        if h[2] is not None:
+            h[2][4] += h[4]
+        if h[3] is not None:
+            h[3][4] += h[4]
+        h[4] = 0
+
+
+def _merge(a, b):
+    """skew heap meld, ties go to the lower edge index"""
+    if a is None:
+        return b
+    if b is None:
+        return a
+    _push(a)
+    _push(b)
+    if (b[0], b[1]) < (a[0], a[1]):
+        a, b = b, a
+    top = a
+    while True:
+        right = a[3]
+        a[3] = a[2]
+        if right is None:
+            a[2] = b
+            return top
+        _push(right)
+        if (b[0], b[1]) < (right[0], right[1]):
+            right, b = b, right
+        a[2] = right
+        a = right
+
+
+class RollbackUnionFind:
+    """union by size without path compression, so unions can be undone in reverse order"""
+    def __init__(self, n):
+        self.parent = list(range(0, n))
+        self.size = [1] * n
+        self.history = []
+
+    def find(self, v):
+        parent = self.parent
+        while parent[v] != v:
+            v = parent[v]
+        return v
+
+    def join(self, a, b):
+        a = self.find(a)
+        b = self.find(b)
+        if a == b:
+            return False
+        if self.size[a] < self.size[b]:
+            a, b = b, a
+        self.history.append((a, b))
+        self.parent[b] = a
+        self.size[a] += self.size[b]
+        return True
+
+    def rollback(self, mark):
+        while len(self.history) > mark:
+            (a, b) = self.history.pop()
+            self.parent[b] = b
+            self.size[a] -= self.size[b]
+
+
+def tarjan(n, root, src, dst, weight):
+    """
+    Same arborescence problem as edmonds() in O(E log V): returns in_edge, the edge index
+    entering every node (-1 for root). Raises ValueError when some node cannot be reached.
+    """
+    heap = [None] * n
+    into = [[] for v in range(0, n)]
+    for e in range(0, len(src)):
+        if src[e] != dst[e] and dst[e] != root:
+            into[dst[e]].append((weight[e], e))
+    for v in range(0, n):
+        # a sorted chain linked through the left children is already a valid skew heap
+        top = None
+        for (w, e) in sorted(into[v], reverse=True):
+            top = [w, e, top, None, 0]
+        heap[v] = top
+    del into
+    uf = RollbackUnionFind(n)
+    seen = [-1] * n
+    seen[root] = root
+    chosen = [-1] * n     # edge entering each component, indexed by its representative
+    cycles = []
+    for s in range(0, n):
+        u = s
+        path = []
+        edges = []
+        while seen[u] < 0:
+            while True:
+                h = heap[u]
+                if h is None:
+                    raise ValueError("node {} is not reachable from the root".format(u))
+                _push(h)
+                heap[u] = _merge(h[2], h[3])
+                if uf.find(src[h[1]]) != u:
+                    break  # edges inside a contracted cycle are dropped
+            if heap[u] is not None:
+                heap[u][4] -= h[0]
+            edges.append(h[1])
+            path.append(u)
+            seen[u] = s
+            u = uf.find(src[h[1]])
+            if seen[u] == s:
+                # cycle: melt the heaps of its members into one contracted node
+                mark = len(uf.history)
+                melted = None
+                first = len(path)
+                while True:
+                    first -= 1
+                    w = path[first]
+                    melted = _merge(melted, heap[w])
+                    if not uf.join(u, w):
+                        break
+                u = uf.find(u)
+                heap[u] = melted
+                seen[u] = -1
+                cycles.append((u, mark, edges[first:]))
+                del path[first:]
+                del edges[first:]
+        for e in edges:
+            chosen[uf.find(dst[e])] = e
+    for (u, mark, members) in reversed(cycles):
+        uf.rollback(mark)
+        e = chosen[u]
+        for m in members:
+            chosen[uf.find(dst[m])] = m
+        chosen[uf.find(dst[e])] = e
+    chosen[root] = -1
+    return chosen
+
+
+##############################################################################################################################
+# drop-in for compute_rdmst on the {parent: {child: weight}} graphs of create_tree
+##############################################################################################################################
+def graph_edges(g):
+    """node names and integer edge lists of a dict-of-dicts graph, edges in the graph's own order"""
+    names = list(g.keys())
+    at = dict((name, i) for (i, name) in enumerate(names))
+    src, dst, weight = [], [], []
+    for a in names:
+        for (b, w) in g[a].items():
+            if b not in at:
+                at[b] = len(names)
+                names.append(b)
+            src.append(at[a])
+            dst.append(at[b])
+            weight.append(w)
+    return names, src, dst, weight
+
+
+def compute_rdmst_tarjan(g, root):
+    """(rdmst, weight) like mdmst.compute_rdmst, solved with tarjan()"""
+    names, src, dst, weight = graph_edges(g)
+    in_edge = tarjan(len(names), names.index(root), src, dst, weight)
+    rdmst = dict((name, {}) for name in names)
+    total = 0
+    for e in in_edge:
+        if e >= 0:
+            rdmst[names[src[e]]][names[dst[e]]] = weight[e]
+            total += weight[e]
+    return rdmst, total
+
+
+##############################################################################################################################
+# self-check: both solvers against brute force on small graphs, the dual certificate, and timing
+##############################################################################################################################
+def brute_force_weight(n, root, src, dst, weight):
+    import itertools
+    best = None
+    into = [[e for e in range(0, len(src)) if dst[e] == v and src[e] != v] for v in range(0, n)]
+    others = [v for v in range(0, n) if v != root]
+    for pick in itertools.product(*[into[v] for v in others]):
+        parent = dict((dst[e], src[e]) for e in pick)
+        ok = True
+        for v in others:
+            (x, steps) = (v, 0)
+            while x != root and steps <= n:
+                (x, steps) = (parent[x], steps + 1)
+            ok = ok and x == root
+        if ok:
+            total = sum(weight[e] for e in pick)
+            best = total if best is None else min(best, total)
+    return best
+
+
+def tree_weight(n, root, src, dst, weight, in_edge):
+    for v in range(0, n):
+        if v != root:
+            assert dst[in_edge[v]] == v
+            (x, steps) = (v, 0)
+            while x != root:
+                (x, steps) = (src[in_edge[x]], steps + 1)
+                assert steps <= n, "cycle in the arborescence"
+    return sum(weight[in_edge[v]] for v in range(0, n) if v != root)
+
+
+def main():
+    import random
+    import time
+    random.seed(1)
+    for trial in range(0, 2000):
+        n = random.randint(2, 6)
+        root = random.randrange(n)
+        pairs = [(u, v) for u in range(0, n) for v in range(0, n) if u != v and random.random() < 0.6]
+        src = [u for (u, v) in pairs]
+        dst = [v for (u, v) in pairs]
+        weight = [random.randint(0, 5) for e in pairs]
+        expected = brute_force_weight(n, root, src, dst, weight)
+        try:
+            (in_edge, up, y) = edmonds(n, root, src, dst, weight)
+            fast = tarjan(n, root, src, dst, weight)
+        except ValueError:
+            assert expected is None
+            continue
+        assert tree_weight(n, root, src, dst, weight, in_edge) == expected == sum(y)
+        assert tree_weight(n, root, src, dst, weight, fast) == expected
+        (pos, lo, hi, acc) = dual_intervals(n, up, y)
+        for e in range(0, len(src)):
+            if dst[e] != root:
+                outside = set(chain(src[e], up))
+                assert weight[e] >= sum(y[S] for S in chain(dst[e], up) if S not in outside)
+    print("edmonds and tarjan match brute force on 2000 small graphs, duals feasible")
+    for (n, p) in [(100, 1.0), (300, 1.0), (3000, 0.01)]:
+        pairs = [(u, v) for u in range(0, n) for v in range(0, n) if u != v and (v == u + 1 or random.random() < p)]
+        src = [u for (u, v) in pairs]
+        dst = [v for (u, v) in pairs]
+        weight = [random.randint(0, 50) for e in pairs]
+        t0 = time.time()
+        slow = tree_weight(n, 0, src, dst, weight, edmonds(n, 0, src, dst, weight)[0])
+        t1 = time.time()
+        fast = tree_weight(n, 0, src, dst, weight, tarjan(n, 0, src, dst, weight))
+        t2 = time.time()
+        assert slow == fast
+        print("{} nodes, {} edges: edmonds {:.2f}s, tarjan {:.2f}s".format(n, len(src), t1 - t0, t2 - t1))
+
+
+if __name__ == "__main__":
+    main()
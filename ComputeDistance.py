@@ -1,7 +1,15 @@
 import copy
+import os
+import random
+import sys
+import time
 
 
-def matrixbuilder(node):
+def matrixbuilder(node, engine="python"):
+    if engine == "numpy":
+        from DistanceMatrix import nodes_med_matrix
+        names = list(node.keys())
+        return names, nodes_med_matrix(node, names).tolist()
     matrix = []
     for node1 in node:
         temp = []
@@ -23,7 +31,203 @@ def disthelper(node1, node2):
     return distcalc(node1, node2)
 
 
+# MED of one chromosome in closed form.
+# Peeling a run of +1/-1 events off the difference vector (see distcalc_peeloff)
+# costs exactly one event per unit the zero-padded difference 0,d_1..d_n,0 climbs,
+# i.e. half of its total variation, so the distance is one linear pass.
 def distcalc(node1, node2):
+    assert len(node1) == len(node2)
+    d = 0
+    prev = 0
+    for i in range(0, len(node1)):
+        diff = node1[i] - node2[i]
+        d += abs(diff - prev)
+        prev = diff
+    return int((d + abs(prev)) // 2)
+
+
+# A copy number lost in node1 cannot be regained by node2.
+def zerodisthelper(node1, node2):
+    for i in range(0, len(node1)):
+        if node1[i] == 0 and node2[i] != 0:
+            return 1000000
+    return distcalc(node1, node2)
+
+
+##############################################################################################################################
+# bounded MED: stop as soon as the distance is known to exceed a bound
+##############################################################################################################################
+EXCEEDED = float('inf')  # returned by dist_bounded when the distance is above the bound
+
+
+# Every event moves a segment by one copy, so MED of a chromosome is at least the largest
+# |node1[i] - node2[i]|, which is at least the shift of the chromosome maximum or minimum.
+# Without zero states MED is a metric, so it is also at least the difference of the two
+# cells' MED to an all-zero chromosome (half the total variation of the profile);
+# zero-state sentinels only raise MED, so both bounds hold for dist() as well.
+# These summaries are computed once per cell, comparing them costs O(1) per chromosome.
+def profile_extremes(node):
+    return [(max(seg), min(seg), distcalc(seg, [0] * len(seg))) for seg in node]
+
+
+def chrom_lower_bounds(ext1, ext2):
+    return [max(abs(a[0] - b[0]), abs(a[1] - b[1]), abs(a[2] - b[2])) for (a, b) in zip(ext1, ext2)]
+
+
+def dist_bounded(node1, node2, bound, chrom_dist=disthelper, ext1=None, ext2=None):
+    """
+    dist(node1, node2) if it is <= bound, else EXCEEDED.
+    Sums the per-chromosome lower bounds first, then replaces them one chromosome at a
+    time by the exact MED and gives up as soon as the running total passes bound.
+    ext1/ext2 are profile_extremes of the two cells when the caller has them.
+    """
+    lower = chrom_lower_bounds(ext1 or profile_extremes(node1), ext2 or profile_extremes(node2))
+    remaining = sum(lower)
+    if remaining > bound:
+        return EXCEEDED
+    d = 0
+    for i in range(0, len(node1)):
+        remaining -= lower[i]
+        d += chrom_dist(node1[i], node2[i])
+        if d + remaining > bound:
+            return EXCEEDED
+    return d
+
+
+def best_parents(nodes, child, candidates, k=1, chrom_dist=disthelper, extremes=None):
+    """
+    The k cheapest incoming edges of child as a sorted list of (distance, parent).
+    Candidates are visited by increasing lower bound: the search stops at the first one whose
+    bound cannot beat the k-th best, and the others only need a dist_bounded call.
+    extremes maps cell names to profile_extremes; pass it when searching for many children.
+    """
+    if extremes is None:
+        extremes = dict((name, profile_extremes(nodes[name])) for name in candidates)
+        extremes[child] = profile_extremes(nodes[child])
+    ordered = sorted((sum(chrom_lower_bounds(extremes[parent], extremes[child])), parent)
+                     for parent in candidates if parent != child)
+    best = []
+    for (lower, parent) in ordered:
+        bound = best[-1][0] if len(best) == k else EXCEEDED
+        if lower >= bound:
+            break
+        d = dist_bounded(nodes[parent], nodes[child], bound, chrom_dist, extremes[parent], extremes[child])
+        if d >= bound:
+            continue
+        best.append((d, parent))
+        best.sort(key=lambda x: x[0])
+        del best[k:]
+    return best
+
+
+##############################################################################################################################
+# interned per-chromosome vectors with a chromosome-level distance cache
+##############################################################################################################################
+class SegmentTable:
+    """
+    Interns the copy number vector of every chromosome: each distinct vector gets an integer ID
+    (its position in vectors[chromosome]) and a cell becomes a tuple of IDs. MED is a sum over
+    chromosomes, so dist() looks up one cached value per chromosome and computes chrom_dist
+    only once per distinct pair of vectors.
+    Pass chrom_dist=distcalc for the SP1_SCT_UTIL semantics (no zero-state sentinel).
+    """
+    def __init__(self, chrom_dist=disthelper):
+        self.chrom_dist = chrom_dist
+        self.vectors = []  # per chromosome, distinct vectors in ID order
+        self.lookup = []   # per chromosome, tuple(vector) -> ID
+        self.cache = []    # per chromosome, (ID, ID) -> MED
+        self.ids = {}      # cell name -> tuple of per-chromosome IDs
+        self.hits = 0
+        self.misses = 0
+
+    def grow(self, chromosomes):
+        while len(self.vectors) < chromosomes:
+            self.vectors.append([])
+            self.lookup.append({})
+            self.cache.append({})
+
+    def vector_id(self, c, vector):
+        key = tuple(vector)
+        if key not in self.lookup[c]:
+            self.lookup[c][key] = len(self.vectors[c])
+            self.vectors[c].append(list(vector))
+        return self.lookup[c][key]
+
+    def intern(self, name, profile):
+        """register a cell, returns its profile rebuilt from the shared vectors"""
+        self.grow(len(profile))
+        ids = tuple(self.vector_id(c, profile[c]) for c in range(0, len(profile)))
+        self.ids[name] = ids
+        return [self.vectors[c][i] for (c, i) in enumerate(ids)]
+
+    def intern_matrix(self, matrix):
+        """
+        intern() of every cell of a Readfile.CNVMatrix (NumPy only), with the same IDs: the cells
+        are grouped by matrix.distinct(), so only the first cell with each vector is looked up
+        """
+        self.grow(len(matrix.bounds))
+        columns = []
+        for c in range(0, len(matrix.bounds)):
+            (first, local) = matrix.distinct(c)
+            ids = [self.vector_id(c, matrix.vector(i, c)) for i in first]
+            columns.append([ids[k] for k in local])
+        self.ids.update(zip(matrix.names, zip(*columns)))
+
+    def dist(self, name1, name2):
+        d = 0
+        ids2 = self.ids[name2]
+        for (c, i) in enumerate(self.ids[name1]):
+            key = (i, ids2[c])
+            cache = self.cache[c]
+            if key in cache:
+                self.hits += 1
+            else:
+                self.misses += 1
+                cache[key] = self.chrom_dist(self.vectors[c][i], self.vectors[c][ids2[c]])
+            d += cache[key]
+        return d
+
+    def profile(self, name):
+        return [self.vectors[c][i] for (c, i) in enumerate(self.ids[name])]
+
+    def dist_bounded(self, name1, name2, bound, ext1=None, ext2=None):
+        """dist_bounded() of two interned cells, the exact chromosome MEDs taken from (and added to) the cache"""
+        ids1 = self.ids[name1]
+        ids2 = self.ids[name2]
+        lower = chrom_lower_bounds(ext1 or profile_extremes(self.profile(name1)),
+                                   ext2 or profile_extremes(self.profile(name2)))
+        remaining = sum(lower)
+        if remaining > bound:
+            return EXCEEDED
+        d = 0
+        for c in range(0, len(ids1)):
+            remaining -= lower[c]
+            key = (ids1[c], ids2[c])
+            cache = self.cache[c]
+            if key in cache:
+                self.hits += 1
+            else:
+                self.misses += 1
+                cache[key] = self.chrom_dist(self.vectors[c][ids1[c]], self.vectors[c][ids2[c]])
+            d += cache[key]
+            if d + remaining > bound:
+                return EXCEEDED
+        return d
+
+    def distinct_counts(self):
+        return [len(vectors) for vectors in self.vectors]
+
+    def report(self):
+        calls = self.hits + self.misses
+        rate = 100.0 * self.hits / calls if calls else 0.0
+        print("[INFO] {} cells, distinct vectors per chromosome: {}".format(len(self.ids), self.distinct_counts()))
+        print("[INFO] chromosome distance cache: {} lookups, {} computed, hit rate {:.2f}%".format(calls, self.misses, rate))
+
+
+##############################################################################################################################
+# reference peel-off implementation, kept to check distcalc/zerodisthelper against
+##############################################################################################################################
+def distcalc_peeloff(node1, node2):
     assert len(node1) == len(node2)
     if len(node1) == 1:
         return abs(node1[0] - node2[0])
@@ -58,7 +262,7 @@ def distcalc(node1, node2):
         return abs(d)
 
 
-def zerodisthelper(node1, node2):
+def zerodisthelper_peeloff(node1, node2):
     n1 = copy.deepcopy(node1)
     n2 = copy.deepcopy(node2)
     dist = 0
@@ -76,4 +280,107 @@ def zerodisthelper(node1, node2):
         else:
             temp1.append(x1)
             temp2.append(x2)
-    return distcalc(temp1, temp2)
+    return distcalc_peeloff(temp1, temp2)
+
+
+def disthelper_peeloff(node1, node2):
+    if 0 in node1 or 0 in node2:
+        return zerodisthelper_peeloff(node1, node2)
+    return distcalc_peeloff(node1, node2)
+
+
+##############################################################################################################################
+# equivalence check and dist_bounded benchmark: python ComputeDistance.py [raw example matrix ...]
+##############################################################################################################################
+def random_segment(length, maxcn=8, zero_rate=0.1):
+    seg = []
+    while len(seg) < length:
+        if random.random() < zero_rate:
+            cn = 0
+        else:
+            cn = random.randint(1, maxcn)
+        seg.extend([cn] * random.randint(1, 6))
+    return seg[:length]
+
+
+def read_example(filename, genepos=None):
+    """
+    Per-chromosome integer profiles of a raw example matrix (genomic rows, cell columns),
+    grouped the way dataTransfer.R does before segmentation.
+    scDNA input has chrom/chrompos columns; scRNA relative copy number is doubled and
+    rounded, and genes are placed with gencode_v19_gene_pos.txt.
+    """
+    data = open(filename)
+    header = next(data).rstrip("\n").split("\t")
+    rows = [line.rstrip("\n").split("\t") for line in data]
+    data.close()
+    if header[0] == "chrom":
+        cells = header[2:]
+        keyed = [(row[0], int(row[1]), [int(x) for x in row[2:]]) for row in rows]
+    else:
+        if genepos is None:
+            genepos = os.path.join(os.path.dirname(os.path.abspath(__file__)), "gencode_v19_gene_pos.txt")
+        pos = {}
+        for line in open(genepos):
+            array = line.split()
+            pos.setdefault(array[0], (array[1], int(array[2])))
+        cells = header[-(len(rows[0]) - 1):]
+        keyed = [pos[row[0]] + ([int(round(float(x) * 2)) for x in row[1:]],) for row in rows if row[0] in pos]
+    chroms = {}
+    for (chrom, start, values) in sorted(keyed, key=lambda x: x[1]):
+        chroms.setdefault(chrom, []).append(values)
+    nodes = {}
+    for k, cell in enumerate(cells):
+        nodes[cell] = [[values[k] for values in chroms[chrom]] for chrom in sorted(chroms)]
+    return nodes
+
+
+def check_equivalence(nodes, label, max_pairs=20000):
+    names = sorted(nodes.keys())
+    pairs = [(a, b) for a in names for b in names]
+    if len(pairs) > max_pairs:
+        pairs = random.sample(pairs, max_pairs)
+    chrom_calls = 0
+    for (a, b) in pairs:
+        for i in range(0, len(nodes[a])):
+            s1 = nodes[a][i]
+            s2 = nodes[b][i]
+            assert distcalc(s1, s2) == distcalc_peeloff(s1, s2), (label, a, b, i)
+            assert disthelper(s1, s2) == disthelper_peeloff(s1, s2), (label, a, b, i)
+            chrom_calls += 1
+    print("{}: {} cell pairs, {} chromosome segments identical".format(label, len(pairs), chrom_calls))
+
+
+def bench_bounded(nodes, label):
+    """best incoming edge of every cell with plain dist vs best_parents/dist_bounded"""
+    names = sorted(nodes.keys())
+    t0 = time.time()
+    plain = {}
+    for child in names:
+        plain[child] = min(dist(nodes[parent], nodes[child]) for parent in names if parent != child)
+    t1 = time.time()
+    extremes = dict((name, profile_extremes(nodes[name])) for name in names)
+    for child in names:
+        assert best_parents(nodes, child, names, extremes=extremes)[0][0] == plain[child], (label, child)
+    t2 = time.time()
+    print("{}: best parent of {} cells, dist {:.3f}s, dist_bounded {:.3f}s ({:.1f}x)".format(
+        label, len(names), t1 - t0, t2 - t1, (t1 - t0) / max(t2 - t1, 1e-9)))
+
+
+def main():
+    random.seed(0)
+    for length in [1, 2, 3, 5, 10, 50]:
+        nodes = {}
+        for k in range(0, 40):
+            nodes["cell" + str(k)] = [random_segment(length) for c in range(0, 3)]
+        check_equivalence(nodes, "random segments of length {}".format(length))
+    here = os.path.dirname(os.path.abspath(__file__))
+    files = sys.argv[1:] or [os.path.join(here, "example", "scDNA.CNV.txt"), os.path.join(here, "example", "scRNA.CNV.txt")]
+    for filename in files:
+        check_equivalence(read_example(filename), filename)
+    for filename in files:
+        bench_bounded(read_example(filename), filename)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,677 @@
+import hashlib
+import os
+import numpy as np
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
+# per-worker views of the shared arrays, set by _attach_shared
+_SHARED = {}
+
+# MED of a chromosome in which node1 has lost a copy number that node2 still carries
+SENTINEL = 1000000
+
+# MEDGraph entry of a pair without an edge (MED itself is never negative)
+NO_EDGE = -1
+
+
+##############################################################################################################################
+# segmented matrix as one (cells x segments) integer array plus chromosome boundaries
+##############################################################################################################################
+def small_ints(cnv):
+    """cnv as int8, or int16 if copy numbers do not fit"""
+    if cnv.dtype == np.int8:
+        return cnv  # also keeps a memory-mapped matrix mapped
+    if cnv.size == 0 or (cnv.min() >= -128 and cnv.max() <= 127):
+        return cnv.astype(np.int8)
+    return cnv.astype(np.int16)
+
+
+def profile_matrix(nodes, names):
+    """
+    Stack the per-chromosome profiles of read()/read_CNV() into a cells x segments array.
+    Returns the array (int8, or int16 if copy numbers do not fit) and the chromosome
+    boundaries as a list of (start, end) column ranges, like Readfile's charlist.
+    A CNVProfiles store is sliced directly.
+    """
+    if isinstance(nodes, CNVProfiles):
+        rows = np.array([nodes.index[name] for name in names], dtype=np.intp)
+        return small_ints(nodes.cnv[rows]), list(nodes.bounds)
+    bounds = []
+    start = 0
+    for seg in nodes[names[0]]:
+        bounds.append((start, start + len(seg)))
+        start += len(seg)
+    cnv = np.array([[cn for seg in nodes[name] for cn in seg] for name in names], dtype=np.int64)
+    return small_ints(cnv.reshape(len(names), start)), bounds
+
+
+class CNVProfiles(Mapping):
+    """
+    Read-only {cell: per-chromosome copy number lists} view of one cells x segments array:
+    nodes[name] is [cnv[i, a:b] for every chromosome range (a, b) in bounds], built on access.
+    """
+    def __init__(self, names, cnv, bounds):
+        self.names = list(names)
+        self.index = dict((name, i) for i, name in enumerate(self.names))
+        self.cnv = small_ints(np.asarray(cnv))
+        self.bounds = list(bounds)
+
+    def __getitem__(self, name):
+        row = self.cnv[self.index[name]].tolist()
+        return [row[a:b] for (a, b) in self.bounds]
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.index
+
+
+def step_matrix(cnv, bounds):
+    """
+    Copy number steps of every chromosome [a, b) read from zero on both ends:
+    x_a, x_a+1 - x_a, ..., x_b-1 - x_b-2, -x_b-1.
+    MED of a chromosome is half the L1 distance between the step vectors of two cells,
+    the same closed form as ComputeDistance.distcalc.
+    Returns the steps (int16) and the first step column of every chromosome.
+    """
+    n = cnv.shape[0]
+    steps = np.zeros((n, cnv.shape[1] + len(bounds)), dtype=np.int16)
+    starts = []
+    for k, (a, b) in enumerate(bounds):
+        s = a + k
+        starts.append(s)
+        block = cnv[:, a:b].astype(np.int16)
+        steps[:, s] = block[:, 0] if b > a else 0
+        steps[:, s + 1:s + b - a] = block[:, 1:] - block[:, :-1]
+        steps[:, s + b - a] = -block[:, -1] if b > a else 0
+    return steps, np.array(starts, dtype=np.intp)
+
+
+def drop_flat_steps(steps, starts):
+    """drop step columns that are zero in every cell, they add nothing to any distance"""
+    keep = steps.any(axis=0)
+    keep[starts] = True  # keep one column per chromosome so starts stay valid
+    return steps[:, keep], np.cumsum(keep)[starts] - 1
+
+
+def tile_side(n, width, tile_bytes):
+    """side of a square tile whose (side, side, width) int16 working array fits in tile_bytes"""
+    return int(min(n, max(1, int((tile_bytes // max(1, 2 * width)) ** 0.5))))
+
+
+def half_tiles(n, side):
+    """(r0, r1, c0, c1) square tiles on and above the diagonal, each unordered pair is in one of them"""
+    return [(r0, min(n, r0 + side), c0, min(n, c0 + side))
+            for r0 in range(0, n, side) for c0 in range(r0, n, side)]
+
+
+##############################################################################################################################
+# all-pairs directed MED
+# the zero-state-free core is symmetric, so it is computed once per unordered pair and mirrored;
+# only pairs where one cell lost a copy number the other keeps are patched afterwards
+##############################################################################################################################
+def core_tile(steps, r0, r1, c0, c1):
+    """MED between the cells r0:r1 and c0:c1, zero states ignored"""
+    absdiff = np.abs(steps[r0:r1, None, :] - steps[None, c0:c1, :])
+    return absdiff.sum(axis=2, dtype=np.int32) // 2
+
+
+def store_tile(out, tile, r0, r1, c0, c1):
+    out[r0:r1, c0:c1] = tile
+    if c0 != r0:
+        out[c0:c1, r0:r1] = tile.T
+
+
+def patch_lost_copies(out, cnv, bounds, steps, starts, block_bytes=2 ** 26, cols=None, rows=None):
+    """
+    Turn the symmetric core into ComputeDistance.dist: every chromosome where cell i has a
+    homozygous deletion that cell j does not share costs SENTINEL instead of its MED.
+    A per-chromosome zero mask product counts the shared zeros of every pair, so only the
+    affected (i, j) entries are touched. Returns the number of patched chromosome pairs.
+    out holds the cells rows as rows and the cells cols as columns (index arrays, default all).
+    """
+    n = cnv.shape[0]
+    if cols is None:
+        cols = np.arange(n)
+    if rows is None:
+        rows = np.arange(n)
+    ends = list(starts[1:]) + [steps.shape[1]]
+    patched = 0
+    for k, (a, b) in enumerate(bounds):
+        zc = cnv[:, a:b] == 0
+        zrows = zc[rows]
+        holders = np.flatnonzero(zrows.any(axis=1))
+        if len(holders) == 0:
+            continue
+        zt = zc[cols].T.astype(np.float32)
+        chunk = max(1, block_bytes // (4 * len(cols)))
+        for h0 in range(0, len(holders), chunk):
+            held = holders[h0:h0 + chunk]
+            zr = zrows[held].astype(np.float32)
+            lost = np.dot(zr, zt) < zr.sum(axis=1)[:, None]
+            (li, lj) = np.nonzero(lost)
+            if len(li) == 0:
+                continue
+            li = held[li]
+            sc = steps[:, starts[k]:ends[k]]
+            for p0 in range(0, len(li), chunk):
+                i = li[p0:p0 + chunk]
+                j = lj[p0:p0 + chunk]
+                med = np.abs(sc[rows[i]] - sc[cols[j]]).sum(axis=1, dtype=np.int32) // 2
+                out[i, j] += SENTINEL - med
+            patched += len(li)
+    return patched
+
+
+def med_matrix(cnv, bounds, zero_sentinel=True, tile_bytes=2 ** 26, out=None):
+    """
+    Directed N x N MED matrix, out[i, j] = dist(cell i, cell j), computed in tiles so the
+    working memory stays around tile_bytes.
+    zero_sentinel follows ComputeDistance.dist (a chromosome where cell i has a homozygous
+    deletion absent from cell j costs SENTINEL); set it False for SP1_SCT_UTIL.dist.
+    """
+    n = cnv.shape[0]
+    steps, starts = drop_flat_steps(*step_matrix(cnv, bounds))
+    if out is None:
+        out = np.empty((n, n), dtype=np.int32)
+    for (r0, r1, c0, c1) in half_tiles(n, tile_side(n, steps.shape[1], tile_bytes)):
+        store_tile(out, core_tile(steps, r0, r1, c0, c1), r0, r1, c0, c1)
+    if zero_sentinel:
+        patch_lost_copies(out, cnv, bounds, steps, starts, tile_bytes)
+    return out
+
+
+def med_columns(cnv, bounds, zero_sentinel=True, tile_bytes=2 ** 26):
+    """
+    Distance oracle for solvers that never hold the whole matrix: returns columns(cols),
+    the directed MED from every cell to the cells in cols (index array) as an N x len(cols) block.
+    """
+    n = cnv.shape[0]
+    steps, starts = drop_flat_steps(*step_matrix(cnv, bounds))
+
+    def columns(cols):
+        cols = np.asarray(cols, dtype=np.intp)
+        out = np.empty((n, len(cols)), dtype=np.int32)
+        rows = max(1, tile_bytes // max(1, 2 * steps.shape[1] * len(cols)))
+        for r0 in range(0, n, rows):
+            r1 = min(n, r0 + rows)
+            absdiff = np.abs(steps[r0:r1, None, :] - steps[None, cols, :])
+            out[r0:r1] = absdiff.sum(axis=2, dtype=np.int32) // 2
+        if zero_sentinel:
+            patch_lost_copies(out, cnv, bounds, steps, starts, tile_bytes, cols)
+        return out
+    return columns
+
+
+##############################################################################################################################
+# multi-process all-pairs MED over shared memory
+##############################################################################################################################
+def balanced_tiles(n, width, tile_bytes, workers):
+    """half_tiles under tile_bytes, at least 4 per worker so no worker idles at the end"""
+    side = tile_side(n, width, tile_bytes)
+    tiles = half_tiles(n, side)
+    while side > 1 and len(tiles) < 4 * workers:
+        side = -(-side // 2)
+        tiles = half_tiles(n, side)
+    return tiles
+
+
+def _attach_shared(specs):
+    from multiprocessing import shared_memory
+    for key, (name, shape, dtype) in specs.items():
+        shm = shared_memory.SharedMemory(name=name)
+        _SHARED[key + "_shm"] = shm
+        _SHARED[key] = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+
+def _core_tile_worker(tile):
+    (r0, r1, c0, c1) = tile
+    store_tile(_SHARED["out"], core_tile(_SHARED["steps"], r0, r1, c0, c1), r0, r1, c0, c1)
+    return (r1 - r0) * (c1 - c0)
+
+
+def med_matrix_parallel(cnv, bounds, threads, zero_sentinel=True, tile_bytes=2 ** 26):
+    """
+    med_matrix split over a pool of processes.
+    The step array and the N x N output live in multiprocessing.shared_memory, workers only
+    receive tile coordinates and write their block (and its mirror) of the matrix in place.
+    """
+    n = cnv.shape[0]
+    if threads <= 1 or n < 2:
+        return med_matrix(cnv, bounds, zero_sentinel=zero_sentinel, tile_bytes=tile_bytes)
+    try:
+        from multiprocessing import Pool, shared_memory
+    except ImportError:
+        print("multiprocessing.shared_memory needs Python 3.8+, computing distances in one process")
+        return med_matrix(cnv, bounds, zero_sentinel=zero_sentinel, tile_bytes=tile_bytes)
+
+    steps, starts = drop_flat_steps(*step_matrix(cnv, bounds))
+    shapes = {"steps": steps.shape, "out": (n, n)}
+    dtypes = {"steps": steps.dtype, "out": np.dtype(np.int32)}
+    specs = {}
+    blocks = {}
+    try:
+        for key in ["steps", "out"]:
+            shm = shared_memory.SharedMemory(create=True, size=max(1, int(np.prod(shapes[key])) * dtypes[key].itemsize))
+            blocks[key] = shm
+            specs[key] = (shm.name, shapes[key], dtypes[key].str)
+        np.ndarray(shapes["steps"], dtype=dtypes["steps"], buffer=blocks["steps"].buf)[...] = steps
+        tiles = balanced_tiles(n, steps.shape[1], tile_bytes, threads)
+        pool = Pool(threads, initializer=_attach_shared, initargs=(specs,))
+        try:
+            for done in pool.imap_unordered(_core_tile_worker, tiles):
+                pass
+        finally:
+            pool.close()
+            pool.join()
+        out = np.ndarray((n, n), dtype=np.int32, buffer=blocks["out"].buf).copy()
+    finally:
+        for shm in blocks.values():
+            shm.close()
+            shm.unlink()
+    if zero_sentinel:
+        patch_lost_copies(out, cnv, bounds, steps, starts, tile_bytes)
+    return out
+
+
+def nodes_med_matrix(nodes, names, zero_sentinel=True, tile_bytes=2 ** 26, threads=1):
+    """med_matrix over the dict-of-list-of-lists profiles returned by read()/read_CNV()"""
+    cnv, bounds = profile_matrix(nodes, names)
+    if threads > 1:
+        return med_matrix_parallel(cnv, bounds, threads, zero_sentinel=zero_sentinel, tile_bytes=tile_bytes)
+    return med_matrix(cnv, bounds, zero_sentinel=zero_sentinel, tile_bytes=tile_bytes)
+
+
+##############################################################################################################################
+# all-pairs MED through interned chromosome vectors (ComputeDistance.SegmentTable)
+##############################################################################################################################
+def interned_med_matrix(table, names, zero_sentinel=True, tile_bytes=2 ** 26, threads=1):
+    """
+    MED matrix assembled from one small matrix per chromosome over its distinct vectors:
+    out[i, j] = sum over chromosomes of M_c[id_c(i), id_c(j)]. On clonal samples the distinct
+    vectors are a handful per chromosome, so almost all of the work is the ID lookups, which are
+    added into out in bands of rows of at most tile_bytes.
+    """
+    n = len(names)
+    ids = np.array([table.ids[name] for name in names], dtype=np.intp).reshape(n, len(table.vectors))
+    out = np.zeros((n, n), dtype=np.int32)
+    rows = max(1, tile_bytes // (4 * max(1, n)))
+    computed = 0
+    for (c, vectors) in enumerate(table.vectors):
+        if len(vectors) == 1:
+            continue  # every cell carries the same vector, MED 0
+        cnv = np.array(vectors, dtype=np.int16).reshape(len(vectors), len(vectors[0]))
+        if threads > 1:
+            per_chrom = med_matrix_parallel(cnv, [(0, cnv.shape[1])], threads, zero_sentinel, tile_bytes)
+        else:
+            per_chrom = med_matrix(cnv, [(0, cnv.shape[1])], zero_sentinel, tile_bytes)
+        computed += len(vectors) ** 2
+        for r0 in range(0, n, rows):
+            # one band of rows at a time, so the gathered block stays within tile_bytes
+            out[r0:r0 + rows] += per_chrom[np.ix_(ids[r0:r0 + rows, c], ids[:, c])]
+    print("[INFO] {} distinct chromosome pairs computed for {} cell pairs x {} chromosomes".format(
+        computed, n * n, len(table.vectors)))
+    return out
+
+
+##############################################################################################################################
+# create_tree output as one N x N array with the {parent: {child: MED}} interface of the solvers
+##############################################################################################################################
+class MEDGraph(Mapping):
+    """
+    Read-only graph over the cells in names: g[a][b] is the edge weight from a to b, read from
+    matrix[i, j]. The diagonal, NO_EDGE entries and the True entries of the optional boolean
+    absent matrix are missing edges. In-memory matrices are kept as int16 when the weights
+    fit (int32 otherwise); an np.memmap is read in place and never written to.
+    """
+    def __init__(self, names, matrix, absent=None):
+        self.names = list(names)
+        self.index = dict((name, i) for i, name in enumerate(self.names))
+        if not isinstance(matrix, np.memmap):
+            if matrix.size == 0 or matrix.max() <= np.iinfo(np.int16).max:
+                matrix = matrix.astype(np.int16, copy=False)
+            elif matrix.dtype != np.int32:
+                matrix = matrix.astype(np.int32)
+        self.matrix = matrix
+        self.absent = absent
+
+    def __getitem__(self, name):
+        return MEDRow(self, self.index[name])
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def edge_count(self):
+        return sum(len(self[name]) for name in self.names)
+
+    def reachable(self, root, block_bytes=2 ** 26):
+        """
+        boolean array over names: the cells reached from root. When root has an edge to every
+        cell only its row is read; otherwise a breadth-first search expands whole frontiers at
+        once, reading the matrix in bands of rows of at most block_bytes.
+        """
+        n = len(self.names)
+        r = self.index[root]
+        seen = np.zeros(n, dtype=bool)
+        seen[r] = True
+        frontier = np.array([r])
+        rows = max(1, block_bytes // max(1, n * self.matrix.itemsize))
+        while len(frontier) and not seen.all():
+            reach = np.zeros(n, dtype=bool)
+            for b0 in range(0, len(frontier), rows):
+                band = frontier[b0:b0 + rows]
+                edges = np.asarray(self.matrix[band]) >= 0
+                if self.absent is not None:
+                    edges &= ~np.asarray(self.absent[band])
+                reach |= edges.any(axis=0)
+            frontier = np.flatnonzero(reach & ~seen)
+            seen[frontier] = True
+        return seen
+
+
+class MEDRow(Mapping):
+    """out-edges of one cell of a MEDGraph, as {child: MED}"""
+    def __init__(self, graph, i):
+        self.names = graph.names
+        self.index = graph.index
+        self.i = i
+        self.row = graph.matrix[i]
+        self.absent = None if graph.absent is None else graph.absent[i]
+
+    def __getitem__(self, name):
+        j = self.index[name]
+        w = self.row[j]
+        if w < 0 or j == self.i or (self.absent is not None and self.absent[j]):
+            raise KeyError(name)
+        return int(w)
+
+    def cols(self):
+        keep = np.asarray(self.row) >= 0
+        keep[self.i] = False
+        if self.absent is not None:
+            keep &= ~self.absent
+        return np.flatnonzero(keep)
+
+    def __iter__(self):
+        names = self.names
+        return (names[j] for j in self.cols().tolist())
+
+    def __len__(self):
+        return len(self.cols())
+
+    def __contains__(self, name):
+        j = self.index.get(name)
+        return j is not None and j != self.i and self.row[j] >= 0 and (self.absent is None or not self.absent[j])
+
+    def values(self):
+        return self.row[self.cols()].tolist()
+
+    def items(self):
+        cols = self.cols()
+        return list(zip([self.names[j] for j in cols.tolist()], self.row[cols].tolist()))
+
+
+##############################################################################################################################
+# out-of-core MED matrix: tiles written into an .npy memmap and logged so a stopped run resumes
+##############################################################################################################################
+def tile_log_header(cnv, bounds, zero_sentinel, side, dtype):
+    """fingerprint of everything that decides the matrix contents and the tile layout"""
+    digest = hashlib.sha1(np.ascontiguousarray(cnv).tobytes())
+    digest.update(repr((cnv.shape, bounds, bool(zero_sentinel), side, str(dtype))).encode("ascii"))
+    return "MED tiles {}".format(digest.hexdigest())
+
+
+def read_tile_log(log_path, header):
+    """tiles (r0, c0) already in the matrix, or None if the log belongs to another input"""
+    if not os.path.exists(log_path):
+        return None
+    log = open(log_path)
+    lines = log.read().split("\n")
+    log.close()
+    if lines[0] != header:
+        return None
+    done = set()
+    for line in lines[1:-1]:  # the last piece is empty, or a torn line whose tile is recomputed
+        fields = line.split()
+        done.add((int(fields[0]), int(fields[1])))
+    return done
+
+
+def matrix_dtype(steps, zero_sentinel):
+    """int16 when no entry can exceed it: without lost-copy sentinels MED obeys the triangle
+    inequality through the all-zero profile, whose MED to a cell is half its step L1 norm"""
+    reach = np.abs(steps).sum(axis=1, dtype=np.int64).max() if len(steps) else 0
+    if not zero_sentinel and reach <= np.iinfo(np.int16).max:
+        return np.int16
+    return np.int32
+
+
+def med_matrix_memmap(cnv, bounds, path, zero_sentinel=True, tile_bytes=2 ** 26, progress=None, names=None):
+    """
+    med_matrix written tile by tile into the .npy file at path instead of RAM. A tile is
+    listed in path + ".tiles" only after it is flushed to disk, so calling this again after
+    a crash with the same input only computes the missing tiles. Each tile holds both
+    directions of its cell pairs, lost copies included, so rewriting a tile is harmless.
+    progress(done, total) is called after every tile. With names, the finished matrix is
+    described in path + ".cells" so a later run can extend it (extend_med_matrix).
+    Returns the finished matrix as a read-only np.memmap.
+    """
+    n = cnv.shape[0]
+    steps, starts = drop_flat_steps(*step_matrix(cnv, bounds))
+    dtype = matrix_dtype(steps, zero_sentinel)
+    side = tile_side(n, steps.shape[1], tile_bytes)
+    tiles = half_tiles(n, side)
+    header = tile_log_header(cnv, bounds, zero_sentinel, side, dtype)
+    log_path = path + ".tiles"
+    done = read_tile_log(log_path, header) if os.path.exists(path) else None
+    if done is None:
+        out = np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=(n, n))
+        done = set()
+    else:
+        out = np.load(path, mmap_mode="r+")
+    # rewrite the log without a torn last line before appending to it
+    log = open(log_path, "w")
+    log.write(header + "\n")
+    log.write("".join("{} {}\n".format(r0, c0) for (r0, c0) in sorted(done)))
+    log.flush()
+    os.fsync(log.fileno())
+    for (r0, r1, c0, c1) in tiles:
+        if (r0, c0) not in done:
+            tile = core_tile(steps, r0, r1, c0, c1)
+            upper = tile.copy()
+            if zero_sentinel:
+                patch_lost_copies(upper, cnv, bounds, steps, starts, tile_bytes,
+                                  cols=np.arange(c0, c1), rows=np.arange(r0, r1))
+            out[r0:r1, c0:c1] = upper
+            if c0 != r0:
+                lower = tile.T.copy()
+                if zero_sentinel:
+                    patch_lost_copies(lower, cnv, bounds, steps, starts, tile_bytes,
+                                      cols=np.arange(r0, r1), rows=np.arange(c0, c1))
+                out[c0:c1, r0:r1] = lower
+            out.flush()
+            log.write("{} {}\n".format(r0, c0))
+            log.flush()
+            os.fsync(log.fileno())
+            done.add((r0, c0))
+        if progress is not None:
+            progress(len(done), len(tiles))
+    log.close()
+    del out
+    if names is not None:
+        write_cells(path, names, cnv, bounds, zero_sentinel)
+    return np.load(path, mmap_mode="r")
+
+
+##############################################################################################################################
+# incremental MED matrix: reuse a previous run's memmap and compute only the rows and columns of new cells
+##############################################################################################################################
+def cells_header(bounds, zero_sentinel):
+    return "MED cells {}".format(hashlib.sha1(repr((bounds, bool(zero_sentinel))).encode("ascii")).hexdigest())
+
+
+def cell_keys(cnv):
+    """one digest per profile, a cell whose profile changed between runs is not reused"""
+    return [hashlib.sha1(np.asarray(row, dtype=np.int64).tobytes()).hexdigest() for row in cnv]
+
+
+def write_cells(path, names, cnv, bounds, zero_sentinel):
+    """path + ".cells": which cell (and which profile) every row/column of the matrix at path is"""
+    cells = open(path + ".cells", "w")
+    cells.write(cells_header(bounds, zero_sentinel) + "\n")
+    for (name, key) in zip(names, cell_keys(cnv)):
+        cells.write("{}\t{}\n".format(name, key))
+    cells.close()
+
+
+def read_cells(path):
+    """(header, [(name, key), ...]) of the matrix at path, or None if it was not described"""
+    if not os.path.exists(path + ".cells"):
+        return None
+    cells = open(path + ".cells")
+    header = next(cells).rstrip("\n")
+    rows = [tuple(line.rstrip("\n").split("\t")) for line in cells]
+    cells.close()
+    return header, rows
+
+
+def extend_med_matrix(previous, cnv, bounds, names, path, zero_sentinel=True, tile_bytes=2 ** 26, progress=None):
+    """
+    MED matrix of names written to the .npy memmap at path, copying every entry between cells
+    already in the matrix at previous (same name, same profile, same chromosome layout) and
+    computing only the rows and columns of the other cells: O(new * N) distance work.
+    Falls back to med_matrix_memmap when previous cannot be reused.
+    Returns (matrix as read-only np.memmap, number of reused cells).
+    """
+    n = cnv.shape[0]
+    described = read_cells(previous) if os.path.exists(previous) else None
+    if os.path.abspath(previous) == os.path.abspath(path):
+        raise ValueError("the extended matrix must not overwrite the previous one: {}".format(path))
+    if described is None or described[0] != cells_header(bounds, zero_sentinel):
+        print("previous matrix {} does not match this input, computing all pairs".format(previous))
+        return med_matrix_memmap(cnv, bounds, path, zero_sentinel, tile_bytes, progress, names), 0
+    before = dict((key, i) for (i, key) in enumerate(described[1]))
+    old, new = [], []
+    for (i, key) in enumerate(zip(names, cell_keys(cnv))):
+        if key in before:
+            old.append((i, before[key]))
+        else:
+            new.append(i)
+    steps, starts = drop_flat_steps(*step_matrix(cnv, bounds))
+    out = np.lib.format.open_memmap(path, mode="w+", dtype=matrix_dtype(steps, zero_sentinel), shape=(n, n))
+    kept = np.array([i for (i, j) in old], dtype=np.intp)
+    source = np.array([j for (i, j) in old], dtype=np.intp)
+    prev = np.load(previous, mmap_mode="r")
+    side = max(1, tile_bytes // max(1, 4 * len(old)))
+    for r0 in range(0, len(old), side):
+        out[kept[r0:r0 + side, None], kept[None, :]] = prev[source[r0:r0 + side, None], source[None, :]]
+    del prev
+    new = np.array(new, dtype=np.intp)
+    every = np.arange(n)
+    side = max(1, tile_bytes // max(1, 2 * steps.shape[1] * n))
+    for c0 in range(0, len(new), side):
+        cols = new[c0:c0 + side]
+        core = np.abs(steps[:, None, :] - steps[None, cols, :]).sum(axis=2, dtype=np.int32) // 2
+        into = core.copy()
+        leaving = core.T.copy()
+        if zero_sentinel:
+            patch_lost_copies(into, cnv, bounds, steps, starts, tile_bytes, cols=cols, rows=every)
+            patch_lost_copies(leaving, cnv, bounds, steps, starts, tile_bytes, cols=every, rows=cols)
+        out[:, cols] = into
+        out[cols, :] = leaving
+        if progress is not None:
+            progress(min(len(new), c0 + side), len(new))
+    out.flush()
+    del out
+    write_cells(path, names, cnv, bounds, zero_sentinel)
+    return np.load(path, mmap_mode="r"), len(old)
+
+
+##############################################################################################################################
+# directed correctness check against ComputeDistance.dist: python DistanceMatrix.py [raw example matrix ...]
+##############################################################################################################################
+def check_directed(nodes, label, threads=2):
+    from ComputeDistance import dist, distcalc
+    names = sorted(nodes.keys())
+    cnv, bounds = profile_matrix(nodes, names)
+    for zero_sentinel in [True, False]:
+        for tile_bytes in [2 ** 26, 4096]:
+            serial = med_matrix(cnv, bounds, zero_sentinel=zero_sentinel, tile_bytes=tile_bytes)
+            pooled = med_matrix_parallel(cnv, bounds, threads, zero_sentinel=zero_sentinel, tile_bytes=tile_bytes)
+            assert (serial == pooled).all(), (label, zero_sentinel, tile_bytes)
+            for i, a in enumerate(names):
+                for j, b in enumerate(names):
+                    if zero_sentinel:
+                        expected = dist(nodes[a], nodes[b])
+                    else:
+                        expected = sum(distcalc(s1, s2) for (s1, s2) in zip(nodes[a], nodes[b]))
+                    assert serial[i, j] == expected, (label, a, b, zero_sentinel, tile_bytes)
+    full = med_matrix(cnv, bounds)
+    check_memmap(cnv, bounds, label)
+    print("{}: {} directed pairs identical, {} asymmetric".format(label, len(names) ** 2, int((full != full.T).sum())))
+
+
+class StopRun(Exception):
+    pass
+
+
+def check_memmap(cnv, bounds, label):
+    """memmap tiles equal med_matrix, also when the run is stopped halfway and resumed"""
+    import shutil
+    import tempfile
+    folder = tempfile.mkdtemp()
+    try:
+        for zero_sentinel in [True, False]:
+            path = os.path.join(folder, "med{}.npy".format(int(zero_sentinel)))
+            expected = med_matrix(cnv, bounds, zero_sentinel=zero_sentinel)
+
+            def stop_halfway(done, total):
+                if done > total // 2:
+                    raise StopRun()
+            try:
+                med_matrix_memmap(cnv, bounds, path, zero_sentinel, tile_bytes=4096, progress=stop_halfway)
+            except StopRun:
+                pass
+            log = open(path + ".tiles", "a")
+            log.write("1")  # torn last line
+            log.close()
+            computed = []
+            resumed = med_matrix_memmap(cnv, bounds, path, zero_sentinel, tile_bytes=4096,
+                                        progress=lambda done, total: computed.append(done))
+            assert (resumed == expected).all(), (label, zero_sentinel)
+            assert computed[0] > 1 or len(computed) == 1, (label, "resume started over")
+            del resumed
+    finally:
+        shutil.rmtree(folder)
+
+
+def main():
+    import random
+    import sys
+    from ComputeDistance import random_segment, read_example
+    random.seed(0)
+    for zero_rate in [0.0, 0.05, 0.2]:
+        nodes = {}
+        for k in range(0, 60):
+            nodes["cell" + str(k)] = [random_segment(length, zero_rate=zero_rate) for length in [1, 4, 13, 40]]
+        check_directed(nodes, "random profiles, zero rate {}".format(zero_rate))
+    here = os.path.dirname(os.path.abspath(__file__))
+    files = sys.argv[1:] or [os.path.join(here, "example", "scDNA.CNV.txt"), os.path.join(here, "example", "scRNA.CNV.txt")]
+    for filename in files:
+        check_directed(read_example(filename), filename)
+
+
+if __name__ == "__main__":
+    main()
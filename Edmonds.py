@@ -21,35 +21,84 @@ class Tree:
 #redo create_tree by chatgpt to use memory better and to print out stats as we go along. 
 
 
-def create_tree(nodes, node_name_list, root):
+def create_tree(nodes, node_name_list, root, engine="auto", threads=1, table=None, max_dist=None):
     """
     Creates a tree-like dictionary of distances between nodes.
-    Pure Python version for Python 2.7:
-    - No NumPy, no psutil
-    - Prints progress and performance stats
+    engine "python" runs the nested dist() loops (pure Python, no NumPy),
+    "numpy" computes all pairs at once with DistanceMatrix.med_matrix and returns them as a
+    DistanceMatrix.MEDGraph (one N x N array read like the dict of dicts),
+    "auto" uses numpy when it is installed.
+    threads > 1 splits the numpy engine over that many processes.
+    table is the ComputeDistance.SegmentTable the nodes were read with; distances are then
+    computed once per distinct pair of chromosome vectors.
+    max_dist drops edges longer than it; the python engine then stops each distance with
+    dist_bounded (table.dist_bounded with a table, which reuses the cached chromosome
+    distances) as soon as it is known to be too long.
+    Prints progress and performance stats.
     """
     print "IN THE RIGHT VERSION"
     print "[INFO] Starting tree creation..."
     start_time = time.time()
 
-    print "[INFO] Computing pairwise distances using nested loops..."
-    sys.stdout.flush()
+    node_name_list = list(node_name_list)
+    if engine == "auto":
+        try:
+            import DistanceMatrix
+            engine = "numpy"
+        except ImportError:
+            engine = "python"
+
     tree_node_dict = {}
     total_nodes = len(node_name_list)
 
-    for i, node in enumerate(node_name_list):
-        if i % 100 == 0 and i > 0:
-            print "[PROGRESS] Processed {} of {} nodes...".format(i, total_nodes)
-            sys.stdout.flush()
-        temp_out_edge = {}
-        for j, other_node in enumerate(node_name_list):
-            if i != j:
-                # Assuming dist() is defined elsewhere
-                temp_out_edge[other_node] = dist(nodes[node], nodes[other_node])
-        tree_node_dict[node] = temp_out_edge
+    if engine == "numpy":
+        from DistanceMatrix import nodes_med_matrix, interned_med_matrix, MEDGraph, NO_EDGE
+        print "[INFO] Computing pairwise distances as one NumPy matrix with {} process(es)...".format(threads)
+        sys.stdout.flush()
+        if table is not None:
+            matrix = interned_med_matrix(table, node_name_list, threads=threads)
+        else:
+            matrix = nodes_med_matrix(nodes, node_name_list, threads=threads)
+        if max_dist is not None:
+            matrix[matrix > max_dist] = NO_EDGE
+        tree_node_dict = MEDGraph(node_name_list, matrix)
+    else:
+        print "[INFO] Computing pairwise distances using nested loops..."
+        if max_dist is not None:
+            extremes = dict((name, profile_extremes(nodes[name])) for name in node_name_list)
+        if threads > 1:
+            print "[INFO] The python engine runs on a single thread."
+        sys.stdout.flush()
+        for i, node in enumerate(node_name_list):
+            if i % 100 == 0 and i > 0:
+                print "[PROGRESS] Processed {} of {} nodes...".format(i, total_nodes)
+                sys.stdout.flush()
+            temp_out_edge = {}
+            for j, other_node in enumerate(node_name_list):
+                if i != j:
+                    if max_dist is not None and table is not None:
+                        d = table.dist_bounded(node, other_node, max_dist, extremes[node], extremes[other_node])
+                        if d <= max_dist:
+                            temp_out_edge[other_node] = d
+                    elif max_dist is not None:
+                        d = dist_bounded(nodes[node], nodes[other_node], max_dist,
+                                         ext1=extremes[node], ext2=extremes[other_node])
+                        if d <= max_dist:
+                            temp_out_edge[other_node] = d
+                    elif table is not None:
+                        temp_out_edge[other_node] = table.dist(node, other_node)
+                    else:
+                        # Assuming dist() is defined elsewhere
+                        temp_out_edge[other_node] = dist(nodes[node], nodes[other_node])
+            tree_node_dict[node] = temp_out_edge
+        if table is not None:
+            table.report()
 
     elapsed_time = time.time() - start_time
-    approx_mem = sys.getsizeof(tree_node_dict)
+    if engine == "numpy":
+        approx_mem = tree_node_dict.matrix.nbytes
+    else:
+        approx_mem = sys.getsizeof(tree_node_dict)
 
     print "[INFO] Tree creation complete."
     print "Execution Time: {:.4f} seconds".format(elapsed_time)
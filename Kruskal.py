@@ -1,96 +1,295 @@
-# Python program for Kruskal's algorithm to find
-# Minimum Spanning Tree of a given connected,
-# undirected and weighted graph
+# Minimum spanning trees for a fast, approximate lineage tree ("--engine mst").
+# Kruskal's algorithm over edge lists with an array-based union-find, and a dense O(V^2)
+# Prim grown from the root over the out-edge rows of a graph. The triage tree is that Prim
+# tree, scored with the directed MED parent -> child, so its weight can be compared with the
+# exact RDMST: the two are equal whenever MED is symmetric, the gap comes from the lost-copy
+# sentinel and missing edges.
 
-from collections import defaultdict
 
+##############################################################################################################################
+# union-find and Kruskal
+##############################################################################################################################
+class UnionFind:
+    """disjoint sets over 0..n-1 in two flat lists, union by rank and path halving (no recursion)"""
+    def __init__(self, n):
+        self.parent = list(range(0, n))
+        self.rank = [0] * n
+
+    def find(self, i):
+        parent = self.parent
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    def union(self, x, y):
+        """join the sets of x and y, False when they already were one"""
+        xroot = self.find(x)
+        yroot = self.find(y)
+        if xroot == yroot:
+            return False
+        # attach the lower-rank tree under the root of the higher-rank one
+        if self.rank[xroot] < self.rank[yroot]:
+            xroot, yroot = yroot, xroot
+        self.parent[yroot] = xroot
+        if self.rank[xroot] == self.rank[yroot]:
+            self.rank[xroot] += 1
+        return True
+
+
+def kruskal(n, src, dst, weight):
+    """edge indices of a minimum spanning forest of the undirected graph src[e] -- dst[e]"""
+    try:
+        import numpy as np
+        order = np.argsort(np.asarray(weight), kind="stable").tolist()
+    except ImportError:
+        order = sorted(range(0, len(weight)), key=weight.__getitem__)
+    sets = UnionFind(n)
+    chosen = []
+    for e in order:
+        if sets.union(src[e], dst[e]):
+            chosen.append(e)
+            if len(chosen) == n - 1:
+                break
+    return chosen
+
+
+def orient(n, root, src, dst, edges):
+    """parent of every node (-1 for root) when the tree edges are hung from root"""
+    adjacent = [[] for v in range(0, n)]
+    for e in edges:
+        adjacent[src[e]].append(dst[e])
+        adjacent[dst[e]].append(src[e])
+    parent = [-1] * n
+    seen = [False] * n
+    seen[root] = True
+    queue = [root]
+    for u in queue:
+        for v in adjacent[u]:
+            if not seen[v]:
+                seen[v] = True
+                parent[v] = u
+                queue.append(v)
+    if len(queue) < n:
+        raise ValueError("{} nodes are not connected to the root".format(n - len(queue)))
+    return parent
 
-# Class to represent a graph
-class Graph:
 
+class Graph:
+    """edge-list graph kept for the original interface, now backed by UnionFind and kruskal()"""
     def __init__(self, vertices):
         self.V = vertices  # No. of vertices
-        self.graph = []  # default dictionary
-        # to store graph
+        self.graph = []  # [u, v, w] edges
 
-    # function to add an edge to graph
     def addEdge(self, u, v, w):
         self.graph.append([u, v, w])
 
-        # A utility function to find set of an element i
-
-    # (uses path compression technique)
     def find(self, parent, i):
-        if parent[i] == i:
-            return i
-        return self.find(parent, parent[i])
+        # iterative, with path compression
+        root = i
+        while parent[root] != root:
+            root = parent[root]
+        while parent[i] != root:
+            parent[i], i = root, parent[i]
+        return root
 
-        # A function that does union of two sets of x and y
-
-    # (uses union by rank)
     def union(self, parent, rank, x, y):
         xroot = self.find(parent, x)
         yroot = self.find(parent, y)
-
-        # Attach smaller rank tree under root of
-        # high rank tree (Union by Rank)
         if rank[xroot] < rank[yroot]:
             parent[xroot] = yroot
         elif rank[xroot] > rank[yroot]:
             parent[yroot] = xroot
-
-            # If ranks are same, then make one as root
-        # and increment its rank by one
         else:
             parent[yroot] = xroot
             rank[xroot] += 1
 
-    # The main function to construct MST using Kruskal's
-    # algorithm
     def KruskalMST(self):
+        """the [u, v, w] edges of a minimum spanning tree"""
+        src = [u for (u, v, w) in self.graph]
+        dst = [v for (u, v, w) in self.graph]
+        weight = [w for (u, v, w) in self.graph]
+        return [self.graph[e] for e in kruskal(self.V, src, dst, weight)]
+
+
+##############################################################################################################################
+# dense Prim over a distance matrix
+##############################################################################################################################
+def prim_rows(n, root, row):
+    """
+    Grows a tree from root over n cells, calling row(u) once per added cell u for the weights of
+    its out-edges (a length-n sequence, negative entries are missing edges): every cell joins
+    through its cheapest edge from a cell already in the tree, ties going to the first cell in
+    the scan. O(V^2) time, O(V) memory besides one row. Returns the parent of every cell (-1
+    for root) as a list. Runs on NumPy when it is installed, with the same choices without it.
+    """
+    try:
+        import numpy as np
+    except ImportError:
+        return _prim_rows_python(n, root, row)
+    big = np.iinfo(np.int64).max
+    rest = np.array([v for v in range(0, n) if v != root], dtype=np.int64)
+    key = np.full(n - 1, big, dtype=np.int64)
+    parent = np.full(n, -1, dtype=np.int64)
+    via = np.full(n - 1, -1, dtype=np.int64)
+    u = root
+    while len(rest):
+        weights = np.asarray(row(u), dtype=np.int64)[rest]
+        weights[weights < 0] = big
+        better = weights < key
+        key[better] = weights[better]
+        via[better] = u
+        i = int(np.argmin(key))
+        if key[i] == big:
+            raise ValueError("{} cells are not connected to the root".format(len(rest)))
+        u = int(rest[i])
+        parent[u] = via[i]
+        # drop the added cell by moving the last one into its place
+        rest[i], key[i], via[i] = rest[-1], key[-1], via[-1]
+        rest, key, via = rest[:-1], key[:-1], via[:-1]
+    return parent.tolist()
+
+
+def _prim_rows_python(n, root, row):
+    big = float('inf')
+    rest = [v for v in range(0, n) if v != root]
+    key = [big] * (n - 1)
+    via = [-1] * (n - 1)
+    parent = [-1] * n
+    u = root
+    while rest:
+        weights = row(u)
+        for (i, v) in enumerate(rest):
+            w = weights[v]
+            if 0 <= w < key[i]:
+                key[i] = w
+                via[i] = u
+        i = min(range(0, len(key)), key=key.__getitem__)
+        if key[i] == big:
+            raise ValueError("{} cells are not connected to the root".format(len(rest)))
+        u = rest[i]
+        parent[u] = via[i]
+        rest[i], key[i], via[i] = rest[-1], key[-1], via[-1]
+        del rest[-1], key[-1], via[-1]
+    return parent
+
+
+def prim_dense(matrix, root, absent=None):
+    """
+    prim_rows over an N x N matrix (in memory or np.memmap), reading one row per added cell.
+    Negative entries and True entries of absent are missing edges.
+    """
+    import numpy as np
+
+    def row(u):
+        weights = np.array(matrix[u], dtype=np.int64)
+        if absent is not None:
+            weights[np.asarray(absent[u])] = -1
+        return weights
+    return prim_rows(matrix.shape[0], root, row)
+
+
+##############################################################################################################################
+# rooted triage tree on the graphs of create_tree
+##############################################################################################################################
+def triage_tree(g, root):
+    """
+    (tree, weight) like compute_rdmst, from a minimum spanning tree grown from root with
+    prim_rows over the directed out-edges, so that a MEDGraph (read row by row from its matrix)
+    and the same graph as a dict of dicts give the same tree. Tree edges carry the directed MED
+    parent -> child, and an edge that is missing or dear in that direction is never used.
+    """
+    if hasattr(g, "matrix"):
+        names = list(g.names)
+        parent = prim_dense(g.matrix, names.index(root), g.absent)
+    else:
+        names = list(g.keys())
+        at = dict((name, i) for (i, name) in enumerate(names))
+
+        def row(u):
+            weights = [-1] * len(names)
+            for (b, w) in g[names[u]].items():
+                weights[at[b]] = w
+            return weights
+        parent = prim_rows(len(names), at[root], row)
+    tree = dict((name, {}) for name in names)
+    total = 0
+    for c in range(0, len(names)):
+        p = parent[c]
+        if p >= 0:
+            tree[names[p]][names[c]] = g[names[p]][names[c]]
+            total += tree[names[p]][names[c]]
+    return tree, total
+
+
+def gap_report(triage_weight, exact_weight):
+    """one line comparing the triage tree with the exact RDMST"""
+    gap = triage_weight - exact_weight
+    share = 100.0 * gap / exact_weight if exact_weight else 0.0
+    return "MST triage tree weight {}, exact RDMST weight {}, gap {} ({:.2f}%)".format(
+        triage_weight, exact_weight, gap, share)
+
+
+##############################################################################################################################
+# self-check: kruskal and prim_dense against each other, one triage tree per graph representation, triage gap, timing
+##############################################################################################################################
+def main():
+    import os
+    import random
+    import time
+    import numpy as np
+    from Arborescence import compute_rdmst_tarjan
+    from ComputeDistance import read_example
+    from DistanceMatrix import profile_matrix, med_columns, MEDGraph
+    random.seed(3)
+    for trial in range(0, 300):
+        n = random.randint(2, 30)
+        D = np.random.randint(0, 20, size=(n, n))
+        D = np.minimum(D, D.T)
+        src, dst, weight = [], [], []
+        for u in range(0, n):
+            for v in range(u + 1, n):
+                src.append(u)
+                dst.append(v)
+                weight.append(int(D[u, v]))
+        want = sum(weight[e] for e in kruskal(n, src, dst, weight))
+        root = random.randrange(n)
+        parent = prim_dense(D, root)
+        assert sum(D[parent[v], v] for v in range(0, n) if v != root) == want
+        assert orient(n, root, src, dst, kruskal(n, src, dst, weight))[root] == -1
+    print("kruskal and prim_dense agree on 300 symmetric graphs")
+    here = os.path.dirname(os.path.abspath(__file__))
+    for name in ("scDNA.CNV.txt", "scRNA.CNV.txt"):
+        path = os.path.join(here, "example", name)
+        if os.path.exists(path):
+            nodes = read_example(path)
+            names = list(nodes.keys())
+            cnv, bounds = profile_matrix(nodes, names)
+            for zero_sentinel in (False, True):
+                g = MEDGraph(names, med_columns(cnv, bounds, zero_sentinel)(np.arange(len(names))))
+                root = names[0]
+                exact = compute_rdmst_tarjan(g, root)[1]
+                absent = np.random.random(g.matrix.shape) < 0.5
+                absent[names.index(root)] = False
+                for graph in (g, MEDGraph(names, g.matrix, absent)):
+                    (tree, weight) = triage_tree(graph, root)
+                    # the same tree from the matrix, from the dict of dicts, and without NumPy
+                    as_dict = dict((a, dict(graph[a].items())) for a in names)
+                    assert triage_tree(as_dict, root) == (tree, weight), (name, zero_sentinel)
+                    at = dict((a, i) for (i, a) in enumerate(names))
+                    rows = lambda u: [as_dict[names[u]].get(b, -1) for b in names]
+                    assert _prim_rows_python(len(names), at[root], rows) == prim_dense(graph.matrix, at[root], graph.absent)
+                    if graph.absent is None:
+                        assert weight >= exact
+                        if not zero_sentinel:
+                            assert weight == exact
+                        print("{} (sentinel {}): {}".format(name, zero_sentinel, gap_report(weight, exact)))
+    for n in (5000, 20000):
+        D = np.random.randint(0, 200, size=(n, n)).astype(np.int16)
+        t0 = time.time()
+        prim_dense(D, 0)
+        print("prim_dense on {} cells: {:.1f}s".format(n, time.time() - t0))
+
 
-        result = []  # This will store the resultant MST
-
-        i = 0  # An index variable, used for sorted edges
-        e = 0  # An index variable, used for result[]
-
-        # Step 1:  Sort all the edges in non-decreasing
-        # order of their
-        # weight.  If we are not allowed to change the
-        # given graph, we can create a copy of graph
-        self.graph = sorted(self.graph, key=lambda item: item[2])
-
-        parent = [];
-        rank = []
-
-        # Create V subsets with single elements
-        for node in range(self.V):
-            parent.append(node)
-            rank.append(0)
-
-            # Number of edges to be taken is equal to V-1
-        while e < self.V - 1:
-
-            # Step 2: Pick the smallest edge and increment
-            # the index for next iteration
-            u, v, w = self.graph[i]
-            i = i + 1
-            x = self.find(parent, u)
-            y = self.find(parent, v)
-
-            # If including this edge does't cause cycle,
-            # include it in result and increment the index
-            # of result for next edge
-            if x != y:
-                e = e + 1
-                result.append([u, v, w])
-                self.union(parent, rank, x, y)
-                # Else discard the edge
-
-        # print the contents of result[] to display the built MST
-        print "Following are the edges in the constructed MST"
-        for u, v, weight in result:
-            # print str(u) + " -- " + str(v) + " == " + str(weight)
-            print ("%d -- %d == %d" % (u, v, weight))
-
-        # Driver code
\ No newline at end of file
+if __name__ == "__main__":
+    main()
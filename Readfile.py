@@ -1,95 +1,308 @@
+import hashlib
+import os
 import time
 import sys
+from array import array
 
-def read(filename):
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# chromosome order of the profiles; chr23 and chr24 are X and Y in some inputs
+CHROMOSOMES = ["chr" + str(ele) for ele in range(1, 23)] + ["chrX", "chrY", "chr23", "chr24"]
+
+
+class CNVMatrix:
     """
-    Reads genomic data from a file and constructs nodes and root.
-    Adds:
-    - Progress messages
-    - Summary stats (execution time, memory usage, node count)
-    - Auto-flush for immediate output
+    Copy numbers of a segmented file as one contiguous cells x segments integer array
+    (a NumPy array, or a flat array.array without NumPy) in CHROMOSOMES order.
+    names[i] is the cell of row i, chromosomes[c] the chromosome of columns bounds[c] = (start, end).
+    ids is the vector_ids() array when it is already known (kept in the sidecar).
     """
+    def __init__(self, names, values, width, bounds, chromosomes, ids=None):
+        self.names = names
+        self.values = values
+        self.width = width
+        self.bounds = bounds
+        self.chromosomes = chromosomes
+        self.ids = ids
 
-    print "[INFO] Starting file read: {}".format(filename)
-    sys.stdout.flush()
-    start_time = time.time()
+    def __len__(self):
+        return len(self.names)
 
-    nodes = {}
-    charlist = []
-    chromosome = []
-    CNV = {}
+    def row(self, i):
+        if np is not None:
+            return self.values[i].tolist()
+        return self.values[i * self.width:(i + 1) * self.width].tolist()
+
+    def profile(self, i):
+        """the per-chromosome lists of cell i, as read() returns them"""
+        row = self.row(i)
+        return [row[a:b] for (a, b) in self.bounds]
+
+    def vector(self, i, c):
+        """copy numbers of cell i on chromosome c"""
+        (a, b) = self.bounds[c]
+        if np is not None:
+            return self.values[i, a:b].tolist()
+        return self.values[i * self.width + a:i * self.width + b].tolist()
+
+    def vector_ids(self):
+        """
+        cells x chromosomes int32 array (NumPy only): entry [i, c] numbers the distinct vectors of
+        chromosome c in order of first appearance, so cells with equal IDs have equal copy numbers
+        """
+        if self.ids is None:
+            ids = np.zeros((len(self.names), len(self.bounds)), dtype=np.int32)
+            for (c, (a, b)) in enumerate(self.bounds):
+                (first, inverse) = np.unique(self.values[:, a:b], axis=0, return_index=True, return_inverse=True)[1:]
+                rank = np.empty(len(first), dtype=np.int32)
+                rank[np.argsort(first)] = np.arange(len(first), dtype=np.int32)
+                ids[:, c] = rank[inverse.reshape(-1)]
+            self.ids = ids
+        return self.ids
+
+    def distinct(self, c):
+        """(first cell of every distinct vector of chromosome c in ID order, the ID of every cell), as lists"""
+        column = np.asarray(self.vector_ids()[:, c])
+        return np.unique(column, return_index=True)[1].tolist(), column.tolist()
 
-    # Chromosome list
-    for ele in range(1, 23):
-        chromosome.append("chr" + str(ele))
-    chromosome.append("chrX")
-    chromosome.append("chrY")
+    def nbytes(self):
+        return len(self.values) * self.width * self.values.itemsize if np is not None else len(self.values) * self.values.itemsize
 
-    # Open file
+    def diploid_rows(self):
+        """rows in which every copy number is 2"""
+        if np is not None:
+            return np.flatnonzero((self.values == 2).all(axis=1)).tolist()
+        width = self.width
+        return [i for i in range(0, len(self.names))
+                if width and self.values[i * width:(i + 1) * width].count(2) == width]
+
+
+def read_matrix(filename):
+    """
+    CNVMatrix of a segmented file (header of chr<N>_<k> segment names, then one line per cell:
+    name and copy numbers). The numbers are parsed in one pass over the whole text, by
+    np.fromstring with NumPy and by map(int) into an array.array without it.
+    """
     data = open(filename)
-    line = next(data)
-    line = line[0:-1].split("\t")
+    header = data.readline().rstrip("\r\n").split("\t")
+    text = data.read()
+    data.close()
 
     segDist = {}
-    k = 0
-    for ele in line:
-        ele = ele.split("_")[0]
-        segDist.setdefault(ele, []).append(k)
-        k += 1
-
-    # Build charlist
-    for ele in chromosome:
-        if segDist.has_key(ele):
+    for (k, ele) in enumerate(header):
+        segDist.setdefault(ele.split("_")[0], []).append(k)
+    charlist = []
+    chromosomes = []
+    for ele in CHROMOSOMES:
+        if ele in segDist:
             charlist.append((min(segDist[ele]), max(segDist[ele]) + 1))
-    if segDist.has_key("chr23"):
-        charlist.append((min(segDist["chr23"]), max(segDist["chr23"]) + 1))
-    if segDist.has_key("chr24"):
-        charlist.append((min(segDist["chr24"]), max(segDist["chr24"]) + 1))
+            chromosomes.append(ele)
 
-    print "[INFO] Chromosome segments processed: {}".format(len(charlist))
-    sys.stdout.flush()
+    names = []
+    bodies = []
+    for line in text.splitlines():
+        fields = line.split(None, 1)
+        if fields:
+            names.append(fields[0])
+            bodies.append(fields[1] if len(fields) > 1 else "")
+    body = "\n".join(bodies)
+    del text, bodies
+    width = len(header)
+    if np is not None:
+        values = np.fromstring(body, dtype=np.int32, sep=" ") if body.strip() else np.zeros(0, dtype=np.int32)
+    else:
+        values = array("l", map(int, body.split()))
+    if len(values) != len(names) * width:
+        raise ValueError("{}: {} copy numbers for {} cells x {} segments".format(
+            filename, len(values), len(names), width))
 
-    # Process data lines
-    line_count = 0
-    for line in data:
-        line_count += 1
-        if line_count % 100 == 0:
-            print "[PROGRESS] Processed {} lines...".format(line_count)
-            sys.stdout.flush()
-
-        array = line.split()
-        name = array.pop(0)
-        snip = []
-        CNVvalue = []
-        for (a, b) in charlist:
-            snip.append(map(int, array[a:b]))
-            CNVvalue.extend(map(int, array[a:b]))
-        nodes[name] = snip
-        CNV[name] = list(set(CNVvalue))
+    # keep the chromosome columns only, in CHROMOSOMES order
+    columns = [k for (a, b) in charlist for k in range(a, b)]
+    bounds = []
+    start = 0
+    for (a, b) in charlist:
+        bounds.append((start, start + b - a))
+        start += b - a
+    if np is not None:
+        values = values.reshape(len(names), width)
+        if columns != list(range(0, width)):
+            values = np.ascontiguousarray(values[:, columns])
+        for dtype in (np.int8, np.int16):
+            if values.size == 0 or (values.min() >= np.iinfo(dtype).min and values.max() <= np.iinfo(dtype).max):
+                values = values.astype(dtype)
+                break
+    elif columns != list(range(0, width)):
+        kept = array("l")
+        for i in range(0, len(names)):
+            for (a, b) in charlist:
+                kept.extend(values[i * width + a:i * width + b])
+        values = kept
+    return CNVMatrix(names, values, len(columns), bounds, chromosomes)
 
-    data.close()
 
-    # Determine root
+def with_root(matrix):
+    """
+    (matrix, root): root is the last diploid cell in dict order of the names (file order
+    under Python 3, as read() always picked it), or a row of 2s appended as cell 'root'.
+    """
+    diploid = set(matrix.names[i] for i in matrix.diploid_rows())
     root = 'NA'
-    for ele in CNV.keys():
-        if CNV[ele] == [2]:
+    for ele in dict.fromkeys(matrix.names).keys():
+        if ele in diploid:
             root = ele
-    if root == "NA":
-        snip = []
-        for (a, b) in charlist:
-            snip.append([2] * (b - a))
-        nodes['root'] = snip
-        root = 'root'
+    if root != 'NA':
+        return matrix, root
+    if np is not None:
+        values = np.vstack([matrix.values, np.full((1, matrix.width), 2, dtype=matrix.values.dtype)])
+    else:
+        values = array(matrix.values.typecode, matrix.values)
+        values.extend([2] * matrix.width)
+    return CNVMatrix(matrix.names + ['root'], values, matrix.width, matrix.bounds, matrix.chromosomes), 'root'
+
+
+##############################################################################################################################
+# binary sidecar of a segmented file parsed by one reader (layout): <file>.<layout>.cnv.npy holds the matrix
+# and <file>.<layout>.cnv.ids.npy its CNVMatrix.vector_ids() (both memory-mapped on reload), <file>.<layout>.cnv.idx
+# the source stamp (size, mtime, SHA-1), root, chromosomes, bounds and cell names
+##############################################################################################################################
+def source_stamp(filename):
+    stat = os.stat(filename)
+    return "{} {!r}".format(stat.st_size, stat.st_mtime)
+
+
+def file_sha1(filename, block=2 ** 20):
+    digest = hashlib.sha1()
+    data = open(filename, "rb")
+    for chunk in iter(lambda: data.read(block), b""):
+        digest.update(chunk)
+    data.close()
+    return digest.hexdigest()
+
+
+def write_sidecar(filename, layout, matrix, root):
+    """writes the sidecar files under temporary names and renames them into place, the index last"""
+    base = "{}.{}.cnv".format(filename, layout)
+    stamp = "{} {}".format(source_stamp(filename), file_sha1(filename))
+    pid = os.getpid()
+    np.save(base + ".npy.{}.npy".format(pid), np.ascontiguousarray(matrix.values))
+    np.save(base + ".ids.npy.{}.npy".format(pid), np.ascontiguousarray(matrix.vector_ids()))
+    lines = ["CNV sidecar 2 {}".format(layout), stamp, root, "\t".join(matrix.chromosomes),
+             "\t".join("{}-{}".format(a, b) for (a, b) in matrix.bounds)] + matrix.names + [""]
+    os.rename(base + ".npy.{}.npy".format(pid), base + ".npy")
+    os.rename(base + ".ids.npy.{}.npy".format(pid), base + ".ids.npy")
+    write_index(base, lines)
+
+
+def write_index(base, lines):
+    """writes the sidecar index lines to a temporary file and renames it over <base>.idx"""
+    temporary = base + ".idx.{}".format(os.getpid())
+    index = open(temporary, "w")
+    index.write("\n".join(lines))
+    index.close()
+    os.rename(temporary, base + ".idx")
+
+
+def load_sidecar(filename, layout):
+    """
+    (matrix, root) from the sidecar of filename, the matrix and its vector IDs memory-mapped read-only,
+    or None when there is no sidecar or it is stale. Size and mtime are checked on every load; the
+    SHA-1 only when they changed, and a sidecar whose source was touched without being changed is
+    restamped (through a renamed temporary file, so a concurrent reader never sees half an index).
+    """
+    base = "{}.{}.cnv".format(filename, layout)
+    if not all(os.path.exists(base + ext) for ext in (".idx", ".npy", ".ids.npy")):
+        return None
+    index = open(base + ".idx")
+    lines = index.read().split("\n")
+    index.close()
+    if len(lines) < 6 or lines[0] != "CNV sidecar 2 {}".format(layout):
+        return None
+    (size, mtime, sha1) = lines[1].split(" ")
+    if "{} {}".format(size, mtime) != source_stamp(filename):
+        if file_sha1(filename) != sha1:
+            return None
+        lines[1] = "{} {}".format(source_stamp(filename), sha1)
+        try:
+            write_index(base, lines)
+        except (IOError, OSError):
+            pass  # read-only folder: the SHA-1 is checked again next time
+    root = lines[2]
+    chromosomes = lines[3].split("\t") if lines[3] else []
+    bounds = [tuple(int(x) for x in ele.split("-")) for ele in lines[4].split("\t")] if lines[4] else []
+    names = lines[5:-1]
+    values = np.load(base + ".npy", mmap_mode="r")
+    ids = np.load(base + ".ids.npy", mmap_mode="r")
+    width = bounds[-1][1] if bounds else 0
+    if values.shape != (len(names), width) or ids.shape != (len(names), len(bounds)):
+        return None
+    return CNVMatrix(names, values, width, bounds, chromosomes, ids), root
+
+
+def cached_matrix(filename, parse, layout, sidecar=True):
+    """
+    (CNVMatrix, root) of filename: reloaded from its sidecar when it is valid, otherwise
+    (matrix, root) = parse(filename) and a new sidecar is written next to the file.
+    Without NumPy, or with sidecar=False for a file that is read only once, parse(filename)
+    is returned as is.
+    """
+    if np is None or not sidecar:
+        return parse(filename)
+    loaded = load_sidecar(filename, layout)
+    if loaded is not None:
+        print("[INFO] Reloaded {} from its binary sidecar".format(filename))
+        return loaded
+    (matrix, root) = parse(filename)
+    try:
+        write_sidecar(filename, layout, matrix, root)
+    except (IOError, OSError) as error:
+        print("[INFO] No binary sidecar written for {}: {}".format(filename, error))
+    return matrix, root
+
+
+def read(filename, table=None, sidecar=True):
+    """
+    Reads genomic data from a file and constructs nodes and root.
+    Adds:
+    - Progress messages
+    - Summary stats (execution time, memory usage, node count)
+    - Auto-flush for immediate output
+    - Optional interning: with a ComputeDistance.SegmentTable, identical chromosome
+      vectors are shared between cells and every cell gets per-chromosome IDs
+    The file is parsed by read_matrix(), or reloaded from its binary sidecar (cached_matrix;
+    sidecar=False parses it without writing one); nodes is the {cell: per-chromosome lists} view of it.
+    """
+
+    print("[INFO] Starting file read: {}".format(filename))
+    sys.stdout.flush()
+    start_time = time.time()
+
+    # root: a cell with copy number 2 everywhere, or an added diploid one
+    (matrix, root) = cached_matrix(filename, lambda path: with_root(read_matrix(path)), "read", sidecar)
+    print("[INFO] Chromosome segments processed: {}".format(len(matrix.bounds)))
+    print("[PROGRESS] Parsed {} lines...".format(len(matrix)))
+    sys.stdout.flush()
+
+    nodes = {}
+    for (i, name) in enumerate(matrix.names):
+        snip = matrix.profile(i)
+        if table is not None:
+            snip = table.intern(name, snip)
+        nodes[name] = snip
 
     elapsed_time = time.time() - start_time
-    approx_mem = sys.getsizeof(nodes)
+    approx_mem = sys.getsizeof(nodes) + matrix.nbytes()
 
     # Summary stats
-    print "[INFO] File read complete."
-    print "Execution Time: {:.4f} seconds".format(elapsed_time)
-    print "Approx Memory Usage: {} bytes".format(approx_mem)
-    print "Total Nodes: {}".format(len(nodes))
-    print "Root Node: {}".format(root)
+    print("[INFO] File read complete.")
+    print("Execution Time: {:.4f} seconds".format(elapsed_time))
+    print("Approx Memory Usage: {} bytes".format(approx_mem))
+    print("Total Nodes: {}".format(len(nodes)))
+    print("Root Node: {}".format(root))
+    if table is not None:
+        print("Distinct vectors per chromosome: {}".format(table.distinct_counts()))
     sys.stdout.flush()
 
     return nodes, root
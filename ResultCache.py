@@ -0,0 +1,228 @@
+##############################################################################################################################
+# Content-addressed cache of tree inference results, shared between runs.
+# An entry is a folder named by result_key(): the SHA-1 of the segmented matrix file, the run
+# settings and the source of the modules that compute distances and trees, together with every
+# local module they import (local_modules()), so editing the distance or solver code invalidates
+# old entries by itself. Entries are written to a temporary folder and renamed into place, and a
+# lookup stamps the folder's mtime, so eviction can drop the least recently used entries until the
+# cache fits in max_bytes.
+##############################################################################################################################
+import hashlib
+import os
+import re
+import shutil
+import sys
+
+
+def file_digest(path, block=2 ** 20):
+    digest = hashlib.sha1()
+    with open(path, "rb") as data:
+        for chunk in iter(lambda: data.read(block), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def module_source(name):
+    """path of the source file of the named module: found on sys.path without importing it, else imported to find it"""
+    module = sys.modules.get(name)
+    if module is None:
+        for folder in sys.path:
+            source = os.path.join(folder or os.curdir, name + ".py")
+            if os.path.isfile(source):
+                return source
+        __import__(name)
+        module = sys.modules[name]
+    source = getattr(module, "__file__", None)
+    if source is not None and source.endswith((".pyc", ".pyo")):
+        source = source[:-1]
+    return source
+
+
+IMPORT = re.compile(r"^\s*(?:from\s+(\w+)\s+import\b|import\s+([\w\s,.]+?)\s*(?:#.*)?$)", re.M)
+
+
+def local_modules(modules):
+    """
+    the named modules and every module they import at any depth (in function bodies too) whose
+    source sits in the folder of one of the named ones. Imports are read from the source text,
+    so modules written for the other Python version are followed without importing them.
+    """
+    sources = dict((name, module_source(name)) for name in modules)
+    folders = set(os.path.dirname(os.path.abspath(source)) for source in sources.values() if source)
+    todo = [name for name in sources if sources[name] is not None]
+    while todo:
+        with open(sources[todo.pop()]) as data:
+            text = data.read()
+        for (single, several) in IMPORT.findall(text):
+            names = [single] if single else [part.split()[0].split(".")[0] for part in several.split(",") if part.strip()]
+            for name in names:
+                if name in sources:
+                    continue
+                for folder in folders:
+                    source = os.path.join(folder, name + ".py")
+                    if os.path.isfile(source):
+                        sources[name] = source
+                        todo.append(name)
+                        break
+    return sorted(sources)
+
+
+def code_version(modules):
+    """digest of the source files of the named modules"""
+    digest = hashlib.sha1()
+    for name in sorted(set(modules)):
+        source = module_source(name)
+        if source is None:
+            continue
+        digest.update(name.encode("ascii"))
+        digest.update(file_digest(source).encode("ascii"))
+    return digest.hexdigest()
+
+
+def result_key(path, settings, modules):
+    """cache key of the results computed from the file at path with settings (a tuple of plain values) by modules"""
+    digest = hashlib.sha1()
+    digest.update(file_digest(path).encode("ascii"))
+    digest.update(repr(tuple(settings)).encode("utf-8"))
+    digest.update(code_version(modules).encode("ascii"))
+    return digest.hexdigest()
+
+
+def folder_size(path):
+    total = 0
+    for (folder, dirs, files) in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(folder, name))
+            except OSError:
+                pass
+    return total
+
+
+class ResultCache:
+    """folder of entries {key}/{file name}, bounded to max_bytes by least recent use"""
+    def __init__(self, directory, max_bytes=20 * 2 ** 30):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def entries(self):
+        return [name for name in os.listdir(self.directory)
+                if not name.startswith(".") and os.path.isdir(os.path.join(self.directory, name))]
+
+    def lookup(self, key):
+        """folder of the entry for key (marked as just used), or None"""
+        entry = os.path.join(self.directory, key)
+        if not os.path.isdir(entry):
+            return None
+        try:
+            os.utime(entry, None)
+        except OSError:
+            return None  # evicted by another run in the meantime
+        return entry
+
+    def fetch(self, key, files):
+        """copies the entry for key out to files ({name in the entry: target path}), False on a miss"""
+        entry = self.lookup(key)
+        if entry is None or not all(os.path.exists(os.path.join(entry, name)) for name in files):
+            return False
+        for name in files:
+            # copies, not links: a memmap reopened for writing in the output folder must not change the entry
+            shutil.copyfile(os.path.join(entry, name), files[name])
+        return True
+
+    def store(self, key, files):
+        """copies files ({name in the entry: source path}) into the entry for key, then evicts down to max_bytes"""
+        entry = os.path.join(self.directory, key)
+        staging = os.path.join(self.directory, ".{}.{}".format(key, os.getpid()))
+        if os.path.isdir(staging):
+            shutil.rmtree(staging)
+        os.makedirs(staging)
+        for name in files:
+            shutil.copyfile(files[name], os.path.join(staging, name))
+        try:
+            os.rename(staging, entry)
+        except OSError:
+            shutil.rmtree(staging)  # another run stored the same entry first
+        self.evict(keep=key)
+        return entry
+
+    def evict(self, keep=None):
+        """removes the least recently used entries (never keep) until the cache fits; returns the removed keys"""
+        used = []
+        for name in self.entries():
+            entry = os.path.join(self.directory, name)
+            try:
+                used.append((os.path.getmtime(entry), name, folder_size(entry)))
+            except OSError:
+                pass
+        total = sum(size for (stamp, name, size) in used)
+        removed = []
+        for (stamp, name, size) in sorted(used):
+            if total <= self.max_bytes:
+                break
+            if name == keep:
+                continue
+            shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
+            total -= size
+            removed.append(name)
+        return removed
+
+
+##############################################################################################################################
+# self-check: keys, followed imports, hits and misses, least-recently-used eviction
+##############################################################################################################################
+def main():
+    import tempfile
+    work = tempfile.mkdtemp()
+    try:
+        paths = []
+        for i in range(0, 4):
+            path = os.path.join(work, "segments{}.csv".format(i))
+            with open(path, "w") as data:
+                data.write("cell\t{}\n".format(i) * 5000)
+            paths.append(path)
+        keys = [result_key(path, ("rdmst", "sp1"), ["ResultCache"]) for path in paths]
+        assert len(set(keys)) == 4
+        assert result_key(paths[0], ("rdmst", "tarjan"), ["ResultCache"]) != keys[0]
+        assert result_key(paths[0], ("rdmst", "sp1"), ["ResultCache"]) == keys[0]
+        # imports are followed through function bodies and other local modules, not into other folders
+        code = os.path.join(work, "code")
+        os.makedirs(code)
+        for (name, text) in (("cachetop", "import os, cachemid as m\n"),
+                             ("cachemid", "def f():\n    from cachelow import g  # lazy\n"),
+                             ("cachelow", "print 'Python 2 only'\nimport ResultCache\n")):
+            with open(os.path.join(code, name + ".py"), "w") as data:
+                data.write(text)
+        sys.path.insert(0, code)
+        try:
+            assert local_modules(["cachetop"]) == ["cachelow", "cachemid", "cachetop"]
+            before = result_key(paths[0], ("rdmst",), local_modules(["cachetop"]))
+            with open(os.path.join(code, "cachelow.py"), "a") as data:
+                data.write("# edited\n")
+            assert result_key(paths[0], ("rdmst",), local_modules(["cachetop"])) != before
+        finally:
+            sys.path.remove(code)
+        size = os.path.getsize(paths[0])
+        cache = ResultCache(os.path.join(work, "cache"), max_bytes=3 * size)
+        out = os.path.join(work, "out")
+        os.makedirs(out)
+        assert not cache.fetch(keys[0], {"segments": os.path.join(out, "segments0.csv")})
+        for (i, key) in enumerate(keys[:3]):
+            cache.store(key, {"segments": paths[i]})
+            os.utime(os.path.join(cache.directory, key), (1000 + i, 1000 + i))
+        # using the oldest entry makes the second one the least recently used
+        assert cache.fetch(keys[0], {"segments": os.path.join(out, "segments0.csv")})
+        assert not cache.fetch(keys[0], {"matrix": os.path.join(out, "med.npy")})
+        assert open(os.path.join(out, "segments0.csv")).read() == open(paths[0]).read()
+        cache.store(keys[3], {"segments": paths[3]})
+        assert sorted(cache.entries()) == sorted([keys[0], keys[2], keys[3]])
+        assert cache.lookup(keys[1]) is None
+        print("result cache: keys, hits and least-recently-used eviction as expected")
+    finally:
+        shutil.rmtree(work)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,8 +5,33 @@ import pandas as pd
 from datetime import datetime as dt_
 from collections import defaultdict
 from SP1_SCT_UTIL import *
+from SparseRDMST import sparse_tree, warm_tree, large_tree
+from Solvers import solve, choose_backend, BACKENDS
+from Kruskal import triage_tree, gap_report
+from ResultCache import ResultCache, result_key, local_modules
+from DistanceMatrix import write_cells
 #from rdmst_solver import compute_rdmst
 
+def tree_solver(options, n_cells):
+    """
+    (backend passed to solve(), threads it runs on) for -E rdmst without -K, resolved before the result
+    cache lookup so that the cache key names the backend that really builds the tree: -M is always
+    solved by large, auto is decided here from the cell count, sp1 hands graphs over its dense limit
+    to large and runs its rounds on the process pool with -T > 1
+    """
+    solver = options.solver
+    if options.memmap and solver not in ("auto", "large"):
+        # the other backends load every edge into Python dicts, the large one streams the memmap's columns
+        print(f"the memory-mapped MED matrix is solved by the large backend instead of {solver}")
+        solver = "large"
+    if solver == "auto":
+        solver, reason = choose_backend(n_cells, n_cells * (n_cells - 1), options.threads, mapped=options.memmap)
+        print(f"auto solver: {solver} ({reason})")
+    if solver == "sp1" and n_cells > get_dense_limit():
+        print(f"{n_cells} cells are over the dense limit of sp1, solving with the large backend")
+        solver = "large"
+    return solver, options.threads if solver in ("sp1", "pool") else 1
+
 def main():
     ### Initialing variables #####################################################################
     ##############################################################################################
@@ -33,11 +58,53 @@ def main():
                   help="""Whether reconstructed permuted tree (T) or not (F). 
                           If not, permuted copy number profile will be used to perform LSA. 
                           Default value is F due to time cost.""")
+    op.add_option("-T", "--threads",dest="threads",type="int",default=1,
+                  help="Number of processes used to compute MED distances and to solve the tree. Default 1.")
+    op.add_option("-K", "--candidates",dest="candidates",type="int",default=0,
+                  help="""Solve the tree on the K cheapest incoming edges of every cell, adding edges until
+                          the tree is proven optimal for the full graph. Default 0 builds the dense graph.""")
+    op.add_option("-M", "--memmap",dest="memmap",action="store_true",default=False,
+                  help="""Write the MED matrix tile by tile to a memory-mapped file in the output folder
+                          instead of RAM; a rerun with the same output folder resumes unfinished tiles.
+                          The tree is then solved by the large backend, streaming the matrix from disk.""")
+    op.add_option("-S", "--solver",dest="solver",type="choice",choices=["auto"]+sorted(BACKENDS),default=None,
+                  help="""Tree solver backend (see Solvers.py), all with the same tree weight: """
+                       + "; ".join(f"{name}: {BACKENDS[name][1]}" for name in sorted(BACKENDS))
+                       + """; auto picks one from the graph size, density and free memory. Default sp1.""")
+    op.add_option("-E", "--engine",dest="engine",type="choice",choices=["rdmst","mst"],default="rdmst",
+                  help="""Tree engine: rdmst (exact minimum arborescence) or mst (minimum spanning tree hung from
+                          the root, a fast approximate lineage for triage of large screens). Default rdmst.""")
+    op.add_option("--gap",dest="gap",action="store_true",default=False,
+                  help="""With -E mst, also solve the exact RDMST and report the weight gap of the triage tree.""")
+    op.add_option("-U", "--update",dest="update",type="str",
+                  help="""Output folder of an earlier -M run on fewer cells of the same sample. Only distances
+                          involving new (or changed) cells are computed and the tree is re-solved starting
+                          from the earlier one; the result has the edges of a full recompute with -S large or -K.
+                          Rejected with any other -S, or with -E mst, whose ties are broken differently.""")
+    op.add_option("--chunk-rows",dest="chunk_rows",type="int",default=0,
+                  help="""Read the input this many rows (genomic regions or genes) at a time: cells are deduplicated by
+                          hashing their columns chunk by chunk and the deduplicated matrix is written the same way,
+                          so memory scales with the chunk instead of the input. The deduplicated matrix stays a
+                          tab-separated text file because SC2_RR_dataTransfer.R reads it with read.csv; the binary
+                          sidecar starts at the segmented matrix SC2 writes. Default 0 reads the whole input.""")
+    op.add_option("--cache",dest="cache",type="str",
+                  help="""Result cache folder shared between runs. When the segmented matrix, the tree options and the
+                          distance and solver code match an earlier run, its MED matrix and tree are copied from the
+                          cache instead of being recomputed. The key names the solver that actually runs (auto resolved,
+                          large with -M, the process count for sp1 and pool). Not used with -U or --gap.""")
+    op.add_option("--cache-gb",dest="cache_gb",type="float",default=20,
+                  help="""Size limit of the --cache folder in GB, least recently used results are removed first. Default 20.""")
 
     (options,args) = op.parse_args()
     # check input parameters. Package path, input file, data type and genome version are required.
     if not options.Path or not options.Input or not options.Datatype or not options.Genome:
         op.print_help() ; sys.exit(1)
+    # -U re-solves with warm_tree, which picks the edges of the large backend among equally light trees
+    if options.update and options.solver not in (None, "large"):
+        op.error(f"-U gives the tree of -S large, it cannot be combined with -S {options.solver}")
+    if options.update and options.engine == "mst":
+        op.error("-U re-solves the exact tree, it cannot be combined with -E mst")
+    if options.solver is None: options.solver = "sp1"
     
     # get the input parameters
     PCKAGE_PATH = options.Path
@@ -55,6 +122,7 @@ def main():
     PCKAGE_PATH = getPath(PCKAGE_PATH).replace("//", "/")
     IN_CNV_PATH = getPath(IN_CNV_PATH).replace("//", "/")
     OUTPUT_PATH = getPath(OUTPUT_PATH).replace("//", "/")
+    UPDATE_PATH = getPath(options.update).replace("//", "/") if options.update else None
     GENPOS_PATH = f"{PCKAGE_PATH}/genomes/gencode_v{REF__GENOME[-2:]}_gene_pos.txt"
     BANDBD_PATH = f"{PCKAGE_PATH}/genomes/{REF__GENOME}.band.bed"
 
@@ -62,7 +130,9 @@ def main():
     DE_DUP_PATH = f"1_{IN_CNV_FILE}_dedup.csv"
     DUPREF_PATH = f"1_{IN_CNV_FILE}_dup_ref.csv"
     SEGCNV_PATH = f"2_{IN_CNV_FILE}_bin_{GENE_BIN_SZ}.csv"
+    MEDMAT_PATH = f"2_{IN_CNV_FILE}_bin_{GENE_BIN_SZ}.med.npy"
     SCTREE_PATH = f"3_CNV.tree.txt"
+    LSASEG_PATH = f"2_{IN_CNV_FILE}_bin_{GENE_BIN_SZ}.all_cells.csv"  # segmented data with the duplicates, for LSA
     os.system("mkdir -p " + OUTPUT_PATH)
 
     
@@ -78,36 +148,35 @@ def main():
     os.chdir(OUTPUT_PATH)
     print(f"All intermediate files and output files will be stored in {OUTPUT_PATH}")
     print("reading data")
-    df_ori = pd.read_csv(IN_CNV_PATH, sep="\t", index_col=0)
-    df_ori.columns = df_ori.columns.str.replace("[\ \-\.]", "_", regex=True)
-
-    # deduplication
-    cel_dup = df_ori.T.duplicated(keep="first")
-    cel_uni = cel_dup[~cel_dup].index.tolist()  # unique cell list
-    cel_dup = cel_dup[ cel_dup].index.tolist()  # duplicated cell list
-    # find duplication relationship
-    print("running deduplication")
-    dup_relationship = {"par_cell":[], "dup_cell":[]}
-    for dup_cell in cel_dup:
-        for uni_cell in cel_uni:
-            if df_ori[uni_cell].equals(df_ori[dup_cell]):  # find cells of origin
-                dup_relationship["par_cell"].append(uni_cell)
-                dup_relationship["dup_cell"].append(dup_cell)
-                break
+    if options.chunk_rows > 0:
+        # streamed: per-cell hashes over row chunks, the dedup-data is written chunk by chunk
+        print(f"running deduplication, {options.chunk_rows} rows at a time")
+        n_cells, cel_uni, dup_relationship = stream_dedup(IN_CNV_PATH, DE_DUP_PATH, options.chunk_rows)
+    else:
+        df_ori = pd.read_csv(IN_CNV_PATH, sep="\t", index_col=0)
+        df_ori.columns = clean_cell_names(df_ori.columns)
+
+        # deduplication: cells grouped by a hash of their profile, the first cell of a group is its representative
+        print("running deduplication")
+        cel_uni, dup_relationship = dedup_cells(df_ori)
+        n_cells = df_ori.shape[1]
     cell_dup_ref = pd.DataFrame(dup_relationship)
     if cell_dup_ref.shape[0]>0:
         # save duplication information
-        df_ded = df_ori.loc[:,cel_uni]
-        #df_ded = df_ded.iloc[:,np.random.choice(range(df_ded.shape[1]), size=min(df_ded.shape[1], 100), replace=False)]
-        print(f"""{df_ded.shape[1]}/{df_ori.shape[1]} cells remained after deduplication.
+        if options.chunk_rows == 0:
+            df_ded = df_ori.loc[:,cel_uni]
+            #df_ded = df_ded.iloc[:,np.random.choice(range(df_ded.shape[1]), size=min(df_ded.shape[1], 100), replace=False)]
+            df_ded.to_csv(DE_DUP_PATH, sep="\t")
+        print(f"""{len(cel_uni)}/{n_cells} cells remained after deduplication.
                         duplication relationship is stored in {DUPREF_PATH} and 
                         dedup-data saved in {DE_DUP_PATH}, which will be used in the following analysis""")
-        df_ded.to_csv(DE_DUP_PATH, sep="\t")
         cell_dup_ref.to_csv(DUPREF_PATH, sep="\t")
+        cell_cnt = multiplicity(cel_uni, dup_relationship)
+        print(f"the tree is inferred on {len(cel_uni)} representative cells (up to {max(cell_cnt.values())} cells each), "
+              f"duplicates are re-attached to them at distance 0")
     else:
         print("no duplicating cells found, good!")
         DE_DUP_PATH = IN_CNV_PATH
-        df_ded = df_ori
     
     print(f"converting CN profile to segmental CN level:\n")
     command = f"Rscript {PCKAGE_PATH}/SC2_RR_dataTransfer.R {OUTPUT_PATH} {DE_DUP_PATH} {NUCLEC_ACID} {SEGCNV_PATH}"                                # input DNA
@@ -118,24 +187,79 @@ def main():
     ### reformed segmental data will be used to infer MEDLAT single cell tree                  ###
     ### where a diploid cell will be used as the root (imputed if not existing)                ###
     ##############################################################################################
-    nodes, root = read_CNV(SEGCNV_PATH)
-    node_list  = nodes.keys()
-
     #calculation of MED distance
     print("\n#####################################################")
     print("### going back to SC1_py_sctree.py                ###")
     print("#####################################################\n")
-    print("initializing tree")
-    #tree_dict = create_tree(nodes, node_list, root, df_cor=None, len_threshold=30)  
-    tree_dict = create_tree(nodes, node_list, root, proximity=True, len_threshold=30, df_cor=None)
-    # set df_cor to None and leave proximity to True if no spatial coordinate information is provided
-    # this will automatically calculate pairwise MED instead of only connecting cells within close proximity
-    
-    print("computing rdmst")
-    #tree = compute_rdmst(tree_dict, root)[0]
-    
-    # New call with dynamic chunking and memory safety:
-    tree, weight = compute_rdmst(g=tree_dict,root=root,recursive=False, parallel=True, max_workers=8)
+    seg_table  = SegmentTable(chrom_dist=distcalc)  # interns identical chromosome vectors
+    nodes, root = read_CNV(SEGCNV_PATH, seg_table)
+    node_list  = nodes.keys()
+    if UPDATE_PATH:
+        route = ("update",)  # never cached
+    elif options.engine == "mst":
+        route = ("mst",)
+    elif options.candidates > 0:
+        route = ("candidates", options.candidates)
+    else:
+        solver, threads = tree_solver(options, len(nodes))
+        route = ("rdmst", solver, threads)
+
+    # results are cached by the content of the segmented matrix, the tree that is built and the code that computes them
+    cache = cache_key = None
+    if options.cache and options.gap:
+        print("--gap solves the exact tree to compare with, the result cache is not used")
+    elif options.cache and not UPDATE_PATH:
+        cache = ResultCache(getPath(options.cache), max_bytes=int(options.cache_gb * 2 ** 30))
+        modules = ["SP1_SCT_UTIL", "DistanceMatrix", "ComputeDistance", "SparseRDMST", "Kruskal", "Solvers"]
+        if route[0] == "rdmst":
+            modules += [module for module in BACKENDS[solver][2] if module != "numpy"]
+        settings = route + (tuple(dup_relationship["par_cell"]), tuple(dup_relationship["dup_cell"]))
+        cache_key = result_key(SEGCNV_PATH, settings, local_modules(modules))
+    cached = cache is not None and cache.fetch(cache_key, {"tree": SCTREE_PATH})
+    tree_dict = None
+    if cached:
+        print(f"found in the result cache {cache.directory}: {cache_key}, skipping MED and tree inference")
+        cache.fetch(cache_key, {"med": MEDMAT_PATH, "med.cells": MEDMAT_PATH + ".cells"})
+        tree = read_tree(SCTREE_PATH)
+    elif UPDATE_PATH:
+        previous_matrix = [f for f in os.listdir(UPDATE_PATH) if f.endswith(".med.npy")]
+        if len(previous_matrix) != 1:
+            print(f"expected one .med.npy matrix in {UPDATE_PATH}, found {len(previous_matrix)}") ; sys.exit(1)
+        print("extending the previous distance matrix")
+        tree_dict = create_tree(nodes, node_list, root, proximity=True, len_threshold=30, df_cor=None, table=seg_table,
+                                matrix_path=MEDMAT_PATH, previous_matrix=f"{UPDATE_PATH}/{previous_matrix[0]}")
+        print("computing rdmst from the previous tree")
+        previous_tree = read_tree(f"{UPDATE_PATH}/{SCTREE_PATH}")
+        tree, weight = warm_tree(tree_dict.matrix, tree_dict.names, root, previous_tree, k=options.candidates or 8)
+    elif options.engine == "mst":
+        print("initializing tree")
+        tree_dict = create_tree(nodes, node_list, root, proximity=True, len_threshold=30, df_cor=None, threads=options.threads, table=seg_table,
+                                matrix_path=MEDMAT_PATH if options.memmap else None)
+        print("computing the MST triage tree")
+        tree, weight = triage_tree(tree_dict, root)
+        if options.gap:
+            print(gap_report(weight, large_tree(tree_dict, root, verbose=False)[1]))
+    elif options.candidates > 0:
+        print(f"computing rdmst on the {options.candidates} cheapest incoming edges per cell")
+        tree, weight = sparse_tree(nodes, root, k=options.candidates)
+    else:
+        print("initializing tree")
+        #tree_dict = create_tree(nodes, node_list, root, df_cor=None, len_threshold=30)  
+        tree_dict = create_tree(nodes, node_list, root, proximity=True, len_threshold=30, df_cor=None, threads=options.threads, table=seg_table,
+                                matrix_path=MEDMAT_PATH if options.memmap else None)
+        # set df_cor to None and leave proximity to True if no spatial coordinate information is provided
+        # this will automatically calculate pairwise MED instead of only connecting cells within close proximity
+        
+        print("computing rdmst")
+        #tree = compute_rdmst(tree_dict, root)[0]
+        tree, weight = solve(tree_dict, root, solver, threads=threads)
+
+    if dup_relationship["dup_cell"]:
+        attached = attach_duplicates(tree, dup_relationship)
+        expand_segments(SEGCNV_PATH, LSASEG_PATH, dup_relationship)
+        print(f"{attached} duplicated cells attached to the tree, segmental CN of all cells saved to {LSASEG_PATH}")
+    else:
+        LSASEG_PATH = SEGCNV_PATH
 
     with open(SCTREE_PATH,'w') as write:
         write.write("\t".join(["stt", "end", "len"])+"\n") # header line
@@ -143,6 +267,15 @@ def main():
             for ot_node in tree[in_node].keys():
                 write.write("\t".join([in_node, ot_node, str(tree[in_node][ot_node])])+"\n")
     print(f"MEDALT inferrence finish, weighted tree saved to:{SCTREE_PATH}")
+    if cache is not None and not cached:
+        stored = {"tree": SCTREE_PATH}
+        if isinstance(tree_dict, MEDGraph):
+            if not options.memmap:
+                np.save(MEDMAT_PATH, tree_dict.matrix)
+                write_cells(MEDMAT_PATH, tree_dict.names, *profile_matrix(nodes, tree_dict.names), False)
+            stored.update({"med": MEDMAT_PATH, "med.cells": MEDMAT_PATH + ".cells"})
+        cache.store(cache_key, stored)
+        print(f"tree and MED matrix stored in the result cache {cache.directory}: {cache_key}")
 
     #Permutation process for lineage speciation analysis (LSA)
     ### LSA test #################################################################################
@@ -159,38 +292,34 @@ def main():
         #permute copy number profile
         step_3_cmd = f"Rscript {PCKAGE_PATH}/SC3_RR_Permutation.R {SCTREE_PATH} "
         step_3_cmd = step_3_cmd + f"{IN_CNV_PATH} {NUCLEC_ACID} {OUTPUT_PATH}/permutation"
-        if datatype == "D":
+        if NUCLEC_ACID == "D":
             os.system(step_3_cmd)
-        elif datatype == "R":
+        elif NUCLEC_ACID == "R":
             os.system(step_3_cmd + " "+ GENE_BIN_SZ + " " + REF__GENOME)
 
         #Infer permutation tree
         for j in range(1,101):
-            permutefile=permutationPath+"/permute."+str(j)+".CNV.txt"
-            (nodes,root) = read(permutefile)
+            permutefile=PERMUT_PATH+"/permute."+str(j)+".CNV.txt"
+            table = SegmentTable(chrom_dist=distcalc)
+            (nodes,root) = read_CNV(permutefile, table, sidecar=False)  # read once, no sidecar
             node_name_list = nodes.keys()
             #g = create_tree(nodes, node_name_list,root)
-            g = create_tree(nodes, node_name_list, root, proximity=True, len_threshold=30, df_cor=None)
+            g = create_tree(nodes, node_name_list, root, proximity=True, len_threshold=30, df_cor=None, threads=options.threads, table=table)
             #result = compute_rdmst(g, root)
-            tree, weight = compute_rdmst(g=tree_dict,root=root,recursive=False, parallel=True, max_workers=8)
-            result = tree
+            result = solve(g, root, options.solver, threads=options.threads)
             permuteTree=permutefile+".celltree.txt"
-            write=open(permuteTree,'w')
             tree=result[0]
-            out1="from"+"\t"+"to"+"\t"+"dist"
-            write.write(out1)
-            for ele in tree.keys():
-                out=ele
-                for value in tree[ele].keys():
-                    out1=out+"\t"+value+"\t"+str(tree[ele][value])
-                    print >> write,out1
-            write.close()
+            with open(permuteTree,'w') as write:
+                write.write("\t".join(["from", "to", "dist"])+"\n") # header line
+                for ele in tree.keys():
+                    for value in tree[ele].keys():
+                        write.write("\t".join([ele, value, str(tree[ele][value])])+"\n")
         print("Pemutation tree finish.")
     elif permutation == "F": PERMUT_PATH = ""
 
     #Identifying CNAs associated with cellular lineage expansion.
     print("Performing LSA.")
-    cmd = f"Rscript {PCKAGE_PATH}/SC4_RR_LSA_tree.R {PCKAGE_PATH} {IN_CNV_PATH} {OUTPUT_PATH} {SCTREE_PATH} {SEGCNV_PATH} {NUCLEC_ACID} {REF__GENOME} {PERMUT_PATH}"
+    cmd = f"Rscript {PCKAGE_PATH}/SC4_RR_LSA_tree.R {PCKAGE_PATH} {IN_CNV_PATH} {OUTPUT_PATH} {SCTREE_PATH} {LSASEG_PATH} {NUCLEC_ACID} {REF__GENOME} {PERMUT_PATH}"
     print(cmd)
     os.system(cmd)
     print("All is done!")
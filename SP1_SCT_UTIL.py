@@ -4,6 +4,7 @@ from collections import *
 import psutil
 
 import copy
+import hashlib
 import pickle
 import os,sys
 import subprocess
@@ -17,37 +18,48 @@ import gc
 import tracemalloc
 import psutil
 from datetime import datetime as dt_
-from concurrent.futures import ThreadPoolExecutor
+from DistanceMatrix import nodes_med_matrix, interned_med_matrix, med_matrix_memmap, extend_med_matrix, profile_matrix, MEDGraph, CNVProfiles, small_ints
+from Readfile import CNVMatrix, with_root, cached_matrix
+from ComputeDistance import SegmentTable
+from mdmst_copilot_rewrite3 import rdmst_helper_inplace, IDView
+from SparseRDMST import large_tree
+from ParallelRDMST import rdmst_pool
 
 
 ##############################################################################################################################
 # Returns a dictionary mapping node names to list of list of integers representing list of copy number list
 ##############################################################################################################################
-def read_CNV(in_seg_path):
+# with a SegmentTable (built with chrom_dist=distcalc), identical chromosome vectors are interned to shared IDs
+def parse_CNV(in_seg_path):
     df = pd.read_csv(in_seg_path, sep="\t")  # read data
     
     chr_scan = [f"chr{i}" for i in range(1,25)] + ["chrX", "chrY"]  # def candidate chrs
     chr_exis = df.columns.str.replace("_.*$", "", regex=True)       # find existing chrs
-    chr_locs={}
+    chr_blks = []  # one (cells x segments) block per chr
+    chr_bnds = []  # its (start, end) columns in the stacked array
+    chr_name = []
     for chr_i in chr_scan:
-        chr_segs = sum(chr_exis==chr_i)         # chr seg number
-        if chr_segs>0: chr_locs[chr_i]=chr_segs # attach it to the dict
-    cell_lst = list(df.index)                   # cell ids
-    node_dic = {i:[]    for i in cell_lst}      # to store node info
-    cnvs_dic = {i:set() for i in cell_lst}      # to keep track of CNs
-    for chr_i in chr_locs:
-        seg_i = chr_exis==chr_i
-        for cel_j in cell_lst: 
-            node_dic[cel_j] = node_dic[cel_j] +[list(df.loc[cel_j, seg_i])]# concat chr bin CNs and append
-            cnvs_dic[cel_j] = cnvs_dic[cel_j] |  set(df.loc[cel_j, seg_i]) # keep track of CNV in each cell
-    
-    root = False
-    for cel_j in cell_lst:
-        if cnvs_dic[cel_j]=={2}: root = cel_j
-    if not root:
-        print(f"No diploid found, inputating a root cell.")
-        root='root'
-        node_dic[root] = [[2]*chr_locs[i] for i in chr_locs.keys()]
+        seg_i = np.flatnonzero(chr_exis==chr_i)
+        if len(seg_i)>0:
+            start = chr_bnds[-1][1] if chr_bnds else 0
+            chr_bnds.append((start, start+len(seg_i)))
+            chr_blks.append(df.iloc[:, seg_i].to_numpy())
+            chr_name.append(chr_i)
+    cell_lst = [str(cel_j) for cel_j in df.index]  # cell ids
+    cnv = np.hstack(chr_blks) if chr_blks else np.zeros((len(cell_lst), 0), dtype=np.int64)
+    matrix, root = with_root(CNVMatrix(cell_lst, small_ints(cnv), cnv.shape[1], chr_bnds, chr_name))
+    if len(matrix) > len(cell_lst): print(f"No diploid found, inputating a root cell.")
+    return matrix, root
+
+
+# the parsed matrix and its vector IDs are kept in a binary sidecar next to in_seg_path (Readfile.cached_matrix),
+# reruns memory-map them and intern one cell per distinct chromosome vector; sidecar=False for files read only once
+def read_CNV(in_seg_path, table=None, sidecar=True):
+    matrix, root = cached_matrix(in_seg_path, parse_CNV, "read_CNV", sidecar)
+    node_dic = CNVProfiles(matrix.names, matrix.values, matrix.bounds)
+    if table is not None:
+        table.intern_matrix(matrix)  # one lookup per distinct vector, the IDs come with the sidecar
+        print(f"distinct vectors per chromosome: {table.distinct_counts()}")
     return node_dic, root
 
 ##############################################################################################################################
@@ -68,6 +80,110 @@ def getPath(path):
     return "/".join(abs_path)
 
 
+##############################################################################################################################
+# cell deduplication of the input matrix (genomic regions or genes x cells), whole or streamed in row chunks
+##############################################################################################################################
+def clean_cell_names(columns):
+    return pd.Index(columns).str.replace(r"[ \-.]", "_", regex=True)
+
+
+def group_digests(cells, digests):
+    """
+    (columns of the unique cells, {"par_cell": [...], "dup_cell": [...]}) from one SHA-1 per cell:
+    every cell whose digest was seen before is a duplicate of the first cell with that digest
+    """
+    first = {}
+    keep = []  # columns of the unique cells
+    dup_relationship = {"par_cell":[], "dup_cell":[]}
+    for j, digest in enumerate(digests):
+        key = digest.digest()
+        if key in first:
+            dup_relationship["par_cell"].append(cells[first[key]])
+            dup_relationship["dup_cell"].append(cells[j])
+        else:
+            first[key] = j
+            keep.append(j)
+    return keep, dup_relationship
+
+
+def dedup_cells(df):
+    """
+    Hash-grouped deduplication of the cells (columns) of df in one pass: each column is hashed
+    once as float64, the same digests stream_dedup builds chunk by chunk.
+    Returns (unique cells, {"par_cell": [...], "dup_cell": [...]}).
+    """
+    cells = list(df.columns)
+    digests = [hashlib.sha1(np.ascontiguousarray(df.iloc[:, j].to_numpy(dtype=np.float64)).tobytes())
+               for j in range(len(cells))]
+    keep, dup_relationship = group_digests(cells, digests)
+    return [cells[j] for j in keep], dup_relationship
+
+
+def multiplicity(cells, dup_relationship):
+    """{cell: number of input cells it stands for} over the unique cells"""
+    count = dict((cel_j, 1) for cel_j in cells)
+    for par_cell in dup_relationship["par_cell"]: count[par_cell] += 1
+    return count
+
+
+def attach_duplicates(tree, dup_relationship):
+    """
+    re-attaches every duplicate as a zero-distance child of its representative; duplicates
+    share every MED of the representative, so the tree stays a minimum one over all cells.
+    Representatives missing from the tree are skipped. Returns the number of attached cells.
+    """
+    in_tree = set(tree.keys()) | set(child for parent in tree for child in tree[parent])
+    attached = 0
+    for par_cell, dup_cell in zip(dup_relationship["par_cell"], dup_relationship["dup_cell"]):
+        if par_cell in in_tree:
+            tree.setdefault(par_cell, {})[dup_cell] = 0
+            attached += 1
+    return attached
+
+
+def expand_segments(seg_path, out_path, dup_relationship):
+    """copy of the segmented file at seg_path with a line for every duplicate, repeating its representative's line"""
+    dups = defaultdict(list)
+    for par_cell, dup_cell in zip(dup_relationship["par_cell"], dup_relationship["dup_cell"]):
+        dups[par_cell].append(dup_cell)
+    with open(seg_path) as seg_file, open(out_path, "w") as out_file:
+        out_file.write(next(seg_file))
+        extra = []
+        for line in seg_file:
+            if not line.endswith("\n"): line += "\n"
+            out_file.write(line)
+            name, rest = line.split("\t", 1)
+            extra.extend(dup_cell + "\t" + rest for dup_cell in dups.get(name, []))
+        out_file.write("".join(extra))
+
+
+def stream_dedup(in_cnv_path, out_path, chunk_rows=1000):
+    """
+    Cells of the input that duplicate an earlier cell, found without loading the matrix:
+    pass 1 reads chunk_rows rows at a time and feeds every cell column to its own SHA-1,
+    pass 2 (only when there are duplicates) copies the unique cells to out_path chunk by chunk, as
+    tab-separated text: SC2_RR_dataTransfer.R reads it with read.csv.
+    Memory scales with chunk_rows x cells. Returns (number of cells, unique cells,
+    {"par_cell": [...], "dup_cell": [...]}) like the in-memory deduplication.
+    """
+    cells = None
+    for chunk in pd.read_csv(in_cnv_path, sep="\t", index_col=0, chunksize=chunk_rows):
+        if cells is None:
+            cells = list(clean_cell_names(chunk.columns))
+            digests = [hashlib.sha1() for cel_j in cells]
+        block = np.ascontiguousarray(chunk.to_numpy(dtype=np.float64).T)  # one row per cell
+        for j, digest in enumerate(digests): digest.update(block[j].tobytes())
+    keep, dup_relationship = group_digests(cells, digests)
+    cel_uni = [cells[j] for j in keep]
+    if dup_relationship["dup_cell"]:
+        header = True
+        for chunk in pd.read_csv(in_cnv_path, sep="\t", index_col=0, chunksize=chunk_rows):
+            chunk.columns = cells
+            chunk.iloc[:, keep].to_csv(out_path, sep="\t", mode="w" if header else "a", header=header)
+            header = False
+    return len(cells), cel_uni, dup_relationship
+
+
 ##############################################################################################################################
 
 ##############################################################################################################################
@@ -88,7 +204,10 @@ def getPath(path):
 ##############################################################################################################################
 
 #chatgpt copilot - rewrite to help with memory issues
-def create_tree(nodes, node_list, root, proximity=True, len_threshold=30, df_cor=None):
+# engine="numpy" computes every MED up front with DistanceMatrix (over `threads` processes); engine="python" calls dist() per pair
+# table: the SegmentTable used by read_CNV, distances then go through its per-chromosome cache
+def create_tree(nodes, node_list, root, proximity=True, len_threshold=30, df_cor=None, engine="numpy", threads=1, table=None, matrix_path=None, previous_matrix=None):
+    node_list = list(node_list)
     print("{:4d} cells to run.".format(len(node_list)), end="")
     blk = 5
     sep = max(5, len(node_list) // blk)
@@ -102,53 +221,100 @@ def create_tree(nodes, node_list, root, proximity=True, len_threshold=30, df_cor
     if df_cor is not None:
         coords_map = {n: (df_cor.loc[n, "coor_x"], df_cor.loc[n, "coor_y"]) for n in node_list}
 
+    # dist() here ignores zero states, so MED is symmetric and one entry serves both directions
     def get_distance(a, b):
         key = tuple(sorted((a, b)))
         if key not in distance_cache:
             distance_cache[key] = dist(nodes[a], nodes[b])
         return distance_cache[key]
 
-    for idx, A_node in enumerate(node_list, 1):
-        pct = min(1, idx / len(node_list))
-        ext = 1 / pct - 1
-        nwl = "\n" if (idx - 1) % sep == 0 else "\r"
+    if engine == "python" and table is not None:
+        def get_distance(a, b):
+            return table.dist(a, b)
+
+    # the numpy engine returns the whole matrix as a MEDGraph instead of a dict of dicts;
+    # with matrix_path the matrix is an on-disk memmap filled tile by tile and resumed after a crash,
+    # with previous_matrix as well only the pairs involving cells new since that run are computed
+    def report_tiles(done, total):
+        pct = done / total
+        nwl = "\n" if done == total or (done - 1) % max(1, total // blk) == 0 else "\r"
         dtt = dt_.now() - tp0
-        rmt = str(dtt * ext)[2:-5]
-        dtt = str(dtt)[2:-5]
-        print("{} iter {:4d}, {:5.1f}% , elapse {}, expected in {}".format(
-            nwl, idx, pct * 100, dtt, rmt), end="")
-
-        out_edge = {}
-        for B_node in node_list:
-            if B_node == A_node:
-                continue
-
-            # Proximity check
-            if df_cor is not None:
-                ax, ay = coords_map[A_node]
-                bx, by = coords_map[B_node]
-                physical_dist = (ax - bx) ** 2 + (ay - by) ** 2
-                prox = physical_dist < len_threshold ** 2
+        print("{} tile {:5d} of {:5d}, {:5.1f}% , elapse {}".format(
+            nwl, done, total, pct * 100, str(dtt)[2:-5]), end="")
+
+    if engine == "numpy":
+        if matrix_path is not None:
+            cnv, bounds = profile_matrix(nodes, node_list)
+            if previous_matrix is not None:
+                med, reused = extend_med_matrix(previous_matrix, cnv, bounds, node_list, matrix_path,
+                                                zero_sentinel=False, progress=report_tiles)
+                print("\n{} of {} cells reused from {}".format(reused, len(node_list), previous_matrix))
             else:
-                prox = proximity
+                med = med_matrix_memmap(cnv, bounds, matrix_path, zero_sentinel=False,
+                                        progress=report_tiles, names=node_list)
+        elif table is not None:
+            med = interned_med_matrix(table, node_list, zero_sentinel=False, threads=threads)
+        else:
+            med = nodes_med_matrix(nodes, node_list, zero_sentinel=False, threads=threads)
+        absent = None
+        if df_cor is not None:
+            xy = df_cor.loc[node_list, ["coor_x", "coor_y"]].to_numpy(dtype=float)
+            physical_dist = ((xy[:, None, :] - xy[None, :, :]) ** 2).sum(axis=2)
+            absent = physical_dist >= len_threshold ** 2
+        elif not proximity:
+            absent = np.ones((len(node_list), len(node_list)), dtype=bool)
+        tree_node_dict = MEDGraph(node_list, med, absent)
+        print("\ntotal tree initiation time: {}, {} edges, {:.1f} MB matrix".format(
+            dt_.now() - tp0, tree_node_dict.edge_count(), med.nbytes / 2 ** 20))
+    else:
+        for idx, A_node in enumerate(node_list, 1):
+            pct = min(1, idx / len(node_list))
+            ext = 1 / pct - 1
+            nwl = "\n" if (idx - 1) % sep == 0 else "\r"
+            dtt = dt_.now() - tp0
+            rmt = str(dtt * ext)[2:-5]
+            dtt = str(dtt)[2:-5]
+            print("{} iter {:4d}, {:5.1f}% , elapse {}, expected in {}".format(
+                nwl, idx, pct * 100, dtt, rmt), end="")
+
+            out_edge = {}
+            for B_node in node_list:
+                if B_node == A_node:
+                    continue
+
+                # Proximity check
+                if df_cor is not None:
+                    ax, ay = coords_map[A_node]
+                    bx, by = coords_map[B_node]
+                    physical_dist = (ax - bx) ** 2 + (ay - by) ** 2
+                    prox = physical_dist < len_threshold ** 2
+                else:
+                    prox = proximity
 
-            if prox:
-                # Use cached distance
-                out_edge[B_node] = get_distance(A_node, B_node)
+                if prox:
+                    # Use cached distance
+                    out_edge[B_node] = get_distance(A_node, B_node)
 
-        if out_edge:
-            tree_node_dict[A_node] = out_edge
+            if out_edge:
+                tree_node_dict[A_node] = out_edge
 
-    print("\ntotal tree initiation time: {}".format(dt_.now() - tp0))
+        print("\ntotal tree initiation time: {}".format(dt_.now() - tp0))
+        if table is not None: table.report()
 
     # Sanity check
     if root not in tree_node_dict:
         print("the root node: {}, not found in the graph".format(root))
 
-    distances = graph_rank_dist(tree_node_dict, root)
-    for node in tree_node_dict:
-        if distances[node] == float('inf'):
-            print("node {} not connected to the root, please check it.".format(node))
+    if isinstance(tree_node_dict, MEDGraph):
+        # a vectorised search over the matrix instead of a Python BFS over every edge
+        if root in tree_node_dict:
+            for j in np.flatnonzero(~tree_node_dict.reachable(root)).tolist():
+                print("node {} not connected to the root, please check it.".format(node_list[j]))
+    else:
+        distances = graph_rank_dist(tree_node_dict, root)
+        for node in tree_node_dict:
+            if distances[node] == float('inf'):
+                print("node {} not connected to the root, please check it.".format(node))
 
     return tree_node_dict
 
@@ -191,7 +357,10 @@ def create_tree(nodes, node_list, root, proximity=True, len_threshold=30, df_cor
 ##############################################################################################################################
 
 ##############################################################################################################################
-def matrixbuilder(node):
+def matrixbuilder(node, engine="python"):
+    if engine == "numpy":
+        names = list(node.keys())
+        return names, nodes_med_matrix(node, names, zero_sentinel=False).tolist()
     matrix = []
     for node1 in node:
         temp = []
@@ -216,24 +385,14 @@ def dist(node1, node2, d=0):
 
 ##############################################################################################################################
 def distcalc(node1, node2):
+    # closed form of the peel-off loop: half the total variation of the zero-padded CN difference
     assert len(node1) == len(node2)
-    d = 0
-    diff = copy.deepcopy(node1) ##########################
-    for i in range(0, len(node2)):
-        diff[i] = diff[i] - node2[i]
-    while diff:
-        if   diff[0] == 0: diff.pop(0)
-        elif diff[0] >  0:
-            for i in range(0, len(diff)):
-                if diff[i] > 0: diff[i] = diff[i] - 1
-                else: break
-            d = d+1
-        elif diff[0] <  0:
-            for i in range(0, len(diff)):
-                if diff[i] < 0: diff[i] = diff[i] + 1
-                else: break
-            d = d+1
-    return d
+    d = 0 ; prev = 0
+    for i in range(0, len(node1)):
+        diff = node1[i] - node2[i]
+        d = d + abs(diff - prev)
+        prev = diff
+    return int((d + abs(prev)) // 2)
 
 
 
@@ -259,6 +418,17 @@ def graph_rank_dist(g, startnode):
 
 
 
+def read_tree(tree_path):
+    """{parent: {child: MED}} from a tree file written by SC1_py_sctree.py (stt, end, len)"""
+    tree = defaultdict(dict)
+    with open(tree_path) as tree_file:
+        next(tree_file)
+        for line in tree_file:
+            stt, end, length = line.rstrip("\n").split("\t")
+            tree[stt][end] = int(length)
+    return tree
+
+
 ##############################################################################################################################
 
 ##############################################################################################################################
@@ -290,27 +460,22 @@ def graph_rank_dist(g, startnode):
 ##############################################################################################################################
 def rdmst_recursor(g__inputed, root_node, recurr_idx, t0, ts, st_mem):
     recurr_idx = recurr_idx + 1         # record how many recursions have taken place
-    if recurr_idx%5==0: 
-        nwl = "\n" if (recurr_idx-5)%100==0 else "\r"
-        print(f"""{nwl}{recurr_idx:4d} loops shrunk, avg_span: {str(dt_.now()-ts)[3:-5]
-              } elapse: {str(dt_.now()-t0)[:-5]}, mem: {pc_mem()-st_mem:3.2f} GB.""", end="")
-        ts = dt_.now()
     g_reversed = reverse__graph(g__inputed)            # reverse graph direction
-    g_rev_cont = contract_graph(g_reversed, root_node) # contract each node by min_length
+    g_rev_cont = contract_graph(g_reversed, root_node) # reduce each node's in-edges by their minimum
     g_rdst_min = get_rdst_graph(g_rev_cont, root_node) # get the 0_length nodes 
-    loop_in_gr = find_graphloop(g_rdst_min)            # find loops in the graph
+    loop_in_gr = find_graphloop(g_rdst_min)            # find all loops in the graph
     
     if not loop_in_gr: 
-        print(f"\nall {recurr_idx:4d} loops contracted, now recovering tree:")
+        print(f"\nall loops contracted in {recurr_idx - 1:4d} rounds, now recovering tree:")
         return reverse__graph(g_rdst_min)
     else:   
+        print(f"round {recurr_idx:4d}: {len(loop_in_gr)} loops over {sum(map(len, loop_in_gr))} of {len(g__inputed)} nodes, "
+              f"elapse: {str(dt_.now()-t0)[:-5]}, mem: {pc_mem()-st_mem:3.2f} GB.")
         g_contract = reverse__graph(g_rev_cont)
-        g___pruned, loop_nodes = prune____graph(g_contract, loop_in_gr)
+        g___pruned, first_id, origin = prune____graph(g_contract, loop_in_gr)
         del g_reversed, g_rev_cont, g__inputed, g_rdst_min
         g_new_rdst = rdmst_recursor(g___pruned, root_node, recurr_idx, t0, ts, st_mem)  # recursion at here
-        g_expanded = expand___graph(g_contract, g_new_rdst, loop_in_gr, loop_nodes)
-        print(f"\r{recurr_idx:4d} layer remaining.", end="")
-        return g_expanded
+        return expand___graph(g_contract, g_new_rdst, loop_in_gr, first_id, origin)
 
 
 ##############################################################################################################################
@@ -338,11 +503,17 @@ def reverse__graph(g):
 #                rg[node][in_nbr] -= minimum
 #    return rg
 
-#missing weights in the output file - there are getting lost in the above function
-# instead of trying to modify them just keep them as is. 
-
+# the reduced weights only steer the contraction; compute_rdmst puts the original
+# weights back on the final tree, so none get lost in the output file
 def contract_graph(in_graph, root):
-    return in_graph.copy()  # ✅ No weight changes
+    rg = {}
+    for node in in_graph:
+        if node == root or not in_graph[node]:
+            rg[node] = dict(in_graph[node])
+        else:
+            minimum = min(in_graph[node].values())
+            rg[node] = {in_nbr: w - minimum for in_nbr, w in in_graph[node].items()}
+    return rg
 
 
 
@@ -365,93 +536,74 @@ def get_rdst_graph(rg, root):
 
 ##############################################################################################################################
 def find_graphloop(rdst_candidate):
-    node_unvisited = []
-    for node in rdst_candidate:  
-        node_unvisited.append(node)
-    while node_unvisited != []:
-        start_node = node_unvisited.pop()  
-        stack = []  
-        trail = []  
-        stack.append(start_node)
-        while len(stack) != 0:
-            node = stack.pop(-1)
-            for nbr in rdst_candidate[node]:
-                if nbr in trail:
-                    return tuple(trail[trail.index(nbr):]) 
-                else:
-                    stack.append(nbr)
-                    trail.append(nbr)
-                    if nbr in node_unvisited:
-                        node_unvisited.remove(nbr)
-    return False
-
-
-##############################################################################################################################
-
-##############################################################################################################################
-def prune____graph(g, cycle):
-    loop_nodes = max(g.keys()) + "1"
+    # every node keeps at most one in-edge, so following them is a functional graph:
+    # one walk per node finds all its disjoint loops in O(V). Each loop lists a node's
+    # parent right after it (the last node's parent is the first).
+    walked = {}
+    loops = []
+    for start in rdst_candidate:
+        trail = []
+        node = start
+        while node is not None and node not in walked:
+            walked[node] = start
+            trail.append(node)
+            node = next(iter(rdst_candidate[node]), None)
+        if node is not None and walked[node] == start:
+            loops.append(tuple(trail[trail.index(node):]))
+    return loops
+
+
+##############################################################################################################################
+
+##############################################################################################################################
+def prune____graph(g, loops):
+    # all loops are contracted in one rebuild, loop k becomes node first_id + k;
+    # origin keeps the original edge behind every edge that touches a contracted node
+    first_id = max(g.keys()) + 1
+    comp = {}
+    for k, loop in enumerate(loops):
+        for node in loop:
+            comp[node] = first_id + k
     contracted_graph = {}
-    contracted_graph[loop_nodes] = {}
+    for k in range(len(loops)):
+        contracted_graph[first_id + k] = {}
     for node in g:
-        if not node in cycle:
+        if not node in comp:
             contracted_graph[node] = {}
+    origin = {}
     for node in g:
+        a_node = comp.get(node, node)
+        out_edge = contracted_graph[a_node]
         for nbr in g[node]:
-            if node in cycle:
-                if nbr in cycle: pass   ############## node in,  nbr in  cycle ###########################################################
-                else:    ############################# node in,  nbr out cycle ###########################################################
-                    if nbr in contracted_graph[loop_nodes]:
-                        contracted_graph[loop_nodes][nbr] = min(contracted_graph[loop_nodes][nbr], g[node][nbr])
-                    else:
-                        contracted_graph[loop_nodes][nbr] = g[node][nbr]
-            else:
-                if nbr in cycle: ##################### node out, nbr in  cycle ###########################################################
-                    if loop_nodes in contracted_graph[node]:
-                        contracted_graph[node][loop_nodes] = min(contracted_graph[node][loop_nodes], g[node][nbr])
-                    else:
-                        contracted_graph[node][loop_nodes] = g[node][nbr]
-                else: ################################ node out, nbr out cycle ###########################################################
-                    contracted_graph[node][nbr] = g[node][nbr]
-    return contracted_graph, loop_nodes
+            b_node = comp.get(nbr, nbr)
+            if a_node == b_node: continue       # edge inside a loop
+            if a_node == node and b_node == nbr:
+                out_edge[nbr] = g[node][nbr]
+            elif b_node not in out_edge or g[node][nbr] < out_edge[b_node]:
+                out_edge[b_node] = g[node][nbr]
+                origin[(a_node, b_node)] = (node, nbr)
+    return contracted_graph, first_id, origin
 
 
 ##############################################################################################################################
 
 ##############################################################################################################################
-def expand___graph(g_contract, g_new_rdst, loop_node, loop_repr):
+def expand___graph(g_contract, g_new_rdst, loops, first_id, origin):
     restored_graph = {}
     for node in g_contract:
         restored_graph[node] = {}
-    for node in g_new_rdst:  
-        for nbr in g_new_rdst[node]:
-            if node == loop_repr:  
-                minimum = float('inf')
-                for orig in loop_node:
-                    if nbr in g_contract[orig]:
-                        if g_contract[orig][nbr] < minimum:
-                            minimum = g_contract[orig][nbr]
-                            point = orig
-                restored_graph[point][nbr] = minimum
-            else:
-                if nbr == loop_repr:  
-                    minimum = float('inf')
-                    for orig_nbr in g_contract[node]:
-                        if orig_nbr in loop_node:
-                            if g_contract[node][orig_nbr] < minimum:
-                                minimum = g_contract[node][orig_nbr]
-                                start_pt = orig_nbr  
-                    restored_graph[node][start_pt] = minimum
-                else: 
-                    restored_graph[node][nbr] = g_contract[node][nbr]
-    for index in range(len(loop_node) - 1): 
-        restored_graph[loop_node[index + 1]][loop_node[index]] = g_contract[loop_node[index + 1]][loop_node[index]]
-    restored_graph[loop_node[0]][loop_node[-1]] = g_contract[loop_node[0]][loop_node[-1]]
-    index = loop_node.index(start_pt)
-    if index == len(loop_node) - 1:
-        restored_graph[loop_node[0]].pop(loop_node[index])
-    else:
-        restored_graph[loop_node[index + 1]].pop(loop_node[index])
+    entry = {}      # loop -> the member its tree in-edge enters
+    for a_node in g_new_rdst:  
+        for b_node in g_new_rdst[a_node]:
+            node, nbr = origin.get((a_node, b_node), (a_node, b_node))
+            restored_graph[node][nbr] = g_contract[node][nbr]
+            if b_node >= first_id:
+                entry[b_node] = nbr
+    for k, loop in enumerate(loops):
+        for index in range(len(loop)):
+            if loop[index] != entry[first_id + k]:
+                parent = loop[(index + 1) % len(loop)]
+                restored_graph[parent][loop[index]] = g_contract[parent][loop[index]]
     return restored_graph
 
 
@@ -465,8 +617,8 @@ def pc_mem():
     return mem_bytes / 1e9  # Convert to GB
 
 
-def get_dynamic_chunk_size(base_chunk=5000, memory_fraction=0.1):
-    """Determine chunk size based on available RAM."""
+def get_dense_limit(base_chunk=5000, memory_fraction=0.1):
+    """Largest graph (in nodes) handed to the contraction solvers, based on available RAM."""
     available_mem = psutil.virtual_memory().available / 1e9  # GB
     # Assume each node costs ~1MB (adjust if needed)
     estimated_nodes_per_gb = 1000
@@ -474,33 +626,46 @@ def get_dynamic_chunk_size(base_chunk=5000, memory_fraction=0.1):
     return max(base_chunk, dynamic_size)
 
 
-def compute_rdmst(g, root, recursive=True, parallel=False, max_workers=4):
+def compute_rdmst(g, root, recursive=True, parallel=False, max_workers=4, inplace=False, max_dense=None):
+    # inplace=True contracts the cycles on one working graph with an undo log, read row by row from g
+    # (g plus that graph at peak instead of a graph per round), recursive and parallel are then ignored
+    # graphs over max_dense nodes (default get_dense_limit()) and memory-mapped MED matrices (-M) are
+    # never expanded into dicts: they are solved exactly on candidate edges streamed from the matrix
+    # and the tree is verified against the full graph
+    max_dense = get_dense_limit() if max_dense is None else max_dense
+    if isinstance(g, MEDGraph) and isinstance(g.matrix, np.memmap):
+        print(f"Memory-mapped graph ({len(g)} nodes), solving on candidate edges streamed from the matrix...")
+        return large_tree(g, root)
+    if len(g) > max_dense:
+        print(f"Graph too large ({len(g)} nodes) for the contraction solvers, solving on candidate edges...")
+        return large_tree(g, root)
+
     tracemalloc.start()
     st_mem = pc_mem()
     t0 = dt_.now()
     print(f"Starting RD-MST computation. Initial memory: {st_mem:.2f} GB")
 
-    chunk_size = get_dynamic_chunk_size()
-    print(f"Dynamic chunk size set to {chunk_size} nodes based on available RAM.")
-
-    if len(g) > chunk_size:
-        print(f"Graph too large ({len(g)} nodes). Splitting into chunks of {chunk_size}...")
-        chunks = chunk_graph(g, chunk_size)
-        results = []
-        for i, subgraph in enumerate(chunks, 1):
-            print(f"\nProcessing chunk {i}/{len(chunks)}... Current memory: {pc_mem():.2f} GB")
-            if recursive:
-                rdmst_chunk = rdmst_recursor(subgraph, root, 0, t0, dt_.now(), st_mem)
-            else:
-                rdmst_chunk = rdmst_iterative(subgraph, root, parallel=parallel, max_workers=max_workers)
-            results.append(rdmst_chunk)
-        rdmst = merge_chunks(results)
+    # the solver runs on integer node IDs, cell names are put back on the final tree only;
+    # the in-place solver reads g through an IDView, the others get a relabelled copy
+    names = list(g.keys())
+    node_id = {name: i for i, name in enumerate(names)}
+    root_id = node_id[root]
+
+    print(f"Processing full graph. Current memory: {pc_mem():.2f} GB")
+    if inplace:
+        rdmst = rdmst_helper_inplace(IDView(g, names), root_id, log=print)
+    elif parallel and isinstance(g, MEDGraph):
+        # the pool writes the matrix straight into its shared edge arrays, no dict copy
+        t1 = dt_.now()
+        rdmst = rdmst_pool(MEDGraph(range(len(names)), g.matrix, g.absent), root_id, workers=max_workers)
+        print(f"\nsolved over {max_workers} processes, Total time: {dt_.now()-t1}")
     else:
-        print(f"Processing full graph. Current memory: {pc_mem():.2f} GB")
+        gi = {node_id[a]: {node_id[b]: w for b, w in g[a].items()} for a in names}
         if recursive:
-            rdmst = rdmst_recursor(g, root, 0, t0, dt_.now(), st_mem)
+            rdmst = rdmst_recursor(gi, root_id, 0, t0, dt_.now(), st_mem)
         else:
-            rdmst = rdmst_iterative(g, root, parallel=parallel, max_workers=max_workers)
+            rdmst = rdmst_iterative(gi, root_id, parallel=parallel, max_workers=max_workers)
+        del gi
 
     print(f"\nTotal time: {dt_.now()-t0}")
     print(f"Final memory usage: {pc_mem():.2f} GB")
@@ -508,12 +673,15 @@ def compute_rdmst(g, root, recursive=True, parallel=False, max_workers=4):
     tracemalloc.stop()
 
 
-    # ✅ Compute total weight
+    # ✅ Compute total weight, with the original weights put back on the tree edges
     total_weight = 0
     for u, edges in rdmst.items():
-        for v, w in edges.items():
-            total_weight += w
+        row = g[names[u]]
+        for v in edges:
+            edges[v] = row[names[v]]
+            total_weight += edges[v]
 
+    rdmst = {names[u]: {names[v]: w for v, w in edges.items()} for u, edges in rdmst.items()}
     return rdmst, total_weight
 
 
@@ -521,30 +689,8 @@ def log_memory():
     current, peak = tracemalloc.get_traced_memory()
     print(f"Memory usage: {current/1e9:.2f} GB; Peak: {peak/1e9:.2f} GB")
 
-
-def chunk_graph(g, chunk_size):
-    """Split graph into chunks for memory-safe processing."""
-    nodes = list(g.keys())
-    chunks = []
-    for i in range(0, len(nodes), chunk_size):
-        sub_nodes = nodes[i:i+chunk_size]
-        subgraph = {n: {nbr: g[nbr] for nbr in g[n] if nbr in sub_nodes} for n in sub_nodes}
-        chunks.append(subgraph)
-    return chunks
-
-
-def merge_chunks(chunks):
-    """Merge processed chunks back into a single graph."""
-    merged = {}
-    for chunk in chunks:
-        merged.update(chunk)
-    return merged
-
 def rdmst_recursor(g__inputed, root_node, recurr_idx, t0, ts, st_mem):
     recurr_idx += 1
-    if recurr_idx % 5 == 0:
-        print(f"\r{recurr_idx:4d} loops shrunk, elapsed: {dt_.now()-t0}, mem: {pc_mem()-st_mem:.2f} GB", end="")
-        ts = dt_.now()
 
     g_reversed = reverse__graph(g__inputed)
     g_rev_cont = contract_graph(g_reversed, root_node)
@@ -552,53 +698,55 @@ def rdmst_recursor(g__inputed, root_node, recurr_idx, t0, ts, st_mem):
     loop_in_gr = find_graphloop(g_rdst_min)
 
     if not loop_in_gr:
-        print(f"\nAll {recurr_idx:4d} loops contracted, recovering tree...")
+        print(f"\nAll loops contracted in {recurr_idx - 1:4d} rounds, recovering tree...")
         return reverse__graph(g_rdst_min)
     else:
+        print(f"round {recurr_idx:4d}: {len(loop_in_gr)} loops over {sum(map(len, loop_in_gr))} of {len(g__inputed)} nodes, "
+              f"elapsed: {dt_.now()-t0}, mem: {pc_mem()-st_mem:.2f} GB")
         g_contract = reverse__graph(g_rev_cont)
-        g___pruned, loop_nodes = prune____graph(g_contract, loop_in_gr)
+        g___pruned, first_id, origin = prune____graph(g_contract, loop_in_gr)
 
         # Cleanup
         del g_reversed, g_rev_cont, g__inputed, g_rdst_min
         gc.collect()
 
         g_new_rdst = rdmst_recursor(g___pruned, root_node, recurr_idx, t0, ts, st_mem)
-        g_expanded = expand___graph(g_contract, g_new_rdst, loop_in_gr, loop_nodes)
-        return g_expanded
+        return expand___graph(g_contract, g_new_rdst, loop_in_gr, first_id, origin)
 
 def rdmst_iterative(g, root, parallel=False, max_workers=4):
-    stack = [(g, root)]
-    result_graph = None
+    # contract all loops of a round at once until none is left, then expand the rounds in reverse;
+    # parallel runs the rounds on shared edge arrays over a pool of max_workers processes instead
+    if parallel:
+        t0 = dt_.now()
+        result_graph = rdmst_pool(g, root, workers=max_workers)
+        print(f"\nsolved over {max_workers} processes, Total time: {dt_.now()-t0}")
+        return result_graph
     t0 = dt_.now()
     st_mem = pc_mem()
+    rounds = []
+    g_current = g
 
-    while stack:
-        g_current, root_node = stack.pop()
+    while True:
         g_reversed = reverse__graph(g_current)
-        g_rev_cont = contract_graph(g_reversed, root_node)
-        g_rdst_min = get_rdst_graph(g_rev_cont, root_node)
+        g_rev_cont = contract_graph(g_reversed, root)
+        g_rdst_min = get_rdst_graph(g_rev_cont, root)
         loop_in_gr = find_graphloop(g_rdst_min)
-
         if not loop_in_gr:
-            result_graph = reverse__graph(g_rdst_min)
             break
-        else:
-            g_contract = reverse__graph(g_rev_cont)
-            g___pruned, loop_nodes = prune____graph(g_contract, loop_in_gr)
 
-            if parallel:
-                with ThreadPoolExecutor(max_workers=max_workers) as executor:
-                    future = executor.submit(expand___graph, g_contract, g___pruned, loop_in_gr, loop_nodes)
-                    expanded_graph = future.result()
-            else:
-                expanded_graph = expand___graph(g_contract, g___pruned, loop_in_gr, loop_nodes)
-
-            stack.append((expanded_graph, root_node))
+        print(f"round {len(rounds)+1:4d}: {len(loop_in_gr)} loops over {sum(map(len, loop_in_gr))} of {len(g_current)} nodes, "
+              f"elapsed: {dt_.now()-t0}, mem: {pc_mem()-st_mem:.2f} GB")
+        g_contract = reverse__graph(g_rev_cont)
+        g_current, first_id, origin = prune____graph(g_contract, loop_in_gr)
+        rounds.append((g_contract, loop_in_gr, first_id, origin))
 
         # Cleanup
         del g_reversed, g_rev_cont, g_rdst_min
         gc.collect()
 
-    print(f"\nTotal time: {dt_.now()-t0}, Memory used: {pc_mem()-st_mem:.2f} GB")
-    return result_graph
+    result_graph = reverse__graph(g_rdst_min)
+    for g_contract, loop_in_gr, first_id, origin in reversed(rounds):
+        result_graph = expand___graph(g_contract, result_graph, loop_in_gr, first_id, origin)
 
+    print(f"\n{len(rounds)} contraction rounds, Total time: {dt_.now()-t0}, Memory used: {pc_mem()-st_mem:.2f} GB")
+    return result_graph
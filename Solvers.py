@@ -0,0 +1,249 @@
+##############################################################################################################################
+# One entry point for the RDMST solvers of this package.
+# Every backend takes a {parent: {child: weight}} graph (a dict of dicts or a MEDGraph) and the
+# root, and solve() wraps its answer in an RDMSTResult. Backends are registered with the modules
+# they need and are only imported when used, so the registry loads under Python 2 without NumPy.
+# solver="auto" picks a backend from the node count, the edge density and the free memory.
+##############################################################################################################################
+import os
+import sys
+import time
+
+# name -> (solve(g, root, threads, verbose, options) -> (tree, weight), description, required modules)
+BACKENDS = {}
+
+
+class RDMSTResult:
+    """tree ({parent: {child: weight}} over every node), its weight, the backend and its run time; unpacks as (tree, weight)"""
+    def __init__(self, tree, weight, solver, seconds):
+        self.tree = tree
+        self.weight = weight
+        self.solver = solver
+        self.seconds = seconds
+
+    def __iter__(self):
+        return iter((self.tree, self.weight))
+
+    def __getitem__(self, i):
+        return (self.tree, self.weight)[i]
+
+    def __repr__(self):
+        return "RDMSTResult(weight={}, solver={}, {:.2f}s)".format(self.weight, self.solver, self.seconds)
+
+
+def register(name, solve, description, needs=()):
+    BACKENDS[name] = (solve, description, tuple(needs))
+
+
+def available(name):
+    """True when the modules backend name needs can be imported here"""
+    for module in BACKENDS[name][2]:
+        try:
+            __import__(module)
+        except (ImportError, SyntaxError):
+            return False
+    return True
+
+
+def available_solvers():
+    return sorted(name for name in BACKENDS if available(name))
+
+
+##############################################################################################################################
+# backends
+##############################################################################################################################
+def _edmonds(g, root, threads, verbose, options):
+    from mdmst_copilot_rewrite3 import compute_rdmst_iterative
+    return compute_rdmst_iterative(g, root, checkpoint=options.get("checkpoint"),
+                                   every=options.get("every", 10), seconds=options.get("seconds", 1800))
+
+
+def _inplace(g, root, threads, verbose, options):
+    from mdmst_copilot_rewrite3 import compute_rdmst_iterative
+    return compute_rdmst_iterative(g, root, inplace=True)
+
+
+def _tarjan(g, root, threads, verbose, options):
+    from Arborescence import compute_rdmst_tarjan
+    return compute_rdmst_tarjan(g, root)
+
+
+def _pool(g, root, threads, verbose, options):
+    from ParallelRDMST import rdmst_pool
+    tree = rdmst_pool(g, root, workers=threads)
+    return tree, sum(w for node in tree for w in tree[node].values())
+
+
+def _large(g, root, threads, verbose, options):
+    from SparseRDMST import large_tree
+    return large_tree(g, root, k=options.get("k", 8), verify=options.get("verify", True), verbose=verbose)
+
+
+def _sp1(g, root, threads, verbose, options):
+    from SP1_SCT_UTIL import compute_rdmst
+    return compute_rdmst(g=g, root=root, recursive=False, parallel=threads > 1, max_workers=threads,
+                         inplace=options.get("inplace", False))
+
+
+def _reference(g, root, threads, verbose, options):
+    import mdmst
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), 4 * len(g) + 1000))
+    return mdmst.compute_rdmst(g, root)
+
+
+register("edmonds", _edmonds, "all cycles of a round contracted on graph copies (mdmst_copilot_rewrite3)",
+         ["mdmst_copilot_rewrite3"])
+register("inplace", _inplace, "contraction on one graph with an undo log (mdmst_copilot_rewrite3)",
+         ["mdmst_copilot_rewrite3"])
+register("tarjan", _tarjan, "O(E log V) heaps and union-find (Arborescence)", ["Arborescence"])
+register("pool", _pool, "per-round edge passes on shared arrays over -T processes (ParallelRDMST)",
+         ["numpy", "ParallelRDMST"])
+register("large", _large, "candidate edges streamed from the distance matrix, proven optimal (SparseRDMST)",
+         ["numpy", "SparseRDMST"])
+register("sp1", _sp1, "dict contraction rounds of the SC1 pipeline (SP1_SCT_UTIL)", ["SP1_SCT_UTIL"])
+register("reference", _reference, "the original recursive solver, Python 2 only (mdmst)", ["mdmst"])
+
+
+##############################################################################################################################
+# auto policy
+##############################################################################################################################
+def available_memory():
+    """free memory in bytes, or None when it cannot be read"""
+    try:
+        import psutil
+        return psutil.virtual_memory().available
+    except ImportError:
+        pass
+    try:
+        with open("/proc/meminfo") as meminfo:
+            for line in meminfo:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (IOError, OSError, ValueError):
+        pass
+    return None
+
+
+def edge_count(g):
+    if hasattr(g, "matrix") and g.absent is None:
+        return len(g) * (len(g) - 1)
+    return sum(len(g[node]) for node in g)
+
+
+def memory_mapped(g):
+    """True for a MEDGraph read from an on-disk matrix, which only the large backend solves without loading it"""
+    matrix = getattr(g, "matrix", None)
+    return matrix is not None and type(matrix).__name__ == "memmap"
+
+
+def choose_solver(g, threads=1):
+    """(backend name, reason) for solver="auto" """
+    return choose_backend(len(g), edge_count(g), threads, memory_mapped(g))
+
+
+def choose_backend(n, edges, threads=1, mapped=False):
+    """choose_solver() from the size of a graph before it is built: n nodes, edges edges, mapped for an on-disk matrix"""
+    density = float(edges) / max(1, n * (n - 1))
+    memory = available_memory()
+    # a dict-of-dicts edge costs ~120 bytes, and the contraction solvers hold about three copies
+    tight = memory is not None and 3 * 120 * edges > memory / 2
+    numpy = available("large")
+    facts = "{} nodes, {} edges, density {:.2f}".format(n, edges, density)
+    if mapped:
+        return "large", facts + ", memory-mapped matrix: streamed candidate edges"
+    if numpy and (n >= 500 or tight):
+        return "large", facts + ", large or memory-bound graph: streamed candidate edges"
+    if numpy and threads > 1:
+        return "pool", facts + ", {} processes".format(threads)
+    if density < 0.05:
+        return "tarjan", facts + ", sparse graph"
+    return "inplace", facts + ", dense graph that fits in memory"
+
+
+def solve(g, root, solver="auto", threads=1, verbose=True, **options):
+    """
+    RDMST of g from root with the named backend (see BACKENDS) or the auto policy.
+    options go to the backends that use them: checkpoint/every/seconds (edmonds), k/verify (large),
+    inplace (sp1). Raises ValueError for an unknown or unavailable backend, or when the root does
+    not reach every node.
+    """
+    if solver == "auto":
+        solver, reason = choose_solver(g, threads)
+        if verbose:
+            print("auto solver: {} ({})".format(solver, reason))
+    if solver not in BACKENDS:
+        raise ValueError("unknown solver {}, choose from {}".format(solver, ", ".join(sorted(BACKENDS))))
+    if not available(solver):
+        raise ValueError("solver {} needs {}".format(solver, ", ".join(BACKENDS[solver][2])))
+    t0 = time.time()
+    result = BACKENDS[solver][0](g, root, threads, verbose, options)
+    if result is None:
+        raise ValueError("the root {} does not reach every node".format(root))
+    (tree, weight) = result
+    for node in g:
+        tree.setdefault(node, {})
+    return RDMSTResult(tree, weight, solver, time.time() - t0)
+
+
+##############################################################################################################################
+# self-check: every available backend on the example inputs gives a spanning arborescence of the same weight
+##############################################################################################################################
+def check_tree(g, root, result):
+    parent = {}
+    for node in result.tree:
+        for child in result.tree[node]:
+            assert child not in parent, (result.solver, "two parents", child)
+            assert result.tree[node][child] == g[node][child], (result.solver, node, child)
+            parent[child] = node
+    assert sorted(parent) == sorted(node for node in g if node != root), result.solver
+    for node in parent:
+        (x, steps) = (node, 0)
+        while x != root:
+            (x, steps) = (parent[x], steps + 1)
+            assert steps <= len(g), (result.solver, "cycle")
+    assert sum(result.tree[node][child] for node in result.tree for child in result.tree[node]) == result.weight
+
+
+def main():
+    import io
+    from ComputeDistance import read_example
+    here = os.path.dirname(os.path.abspath(__file__))
+    names = available_solvers()
+    print("available solvers: {}".format(", ".join(names)))
+    for example in ("scDNA.CNV.txt", "scRNA.CNV.txt"):
+        path = os.path.join(here, "example", example)
+        if not os.path.exists(path):
+            continue
+        nodes = read_example(path)
+        graphs = []
+        try:
+            import numpy as np
+            from DistanceMatrix import profile_matrix, med_columns, MEDGraph
+            cells = list(nodes.keys())
+            cnv, bounds = profile_matrix(nodes, cells)
+            for zero_sentinel in (False, True):
+                matrix = med_columns(cnv, bounds, zero_sentinel)(np.arange(len(cells)))
+                graphs.append(("sentinel {}".format(zero_sentinel), MEDGraph(cells, matrix)))
+        except ImportError:
+            from Edmonds import create_tree
+            graphs.append(("python engine", create_tree(nodes, list(nodes.keys()), "root", engine="python")))
+        for (label, medgraph) in graphs:
+            root = list(medgraph.keys())[0]
+            g = dict((a, dict(medgraph[a].items())) for a in medgraph)
+            weights = {}
+            for name in names + ["auto"]:
+                saved = sys.stdout
+                sys.stdout = io.StringIO() if sys.version_info[0] >= 3 else io.BytesIO()
+                try:
+                    result = solve(dict((a, dict(g[a])) for a in g), root, name, verbose=False)
+                finally:
+                    sys.stdout = saved
+                check_tree(g, root, result)
+                weights[result.solver if name != "auto" else "auto->" + result.solver] = (result.weight, result.seconds)
+            assert len(set(w for (w, s) in weights.values())) == 1, (example, label, weights)
+            print("{} ({}): weight {} from {}".format(example, label, list(weights.values())[0][0], ", ".join(
+                "{} {:.2f}s".format(name, s) for (name, (w, s)) in sorted(weights.items()))))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,447 @@
+##############################################################################################################################
+# RDMST on candidate edges instead of the dense N x N graph.
+# Every cell keeps only its k cheapest incoming edges (plus the root edge), the arborescence is
+# solved on that sparse graph, and the dual certificate of the solve (see Arborescence.py) is
+# checked against the edges that were left out: a cell whose dual total does not exceed the
+# cheapest excluded edge into it is proven, every other cell gets its full column recomputed and
+# any violating edge is added before solving again. The returned tree therefore has the same
+# total weight as the dense solve. Among equal-weight trees the one with the least sum of
+# tie_key() over its edges is returned, so the edge set does not depend on k or on the seed
+# edges of a warm start (tie_key sums of two tied trees only collide with odds ~2^-40).
+##############################################################################################################################
+from datetime import datetime as dt_
+import os
+import zlib
+import numpy as np
+
+from Arborescence import edmonds, dual_intervals, chain
+from DistanceMatrix import profile_matrix, med_columns, MEDGraph
+
+
+def candidate_edges(columns, n, root, k, block=256):
+    """
+    k cheapest parents of every cell, one column block at a time.
+    Returns (src, dst, weight, parents, floor): parents[v] is the candidate set of v and
+    floor[v] the cheapest excluded edge into v (inf when every edge is a candidate).
+    """
+    k = max(1, min(k, n - 1))
+    big = np.iinfo(np.int32).max
+    src, dst, weight = [], [], []
+    parents = [set() for v in range(0, n)]
+    floor = [float('inf')] * n
+    for c0 in range(0, n, block):
+        cols = np.arange(c0, min(n, c0 + block))
+        D = columns(cols)
+        D[cols, np.arange(len(cols))] = big
+        if k < n - 1:
+            part = np.argpartition(D, k, axis=0)
+            near = part[:k]
+            rest = D[part[k], np.arange(len(cols))]
+        else:
+            near = np.argsort(D, axis=0)[:k]
+        for j, v in enumerate(cols):
+            if v == root:
+                continue
+            if k < n - 1:
+                floor[v] = int(rest[j])
+            for u in set(near[:, j].tolist()) | set([root]):
+                parents[v].add(u)
+                src.append(u)
+                dst.append(v)
+                weight.append(int(D[u, j]))
+    return src, dst, weight, parents, floor
+
+
+def edge_thresholds(v, n, up, pos, lo, hi, acc):
+    """
+    thr[u] = y of the sets holding v but not u: edge (u, v) respects the dual certificate
+    when its weight is at least thr[u]. pos, lo, hi, acc come from dual_intervals, pos as array.
+    """
+    thr = np.zeros(n, dtype=np.int64)
+    for S in reversed(chain(v, up)[1:]):
+        thr[lo[S]:hi[S]] = acc[S]
+    thr = acc[v] - thr[pos]
+    thr[v] = 0
+    return thr
+
+
+def name_keys(names):
+    """tie-break keys of the cells in names, from their names so that they do not depend on the cell order"""
+    return [zlib.crc32(str(name).encode("utf-8")) & 0xffffffff for name in names]
+
+
+def tie_key(a, b, mask=(1 << 64) - 1):
+    """pseudo-random 40-bit tie-break of the edge from the cell keyed a to the cell keyed b"""
+    h = (a * 0x9E3779B97F4A7C15 + b * 0xC2B2AE3D27D4EB4F + 0x165667B1) & mask
+    h = ((h ^ (h >> 29)) * 0xBF58476D1CE4E5B9) & mask
+    return (h ^ (h >> 32)) >> 24
+
+
+def tie_broken(columns, n, root, src, dst, weight, parents, floor, up, y, keys, block=256):
+    """
+    in_edge of the minimum arborescence with the least tie_key total, given the duals (up, y) of a
+    tree proven optimal for the full graph. Every minimum arborescence only uses tight edges (weight
+    equal to the dual threshold), so the tight candidates plus the tight edges of the columns whose
+    floor does not clear them are re-solved with weight * 2^64 + tie_key as exact integer weights.
+    Tight edges found outside the candidates are appended to src, dst and weight.
+    """
+    pos, lo, hi, acc = dual_intervals(n, up, y)
+    chains = [chain(v, up)[1:] for v in range(0, n)]
+    tight = []
+    for e in range(0, len(src)):
+        (u, v) = (src[e], dst[e])
+        if v == root or u == v:
+            continue
+        thr = acc[v]
+        for S in chains[v]:
+            if lo[S] <= pos[u] < hi[S]:
+                thr = acc[v] - acc[S]  # y of the sets holding v but not u
+                break
+        if weight[e] == thr:
+            tight.append(e)
+    pos = np.array(pos)
+    open_cols = [v for v in range(0, n) if v != root and acc[v] >= floor[v]]
+    for b0 in range(0, len(open_cols), block):
+        cols = open_cols[b0:b0 + block]
+        D = columns(np.array(cols))
+        for j, v in enumerate(cols):
+            thr = edge_thresholds(v, n, up, pos, lo, hi, acc)
+            for u in np.flatnonzero(D[:, j] == thr).tolist():
+                if u != v and u not in parents[v]:
+                    parents[v].add(u)
+                    tight.append(len(src))
+                    src.append(u)
+                    dst.append(v)
+                    weight.append(int(D[u, j]))
+    ranked = [(weight[e] << 64) + tie_key(keys[src[e]], keys[dst[e]]) for e in tight]
+    in_tight = edmonds(n, root, [src[e] for e in tight], [dst[e] for e in tight], ranked)[0]
+    return [tight[i] if i >= 0 else -1 for i in in_tight]
+
+
+def solve_certified(columns, n, root, k=8, block=256, verbose=True, seed=(), cache_bytes=1 << 30, keys=None):
+    """
+    Minimum arborescence of the complete directed graph given by columns(cols), touching only
+    the columns the dual certificate cannot clear. seed lists extra (u, v) candidate edges,
+    e.g. a previous tree. Up to cache_bytes of full columns are kept between rounds.
+    Ties are broken by tie_key over keys (default the node indices, see name_keys).
+    Returns (in_edge, src, dst, weight).
+    """
+    keys = list(range(0, n)) if keys is None else keys
+    src, dst, weight, parents, floor = candidate_edges(columns, n, root, k, block)
+    seed = [(u, v) for (u, v) in seed if u != v and v != root and u not in parents[v]]
+    for b0 in range(0, len(seed), block):
+        part = seed[b0:b0 + block]
+        cols = sorted(set(v for (u, v) in part))
+        at = dict((v, j) for (j, v) in enumerate(cols))
+        D = columns(np.array(cols))
+        for (u, v) in part:
+            if u not in parents[v]:
+                parents[v].add(u)
+                src.append(u)
+                dst.append(v)
+                weight.append(int(D[u, at[v]]))
+    full = {}
+    rounds = 0
+    while True:
+        rounds += 1
+        in_edge, up, y = edmonds(n, root, src, dst, weight)
+        pos, lo, hi, acc = dual_intervals(n, up, y)
+        pos = np.array(pos)
+        suspect = [v for v in range(0, n) if v != root and acc[v] > floor[v]]
+
+        added = 0
+        for b0 in range(0, len(suspect), block):
+            # full columns are kept up to cache_bytes, the rest is streamed again every round
+            cols = suspect[b0:b0 + block]
+            missing = [v for v in cols if v not in full]
+            if missing:
+                D = columns(np.array(missing))
+                for j, v in enumerate(missing):
+                    full[v] = D[:, j].copy()
+            for v in cols:
+                thr = edge_thresholds(v, n, up, pos, lo, hi, acc)
+                col = full[v]
+                slack = col - thr
+                slack[list(parents[v])] = 0
+                over = np.flatnonzero(slack < 0)
+                if len(over) > k:
+                    # only the k most violated edges per round, so near-ties cannot flood the candidates
+                    over = over[np.argpartition(slack[over], k)[:k]]
+                for u in over.tolist():
+                    parents[v].add(u)
+                    src.append(u)
+                    dst.append(v)
+                    weight.append(int(col[u]))
+                    added += 1
+                left = np.ones(n, dtype=bool)
+                left[list(parents[v])] = False
+                left[v] = False
+                floor[v] = int(col[left].min()) if left.any() else float('inf')
+            for v in missing:
+                if len(full) * n * 4 > cache_bytes:
+                    del full[v]
+        if verbose:
+            print("round {}: {} candidate edges, {} columns checked, {} edges added".format(
+                rounds, len(src), len(suspect), added))
+        if added == 0:
+            return tie_broken(columns, n, root, src, dst, weight, parents, floor, up, y, keys, block), src, dst, weight
+
+
+def tree_from_edges(names, in_edge, src, weight):
+    """({parent: {child: MED}} over every cell, total weight) of a solve_certified result"""
+    tree = dict((name, {}) for name in names)
+    total = 0
+    for v in range(0, len(names)):
+        e = in_edge[v]
+        if e >= 0:
+            tree[names[src[e]]][names[v]] = weight[e]
+            total += weight[e]
+    return tree, total
+
+
+def sparse_tree(nodes, root, k=8, zero_sentinel=False, block=256, verbose=True):
+    """
+    Drop-in for create_tree + compute_rdmst: returns (tree, weight) with tree as
+    {parent: {child: MED}} over every cell.
+    """
+    t0 = dt_.now()
+    names = list(nodes.keys())
+    cnv, bounds = profile_matrix(nodes, names)
+    columns = med_columns(cnv, bounds, zero_sentinel=zero_sentinel)
+    n = len(names)
+    in_edge, src, dst, weight = solve_certified(columns, n, names.index(root), k, block, verbose, keys=name_keys(names))
+    tree, total = tree_from_edges(names, in_edge, src, weight)
+    if verbose:
+        print("sparse RDMST of {} cells: weight {}, {} of {} edges used, {}".format(
+            n, total, len(src), n * (n - 1), dt_.now() - t0))
+    return tree, total
+
+
+def verify_tree(columns, n, root, in_edge, src, dst, weight, block=256):
+    """
+    Proves that in_edge (a solve_certified result) is a minimum arborescence of the full graph:
+    the duals of the candidate edges must add up to the tree weight, and every edge of the full
+    graph, streamed block by block from columns(cols), must respect them.
+    Returns the tree weight, raises ValueError otherwise.
+    """
+    total = sum(weight[e] for e in in_edge if e >= 0)
+    in_dual, up, y = edmonds(n, root, src, dst, weight)
+    if sum(y) != total or sum(weight[e] for e in in_dual if e >= 0) != total:
+        raise ValueError("tree weight {} does not match the dual total {}".format(total, sum(y)))
+    pos, lo, hi, acc = dual_intervals(n, up, y)
+    pos = np.array(pos)
+    for c0 in range(0, n, block):
+        cols = np.arange(c0, min(n, c0 + block))
+        D = columns(cols)
+        for j, v in enumerate(cols.tolist()):
+            if v == root:
+                continue
+            thr = edge_thresholds(v, n, up, pos, lo, hi, acc)
+            bad = np.flatnonzero(D[:, j] < thr)
+            bad = bad[bad != v]
+            if len(bad):
+                raise ValueError("edge {} -> {} of weight {} undercuts the dual certificate".format(
+                    bad[0], v, D[bad[0], j]))
+    return total
+
+
+def graph_columns(g):
+    """
+    (names, columns) of a {parent: {child: MED}} graph: columns(cols) is the int32 block of
+    edge weights into cols, missing edges read as int32 max. A MEDGraph is read straight from
+    its (possibly memory-mapped) matrix, a dict graph is indexed by child once.
+    """
+    big = np.iinfo(np.int32).max
+    if isinstance(g, MEDGraph):
+        matrix, absent = g.matrix, g.absent
+
+        def columns(cols):
+            D = np.asarray(matrix[:, cols], dtype=np.int32)
+            D[D < 0] = big
+            if absent is not None:
+                D[np.asarray(absent[:, cols])] = big
+            return D
+        return list(g.names), columns
+    names = list(g.keys())
+    at = dict((name, i) for (i, name) in enumerate(names))
+    into = [([], []) for name in names]
+    for a in names:
+        for (b, w) in g[a].items():
+            into[at[b]][0].append(at[a])
+            into[at[b]][1].append(w)
+    into = [(np.array(u, dtype=np.int64), np.array(w, dtype=np.int32)) for (u, w) in into]
+
+    def columns(cols):
+        D = np.full((len(names), len(cols)), big, dtype=np.int32)
+        for j, v in enumerate(cols.tolist()):
+            D[into[v][0], j] = into[v][1]
+        return D
+    return names, columns
+
+
+def large_tree(g, root, k=8, block=256, verify=True, verbose=True):
+    """
+    Exact RDMST of a graph too large for the contraction solvers: only the k cheapest incoming
+    edges of every cell are held in memory, columns of g are streamed in blocks, and with
+    verify the result is proven optimal for the full graph. Returns (tree, weight) like sparse_tree.
+    Raises ValueError when some cell cannot be reached from root.
+    """
+    t0 = dt_.now()
+    names, columns = graph_columns(g)
+    n = len(names)
+    r = names.index(root)
+    in_edge, src, dst, weight = solve_certified(columns, n, r, k, block, verbose, keys=name_keys(names))
+    big = np.iinfo(np.int32).max
+    for v in range(0, n):
+        if v != r and weight[in_edge[v]] == big:
+            raise ValueError("node {} is not reachable from the root".format(names[v]))
+    tree, total = tree_from_edges(names, in_edge, src, weight)
+    if verify:
+        verify_tree(columns, n, r, in_edge, src, dst, weight, block)
+    if verbose:
+        print("large-graph RDMST of {} cells: weight {}{}, {} of {} edges held, {}".format(
+            n, total, " (verified)" if verify else "", len(src), n * (n - 1), dt_.now() - t0))
+    return tree, total
+
+
+def matrix_columns(matrix):
+    """column oracle over a precomputed (possibly memory-mapped) MED matrix"""
+    def columns(cols):
+        return np.asarray(matrix[:, cols], dtype=np.int32)
+    return columns
+
+
+def warm_tree(matrix, names, root, previous, k=8, block=256, verbose=True):
+    """
+    RDMST of the full graph in matrix (rows and columns in names order), warm-started from
+    the tree of a previous run: its edges between cells still present are candidates from the
+    start, next to the k cheapest parents of every cell. The dual certificate makes the weight
+    identical to a from-scratch solve, and the tie-break of solve_certified the edges identical
+    to those of large_tree or sparse_tree on the same cells. Returns (tree, weight) like sparse_tree.
+    """
+    t0 = dt_.now()
+    at = dict((name, i) for (i, name) in enumerate(names))
+    seed = [(at[parent], at[child]) for parent in previous for child in previous[parent]
+            if parent in at and child in at]
+    in_edge, src, dst, weight = solve_certified(matrix_columns(matrix), len(names), at[root], k, block, verbose, seed,
+                                                keys=name_keys(names))
+    tree, total = tree_from_edges(names, in_edge, src, weight)
+    if verbose:
+        print("warm-started RDMST of {} cells from {} previous edges: weight {}, {}".format(
+            len(names), len(seed), total, dt_.now() - t0))
+    return tree, total
+
+
+##############################################################################################################################
+# self-check: sparse solves against the dense solve of the full matrix
+##############################################################################################################################
+def dense_weight(columns, n, root):
+    D = columns(np.arange(n))
+    src, dst, weight = [], [], []
+    for u in range(0, n):
+        for v in range(0, n):
+            if u != v and v != root:
+                src.append(u)
+                dst.append(v)
+                weight.append(int(D[u, v]))
+    in_edge = edmonds(n, root, src, dst, weight)[0]
+    return sum(weight[e] for e in in_edge if e >= 0)
+
+
+def check(cnv, bounds, label, ks=(1, 2, 4, 8)):
+    n = cnv.shape[0]
+    for zero_sentinel in (False, True):
+        columns = med_columns(cnv, bounds, zero_sentinel=zero_sentinel)
+        want = dense_weight(columns, n, 0)
+        edges = set()
+        for k in ks + (n - 1,):
+            in_edge, src, dst, weight = solve_certified(columns, n, 0, k, verbose=False)
+            got = sum(weight[e] for e in in_edge if e >= 0)
+            assert got == want, (label, zero_sentinel, k, got, want)
+            assert sorted(dst[e] for e in in_edge if e >= 0) == list(range(1, n))
+            edges.add(frozenset((src[e], dst[e]) for e in in_edge if e >= 0))
+        assert len(edges) == 1, (label, zero_sentinel, "edge sets differ between k")
+    print("{}: sparse == dense for k in {}, same edges".format(label, list(ks)))
+
+
+def check_incremental(cnv, bounds, label, added):
+    """extending the matrix of the first cells and warm-starting from their tree matches a full solve"""
+    import shutil
+    import tempfile
+    from DistanceMatrix import med_matrix, med_matrix_memmap, extend_med_matrix
+    n = cnv.shape[0]
+    names = ["cell{}".format(i) for i in range(0, n)]
+    first = n - added
+    folder = tempfile.mkdtemp()
+    try:
+        for zero_sentinel in (False, True):
+            before = os.path.join(folder, "before.npy")
+            after = os.path.join(folder, "after.npy")
+            old = med_matrix_memmap(cnv[:first], bounds, before, zero_sentinel, names=names[:first])
+            in_edge, src, dst, weight = solve_certified(matrix_columns(old), first, 0, 2, verbose=False)
+            previous = tree_from_edges(names[:first], in_edge, src, weight)[0]
+            # new cells arrive in between the old ones, and one old cell was re-profiled
+            order = list(range(first, n)) + list(range(0, first))
+            order[1], order[-1] = order[-1], order[1]
+            moved = [names[i] for i in order]
+            changed = cnv[order].copy()
+            changed[moved.index(names[first - 1]), 0] += 1
+            med, reused = extend_med_matrix(before, changed, bounds, moved, after, zero_sentinel)
+            assert reused == first - 1, (label, reused)
+            assert (np.asarray(med) == med_matrix(changed, bounds, zero_sentinel)).all(), (label, zero_sentinel)
+            want = dense_weight(matrix_columns(med), n, moved.index("cell0"))
+            (tree, got) = warm_tree(med, moved, "cell0", previous, k=2, verbose=False)
+            assert got == want, (label, zero_sentinel, got, want)
+            cold = large_tree(MEDGraph(moved, med), "cell0", k=8, verbose=False)[0]
+            assert tree == cold, (label, zero_sentinel, "warm and cold edges differ")
+            del old, med
+    finally:
+        shutil.rmtree(folder)
+    print("{}: extended matrix and warm-started tree match a full recompute, edge for edge".format(label))
+
+
+def check_large(cnv, bounds, label):
+    """large_tree on a MEDGraph (with some edges absent) and on the same graph as dicts"""
+    n = cnv.shape[0]
+    names = ["cell{}".format(i) for i in range(0, n)]
+    matrix = med_columns(cnv, bounds)(np.arange(n))
+    absent = np.random.random((n, n)) < 0.3
+    absent[0] = False
+    g = MEDGraph(names, matrix, absent)
+    want = dense_weight(graph_columns(g)[1], n, 0)
+    for graph in (g, dict((a, dict(g[a].items())) for a in names)):
+        got = large_tree(graph, "cell0", k=2, verbose=False)[1]
+        assert got == want, (label, got, want)
+    print("{}: large-graph tree verified against the dense solve".format(label))
+
+
+def main():
+    import sys
+    from ComputeDistance import read_example
+    np.random.seed(7)
+    for trial in range(0, 20):
+        n = np.random.randint(3, 60)
+        width = np.random.randint(2, 30)
+        cnv = np.random.randint(0, 5, size=(n, width)).astype(np.int8)
+        cnv[0] = 2
+        cut = sorted(np.random.choice(np.arange(1, width), size=min(3, width - 1), replace=False).tolist())
+        edges = [0] + cut + [width]
+        bounds = [(edges[i], edges[i + 1]) for i in range(0, len(edges) - 1) if edges[i] < edges[i + 1]]
+        check(cnv, bounds, "random {}x{}".format(n, width))
+        check_large(cnv, bounds, "random {}x{}".format(n, width))
+        if n > 5:
+            check_incremental(cnv, bounds, "random {}x{}".format(n, width), n // 3)
+    here = os.path.dirname(os.path.abspath(__file__))
+    for name in ("scDNA.CNV.txt", "scRNA.CNV.txt"):
+        path = os.path.join(here, "example", name)
+        if os.path.exists(path):
+            nodes = read_example(path)
+            names = list(nodes.keys())
+            cnv, bounds = profile_matrix(nodes, names)
+            check(cnv, bounds, path)
+            check_incremental(cnv, bounds, path, 10)
+    sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,15 @@
+from array import array
 from collections import *
 from copy import *
+import hashlib
+import os
 import sys
 import time
 import resource
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
 
 
 def log_step(message):
@@ -52,96 +59,108 @@ def compute_rdst_candidate(rg, root):
     log_step("Computed candidates.")
     return candidate
 
-def get_cycle(rdst_candidate):
+def get_cycles(rdst_candidate):
+    """
+    All cycles of the candidate graph in one O(V) pass: every node keeps at most one
+    in-edge, so following them is a functional graph. In each cycle a node's parent comes
+    right after it (the last node's parent is the first).
+    """
     log_step("Get cycles....")
-    node_unvisited = []
-    for node in rdst_candidate:  
-        node_unvisited.append(node)
-    while not node_unvisited == []:
-        start_node = node_unvisited.pop()  
-        stack = []  
-        trail = []  
-        stack.append(start_node)
-        while not len(stack) == 0:
-            node = stack.pop(-1)
-            for nbr in rdst_candidate[node]:
-                if nbr in trail:
-                    return tuple(trail[trail.index(nbr):]) 
-                else:
-                    stack.append(nbr)
-                    trail.append(nbr)
-                    if nbr in node_unvisited:
-                        node_unvisited.remove(nbr)
-    log_step("There are no cycles detected.")
-    return False
-
-def contract_cycle(g, cycle):
-    log_step("Contracting cycle...")
-    cstar = max(g.keys()) + "1"
+    walked = {}
+    cycles = []
+    for start in rdst_candidate:
+        trail = []
+        node = start
+        while node is not None and node not in walked:
+            walked[node] = start
+            trail.append(node)
+            node = next(iter(rdst_candidate[node]), None)
+        if node is not None and walked[node] == start:
+            cycles.append(tuple(trail[trail.index(node):]))
+    if not cycles:
+        log_step("There are no cycles detected.")
+    return cycles
+
+def contract_cycles(g, cycles, first_id):
+    """
+    Contract every cycle in one rebuild, cycle k into the new node ID first_id + k.
+    Besides the contracted graph, returns origin: the edge of g behind every edge that
+    touches a contracted node.
+    """
+    log_step("Contracting {} cycles...".format(len(cycles)))
+    comp = {}
+    for k, cycle in enumerate(cycles):
+        for node in cycle:
+            comp[node] = first_id + k
     contracted_graph = {}
-    contracted_graph[cstar] = {}
+    for k in range(0, len(cycles)):
+        contracted_graph[first_id + k] = {}
     for node in g:
-        if not node in cycle:
+        if not node in comp:
             contracted_graph[node] = {}
+    origin = {}
     for node in g:
+        a_node = comp.get(node, node)
+        out_edge = contracted_graph[a_node]
         for nbr in g[node]:
-            if node in cycle:
-                if nbr in cycle:
-                    pass
-                else: 
-                    if nbr in contracted_graph[cstar]:
-                        contracted_graph[cstar][nbr] = min(contracted_graph[cstar][nbr], g[node][nbr])
-                    else:
-                        contracted_graph[cstar][nbr] = g[node][nbr]
-            else:
-                if nbr in cycle:
-                    if cstar in contracted_graph[node]:
-                        contracted_graph[node][cstar] = min(contracted_graph[node][cstar], g[node][nbr])
-                    else:
-                        contracted_graph[node][cstar] = g[node][nbr]
-                else:
-                    contracted_graph[node][nbr] = g[node][nbr]
-
-    log_step("Cycle contracted.")
-    return contracted_graph, cstar
-
-
-def expand_graph(g, rdst_candidate, cycle, cstar):
-    log_step("Expanding cycle...")
+            b_node = comp.get(nbr, nbr)
+            if a_node == b_node:
+                continue
+            if a_node == node and b_node == nbr:
+                out_edge[nbr] = g[node][nbr]
+            elif b_node not in out_edge or g[node][nbr] < out_edge[b_node]:
+                out_edge[b_node] = g[node][nbr]
+                origin[(a_node, b_node)] = (node, nbr)
+
+    log_step("Cycles contracted.")
+    return contracted_graph, origin
+
+
+def pack_origin(origin):
+    """the origin dict of contract_cycles as one flat array: a_node, b_node, node, nbr per contracted edge"""
+    flat = array("i")
+    for ((a_node, b_node), (node, nbr)) in origin.items():
+        flat.extend((a_node, b_node, node, nbr))
+    return flat
+
+
+def unpack_origin(flat, edges):
+    """{(a_node, b_node): (node, nbr)} of the contracted edges among edges, read from a pack_origin array"""
+    found = {}
+    for i in range(0, len(flat), 4):
+        key = (flat[i], flat[i + 1])
+        if key in edges:
+            found[key] = (flat[i + 2], flat[i + 3])
+    return found
+
+
+def expand_graph(nodes, rdst_candidate, cycles, first_id, origin):
+    """
+    Tree over nodes (the graph before contract_cycles) from the tree of the contracted graph.
+    Edges keep their reduced weight, which is 0 for every tree edge. origin is the dict of
+    contract_cycles or its pack_origin array.
+    """
+    log_step("Expanding cycles...")
+    if isinstance(origin, array):
+        origin = unpack_origin(origin, set((a_node, b_node) for a_node in rdst_candidate
+                                           for b_node in rdst_candidate[a_node]))
     restored_graph = {}
-    for node in g:
+    for node in nodes:
         restored_graph[node] = {}
-    for node in rdst_candidate:  
-        for nbr in rdst_candidate[node]:
-            if node == cstar:  
-                min = float('inf')
-                for orig in cycle:
-                    if nbr in g[orig]:
-                        if g[orig][nbr] < min:
-                            min = g[orig][nbr]
-                            point = orig
-                restored_graph[point][nbr] = min
-            else:
-                if nbr == cstar:  
-                    min = float('inf')
-                    for orig_nbr in g[node]:
-                        if orig_nbr in cycle:
-                            if g[node][orig_nbr] < min:
-                                min = g[node][orig_nbr]
-                                start_pt = orig_nbr  
-                    restored_graph[node][start_pt] = min
-                else: 
-                    restored_graph[node][nbr] = g[node][nbr]
-    for index in range(len(cycle) - 1): 
-        restored_graph[cycle[index + 1]][cycle[index]] = g[cycle[index + 1]][cycle[index]]
-    restored_graph[cycle[0]][cycle[-1]] = g[cycle[0]][cycle[-1]]
-    index = cycle.index(start_pt)
-    if index == len(cycle) - 1:
-        restored_graph[cycle[0]].pop(cycle[index])
-    else:
-        restored_graph[cycle[index + 1]].pop(cycle[index])
+    entry = {}  # contracted cycle -> the member its tree in-edge enters
+    for a_node in rdst_candidate:  
+        for b_node in rdst_candidate[a_node]:
+            (node, nbr) = origin.get((a_node, b_node), (a_node, b_node))
+            restored_graph[node][nbr] = rdst_candidate[a_node][b_node]
+            if b_node >= first_id:
+                entry[b_node] = nbr
+    for k, cycle in enumerate(cycles):
+        for index in range(0, len(cycle)):
+            if cycle[index] != entry[first_id + k]:
+                parent = cycle[(index + 1) % len(cycle)]
+                restored_graph[parent][cycle[index]] = 0
 
-    log_step("Cycle expanded")
+    log_step("Cycles expanded")
     return restored_graph
 
 def bfs(g, startnode):
@@ -164,7 +183,22 @@ def bfs(g, startnode):
     log_step("BFS computed.")
     return dist
 
-def compute_rdmst_iterative(g, root):
+def encode_graph(g):
+    """names and the same graph on dense integer IDs (names[i] is node i)"""
+    names = list(g.keys())
+    at = dict((name, i) for (i, name) in enumerate(names))
+    gi = {}
+    for node in g:
+        gi[at[node]] = dict((at[nbr], w) for (nbr, w) in g[node].items())
+    return names, gi
+
+def compute_rdmst_iterative(g, root, inplace=False, checkpoint=None, every=10, seconds=1800):
+    """
+    (rdmst, weight) of g from root. inplace=True solves with rdmst_helper_inplace, which
+    keeps one working graph instead of a graph per contraction level, read from g through an
+    IDView so that g and the working graph are the only edge sets held. checkpoint, every and
+    seconds are passed on to compute_rdmst_helper_iterative.
+    """
     
     if root not in g:
         print("The root node does not exist")
@@ -182,51 +216,201 @@ def compute_rdmst_iterative(g, root):
             sys.stdout.flush()
             return
     
-    rdmst = compute_rdmst_helper_iterative(g, root)
+    # the solver works on integer IDs, names come back only in the result
+    if inplace:
+        names = list(g.keys())
+        rdmst_ids = rdmst_helper_inplace(IDView(g, names), names.index(root))
+    else:
+        names, gi = encode_graph(g)
+        rdmst_ids = compute_rdmst_helper_iterative(gi, names.index(root), checkpoint, every, seconds)
     
     log_step("[STEP 4] Computing total weight of RDMST...")
+    rdmst = {}
     rdmst_weight = 0
-    for node in rdmst:
-        for nbr in rdmst[node]:
-            rdmst[node][nbr] = g[node][nbr]
-            rdmst_weight += rdmst[node][nbr]
+    for node in rdmst_ids:
+        rdmst[names[node]] = {}
+        for nbr in rdmst_ids[node]:
+            rdmst[names[node]][names[nbr]] = g[names[node]][names[nbr]]
+            rdmst_weight += rdmst[names[node]][names[nbr]]
     log_step("[RESULT] Total weight: {}".format(rdmst_weight))
     
     return rdmst, rdmst_weight
 
-def compute_rdmst_helper_iterative(g, root):
+def compute_rdmst_helper_iterative(g, root, checkpoint=None, every=10, seconds=1800):
+    """
+    g uses integer node IDs 0..n-1. Every round contracts all cycles of the current
+    min-incoming-edge graph at once; the rounds are then expanded in reverse order.
+    The stack keeps one compact frame per round (nodes, cycles, first_id, origin), not the
+    graphs; origin is packed into a flat integer array (pack_origin), 4 machine words per
+    contracted edge instead of a dict of tuples. With a checkpoint path, the current graph and the stack are saved there every
+    `every` rounds or `seconds` seconds, and a later call on the same graph resumes from it.
+    """
     log_step("Starting iterative RDMST helper...")
-    stack = [(g, None, None, None)]  # (graph, rdst_candidate, cycle, cstar)
-    log_step("[STEP 2] Initializing contraction stack...")
+    stack = []  # (nodes, cycles, first_id, origin) of every contracted round
+    current_g = g
+    if checkpoint is not None:
+        key = graph_fingerprint(g, root)
+        state = load_checkpoint(checkpoint, key)
+        if state is not None:
+            (current_g, stack) = state
+            log_step("[RESUME] {} rounds restored from {}".format(len(stack), checkpoint))
+    log_step("[STEP 2] Contracting rounds...")
+    saved = (len(stack), time.time())
+    while True:
+        rgraph = reverse_g(current_g)
+        update_dege(rgraph, root)
+        rdst_candidate = compute_rdst_candidate(rgraph, root)
+        cycles = get_cycles(rdst_candidate)
+        if not cycles:
+            log_step("[INFO] No cycle detected. Candidate is final after {} rounds.".format(len(stack)))
+            break
+        log_step("[ROUND {}] {} cycles over {} of {} nodes".format(
+            len(stack) + 1, len(cycles), sum(len(cycle) for cycle in cycles), len(current_g)))
+        g_copy = reverse_g(rgraph)
+        del rgraph
+        first_id = max(g_copy.keys()) + 1
+        contracted_g, origin = contract_cycles(g_copy, cycles, first_id)
+        stack.append((list(current_g.keys()), cycles, first_id, pack_origin(origin)))
+        del origin
+        current_g = contracted_g
+        if checkpoint is not None and (len(stack) - saved[0] >= every or time.time() - saved[1] >= seconds):
+            save_checkpoint(checkpoint, key, current_g, stack)
+            saved = (len(stack), time.time())
 
-    results = []
-    iteration = 0 
+    result = reverse_g(rdst_candidate)
     while stack:
-        iteration += 1
-        current_g, rdst_candidate, cycle, cstar = stack.pop()
-        
-        log_step("[ITERATION {}] Processing graph with {} nodes".format(iteration, len(current_g)))
-
-        if rdst_candidate is None:
-            rgraph = reverse_g(current_g)
-            update_dege(rgraph, root)
-            rdst_candidate = compute_rdst_candidate(rgraph, root)
-            cycle = get_cycle(rdst_candidate)
-            if not cycle:
-                log_step("[INFO] No cycle detected. Candidate is final.")
-                results.append(reverse_g(rdst_candidate))
-                continue
-            log_step("[INFO] Cycle detected: {}".format(cycle))
-            g_copy = deepcopy(rgraph)
-            g_copy = reverse_g(g_copy)
-
-            contracted_g, new_cstar = contract_cycle(g_copy, cycle)
-            stack.append((current_g, rdst_candidate, cycle, new_cstar))
-            stack.append((contracted_g, None, None, None))
-        else:
-            new_rdst_candidate = results.pop()
-            expanded = expand_graph(reverse_g(reverse_g(current_g)), new_rdst_candidate, cycle, cstar)
-            results.append(expanded)
+        (nodes, cycles, first_id, origin) = stack.pop()
+        result = expand_graph(nodes, result, cycles, first_id, origin)
+    if checkpoint is not None and os.path.exists(checkpoint):
+        os.remove(checkpoint)
     log_step("Iterative helper completed.")
-    return results.pop()
+    return result
+
+def graph_fingerprint(g, root):
+    """digest of the root and every edge, so a checkpoint is only resumed on the graph it came from"""
+    digest = hashlib.sha1(repr(root).encode("utf-8"))
+    for node in g:
+        digest.update(repr((node, list(g[node].items()))).encode("utf-8"))
+    return digest.hexdigest()
+
+def save_checkpoint(path, key, current_g, stack):
+    """pickle the contraction state to path, through a temporary file so a kill never leaves half a checkpoint"""
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as out:
+        pickle.dump((key, current_g, stack), out, -1)
+        out.flush()
+        os.fsync(out.fileno())
+    os.rename(tmp, path)
+    log_step("[CHECKPOINT] {} rounds saved to {}".format(len(stack), path))
+
+def load_checkpoint(path, key):
+    """(current_g, stack) saved by save_checkpoint for the graph with fingerprint key, or None"""
+    if not os.path.exists(path):
+        return None
+    with open(path, "rb") as inp:
+        (saved_key, current_g, stack) = pickle.load(inp)
+    if saved_key != key:
+        log_step("[INFO] {} belongs to another graph, starting from scratch".format(path))
+        return None
+    return current_g, stack
+
+class IDView:
+    """integer-ID view of a graph with named nodes (names[i] is node i), each row relabelled when it is read"""
+    def __init__(self, g, names):
+        self.g = g
+        self.names = names
+        self.at = dict((name, i) for (i, name) in enumerate(names))
+
+    def keys(self):
+        return range(0, len(self.names))
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, node):
+        at = self.at
+        return dict((at[nbr], w) for (nbr, w) in self.g[self.names[node]].items())
+
+
+def rdmst_helper_inplace(g, root, log=log_step):
+    """
+    Same rounds as compute_rdmst_helper_iterative on a single working graph. Each cycle is
+    contracted by rewriting the edges of its members in place; the rewrites go to an undo log
+    (members, their cycle parents, and which member every rewritten edge came from), and the
+    log is replayed in reverse to expand the tree. g uses integer node IDs (an IDView of a named
+    graph works as well) and is not modified; every row of g is read once into the working graph,
+    the in-edge dicts plus an out-neighbour set per node, so no other copy of the edges is made.
+    Returns the tree as {parent: {child: 0}} over every node, weights are filled in by the caller.
+    """
+    nodes = list(g.keys())
+    inn = dict((node, {}) for node in nodes)  # in-edges with reduced weights
+    out = dict((node, set()) for node in nodes)
+    for node in nodes:
+        row = g[node]
+        for nbr in row:
+            if nbr != root and nbr != node:
+                inn[nbr][node] = row[nbr]
+                out[node].add(nbr)
+        del row
+    next_id = max(nodes) + 1
+    undo = []
+    rounds = 0
+    while True:
+        best = {}
+        for node in inn:
+            if node != root:
+                if not inn[node]:
+                    raise ValueError("node {} is not reachable from the root".format(node))
+                minimum = min(inn[node].values())
+                for in_nbr in inn[node]:
+                    inn[node][in_nbr] -= minimum
+                    if node not in best and inn[node][in_nbr] == 0:
+                        best[node] = in_nbr
+        cycles = get_cycles(dict((node, {best[node]: 0} if node in best else {}) for node in inn))
+        if not cycles:
+            break
+        rounds += 1
+        log("[ROUND {}] {} cycles over {} of {} nodes, contracted in place".format(
+            rounds, len(cycles), sum(len(cycle) for cycle in cycles), len(inn)))
+        for cycle in cycles:
+            cstar = next_id
+            next_id += 1
+            members = set(cycle)
+            inn_c, entry, leave = {}, {}, {}
+            for m in cycle:
+                for (u, w) in inn.pop(m).items():
+                    out[u].discard(m)
+                    if u not in members and (u not in inn_c or w < inn_c[u]):
+                        inn_c[u] = w
+                        entry[u] = m
+            out_c = set()
+            for m in cycle:
+                for x in out.pop(m):
+                    w = inn[x].pop(m)
+                    if cstar not in inn[x] or w < inn[x][cstar]:
+                        inn[x][cstar] = w
+                        leave[x] = m
+                    out_c.add(x)
+            inn[cstar] = inn_c
+            out[cstar] = out_c
+            for u in inn_c:
+                out[u].add(cstar)
+            undo.append((cstar, dict((m, best[m]) for m in cycle), entry, leave))
+    log("[INFO] No cycle left after {} rounds, replaying {} contractions".format(rounds, len(undo)))
+
+    parent = best
+    for (cstar, cycle_parent, entry, leave) in reversed(undo):
+        for (x, m) in leave.items():
+            if parent.get(x) == cstar:
+                parent[x] = m
+        top = parent.pop(cstar)
+        parent.update(cycle_parent)
+        parent[entry[top]] = top
+    tree = dict((node, {}) for node in nodes)
+    for (child, par) in parent.items():
+        tree[par][child] = 0
+    return tree
 
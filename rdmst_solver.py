@@ -3,7 +3,8 @@ import gc
 import tracemalloc
 import psutil
 from datetime import datetime as dt_
-from concurrent.futures import ThreadPoolExecutor
+from SparseRDMST import large_tree
+from ParallelRDMST import rdmst_pool
 
 
 def pc_mem():
@@ -13,8 +14,8 @@ def pc_mem():
     return mem_bytes / 1e9  # Convert to GB
 
 
-def get_dynamic_chunk_size(base_chunk=5000, memory_fraction=0.1):
-    """Determine chunk size based on available RAM."""
+def get_dense_limit(base_chunk=5000, memory_fraction=0.1):
+    """Largest graph (in nodes) handed to the contraction solvers, based on available RAM."""
     available_mem = psutil.virtual_memory().available / 1e9  # GB
     # Assume each node costs ~1MB (adjust if needed)
     estimated_nodes_per_gb = 1000
@@ -22,33 +23,24 @@ def get_dynamic_chunk_size(base_chunk=5000, memory_fraction=0.1):
     return max(base_chunk, dynamic_size)
 
 
-def compute_rdmst(g, root, recursive=True, parallel=False, max_workers=4):
+def compute_rdmst(g, root, recursive=True, parallel=False, max_workers=4, max_dense=None):
+    # graphs over max_dense nodes (default get_dense_limit()) are solved exactly on streamed
+    # candidate edges, with the tree verified against the full graph
+    max_dense = get_dense_limit() if max_dense is None else max_dense
+    if len(g) > max_dense:
+        print(f"Graph too large ({len(g)} nodes) for the contraction solvers, solving on candidate edges...")
+        return large_tree(g, root)[0]
+
     tracemalloc.start()
     st_mem = pc_mem()
     t0 = dt_.now()
     print(f"Starting RD-MST computation. Initial memory: {st_mem:.2f} GB")
 
-    chunk_size = get_dynamic_chunk_size()
-    print(f"Dynamic chunk size set to {chunk_size} nodes based on available RAM.")
-
-    if len(g) > chunk_size:
-        print(f"Graph too large ({len(g)} nodes). Splitting into chunks of {chunk_size}...")
-        chunks = chunk_graph(g, chunk_size)
-        results = []
-        for i, subgraph in enumerate(chunks, 1):
-            print(f"\nProcessing chunk {i}/{len(chunks)}... Current memory: {pc_mem():.2f} GB")
-            if recursive:
-                rdmst_chunk = rdmst_recursor(subgraph, root, 0, t0, dt_.now(), st_mem)
-            else:
-                rdmst_chunk = rdmst_iterative(subgraph, root, parallel=parallel, max_workers=max_workers)
-            results.append(rdmst_chunk)
-        rdmst = merge_chunks(results)
+    print(f"Processing full graph. Current memory: {pc_mem():.2f} GB")
+    if recursive:
+        rdmst = rdmst_recursor(g, root, 0, t0, dt_.now(), st_mem)
     else:
-        print(f"Processing full graph. Current memory: {pc_mem():.2f} GB")
-        if recursive:
-            rdmst = rdmst_recursor(g, root, 0, t0, dt_.now(), st_mem)
-        else:
-            rdmst = rdmst_iterative(g, root, parallel=parallel, max_workers=max_workers)
+        rdmst = rdmst_iterative(g, root, parallel=parallel, max_workers=max_workers)
 
     print(f"\nTotal time: {dt_.now()-t0}")
     print(f"Final memory usage: {pc_mem():.2f} GB")
@@ -61,25 +53,6 @@ def log_memory():
     current, peak = tracemalloc.get_traced_memory()
     print(f"Memory usage: {current/1e9:.2f} GB; Peak: {peak/1e9:.2f} GB")
 
-
-def chunk_graph(g, chunk_size):
-    """Split graph into chunks for memory-safe processing."""
-    nodes = list(g.keys())
-    chunks = []
-    for i in range(0, len(nodes), chunk_size):
-        sub_nodes = nodes[i:i+chunk_size]
-        subgraph = {n: {nbr: g[nbr] for nbr in g[n] if nbr in sub_nodes} for n in sub_nodes}
-        chunks.append(subgraph)
-    return chunks
-
-
-def merge_chunks(chunks):
-    """Merge processed chunks back into a single graph."""
-    merged = {}
-    for chunk in chunks:
-        merged.update(chunk)
-    return merged
-
 def rdmst_recursor(g__inputed, root_node, recurr_idx, t0, ts, st_mem):
     recurr_idx += 1
     if recurr_idx % 5 == 0:
@@ -107,6 +80,9 @@ def rdmst_recursor(g__inputed, root_node, recurr_idx, t0, ts, st_mem):
         return g_expanded
 
 def rdmst_iterative(g, root, parallel=False, max_workers=4):
+    if parallel:
+        # per-round edge passes over a pool of max_workers processes
+        return rdmst_pool(g, root, workers=max_workers)
     stack = [(g, root)]
     result_graph = None
     t0 = dt_.now()
@@ -126,12 +102,7 @@ def rdmst_iterative(g, root, parallel=False, max_workers=4):
             g_contract = reverse__graph(g_rev_cont)
             g___pruned, loop_nodes = prune____graph(g_contract, loop_in_gr)
 
-            if parallel:
-                with ThreadPoolExecutor(max_workers=max_workers) as executor:
-                    future = executor.submit(expand___graph, g_contract, g___pruned, loop_in_gr, loop_nodes)
-                    expanded_graph = future.result()
-            else:
-                expanded_graph = expand___graph(g_contract, g___pruned, loop_in_gr, loop_nodes)
+            expanded_graph = expand___graph(g_contract, g___pruned, loop_in_gr, loop_nodes)
 
             stack.append((expanded_graph, root_node))
 
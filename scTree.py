@@ -2,6 +2,9 @@
 from optparse import OptionParser
 from Readfile import *
 from Edmonds import *
+from ComputeDistance import SegmentTable
+from Solvers import solve, BACKENDS
+from Kruskal import triage_tree, gap_report
 import os,sys
 import subprocess
 #get the absolute path of input file
@@ -53,12 +56,26 @@ def main():
                   help="the number of genes you want to merge when you input copy number profile inferred from scRNA-seq. Default 30.")
     op.add_option("-R","--Permutation",dest="Permutation",type="str",
                   help="Whether reconstructed permuted tree (T) or not (F). If not, permuted copy number profile will be used to perform LSA. Default value is F due to time cost.")
+    op.add_option("-T","--threads",dest="threads",type="int",default=1,
+                  help="Number of processes used to compute MED distances. Default 1.")
+    op.add_option("-S","--solver",dest="solver",type="choice",choices=["auto"]+sorted(BACKENDS),default="edmonds",
+                  help="Tree solver backend (see Solvers.py), all with the same tree weight: "+"; ".join(name+": "+BACKENDS[name][1] for name in sorted(BACKENDS))+"; auto picks one from the graph size, density and free memory. Default edmonds.")
+    op.add_option("-E","--engine",dest="engine",type="choice",choices=["rdmst","mst"],default="rdmst",
+                  help="Tree engine: rdmst (exact minimum arborescence, see -S) or mst (minimum spanning tree hung from the root, a fast approximate lineage for triage). Default rdmst.")
+    op.add_option("--gap",dest="gap",action="store_true",default=False,
+                  help="With -E mst, also solve the exact RDMST with -S and report the weight gap of the triage tree.")
+    op.add_option("-C","--checkpoint",dest="checkpoint",type="int",default=0,
+                  help="With -S edmonds only. Save the solver state to rdmst.checkpoint in the output path every C contraction rounds; rerunning into the same output path resumes from it. Default 0 (no checkpoints).")
+    op.add_option("--checkpoint-minutes",dest="checkpoint_minutes",type="float",default=30,
+                  help="With -C, also save the state when this many minutes passed since the last save. Default 30.")
 
     (options,args) = op.parse_args()
     # check input parameters. Package path, input file, data type and genome version are required.
     if not options.Path or not options.Input or not options.Datatype or not options.Genome:
         op.print_help()
         sys.exit(1)
+    if options.checkpoint > 0 and options.solver != "edmonds":
+        op.error("-C checkpoints only the edmonds solver, use it with -S edmonds")
     
     print "Starting process"
 
@@ -107,14 +124,24 @@ def main():
 
     #Identifying root node from input file.
     #If a diploidy genome is not input, will add an extra diploidy node as root
-    (nodes,root) = read(CNVfile)
+    #Identical chromosome vectors are interned so MED is computed once per distinct pair
+    table = SegmentTable()
+    (nodes,root) = read(CNVfile,table)
     node_name_list = nodes.keys()
 
     #calculation of MED distance
-    g = create_tree(nodes, node_name_list,root)
+    g = create_tree(nodes, node_name_list,root,threads=options.threads,table=table)
 
     #Inference of tree and output
-    result = compute_rdmst_iterative(g, root)
+    if options.engine == "mst":
+        result = triage_tree(g, root)
+        if options.gap:
+            print gap_report(result[1], solve(g, root, options.solver, threads=options.threads)[1])
+    elif options.checkpoint > 0:
+        result = solve(g, root, options.solver, threads=options.threads, checkpoint=outpath+"/rdmst.checkpoint",
+                       every=options.checkpoint, seconds=60*options.checkpoint_minutes)
+    else:
+        result = solve(g, root, options.solver, threads=options.threads)
     write=open(writename,'w')
     tree=result[0]
     out1="from"+"\t"+"to"+"\t"+"dist"
@@ -149,10 +176,11 @@ def main():
         #Infer permutation tree
         for j in range(1,101):
             permutefile=permutationPath+"/permute."+str(j)+".CNV.txt"
-            (nodes,root) = read(permutefile)
+            table = SegmentTable()
+            (nodes,root) = read(permutefile,table,sidecar=False)  # read once, no sidecar
             node_name_list = nodes.keys()
-            g = create_tree(nodes, node_name_list,root)
-            result = compute_rdmst_iterative(g, root)
+            g = create_tree(nodes, node_name_list,root,threads=options.threads,table=table)
+            result = solve(g, root, options.solver, threads=options.threads)
             permuteTree=permutefile+".celltree.txt"
             write=open(permuteTree,'w')
             tree=result[0]
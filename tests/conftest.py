@@ -0,0 +1,79 @@
+##############################################################################################################################
+# shared fixtures of the test suite (python -m pytest -q from the repository root): the example inputs, and small
+# segmented files and genes x cells matrices written to a temporary folder
+##############################################################################################################################
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, ROOT)
+EXAMPLES = ("scDNA.CNV.txt", "scRNA.CNV.txt")
+
+
+@pytest.fixture(scope="session", params=EXAMPLES)
+def example_nodes(request):
+    """(name, {cell: per-chromosome lists}) of one example input"""
+    from ComputeDistance import read_example
+    return request.param, read_example(os.path.join(ROOT, "example", request.param))
+
+
+@pytest.fixture(scope="session")
+def example_profiles(example_nodes):
+    """(name, cells, cnv, bounds) of one example input"""
+    from DistanceMatrix import profile_matrix
+    (name, nodes) = example_nodes
+    cells = list(nodes.keys())
+    cnv, bounds = profile_matrix(nodes, cells)
+    return name, cells, cnv, bounds
+
+
+@pytest.fixture(scope="session", params=[False, True], ids=["no-sentinel", "sentinel"])
+def example_graph(request, example_profiles):
+    """(label, MEDGraph) of one example input, with and without the lost-copy sentinel"""
+    from DistanceMatrix import med_columns, MEDGraph
+    (name, cells, cnv, bounds) = example_profiles
+    matrix = med_columns(cnv, bounds, request.param)(np.arange(len(cells)))
+    return "{} sentinel {}".format(name, request.param), MEDGraph(cells, matrix)
+
+
+def write_segments(path, names, values, chromosomes=("chr1", "chr2", "chrX")):
+    """segmented file (header of chr<N>_<k> segment names, then name and copy numbers per cell) at path"""
+    width = values.shape[1]
+    header = ["{}_{}".format(chromosomes[k * len(chromosomes) // width], k) for k in range(0, width)]
+    with open(path, "w") as data:
+        data.write("\t".join(header) + "\n")
+        for (name, row) in zip(names, values):
+            data.write(name + "\t" + "\t".join(str(x) for x in row) + "\n")
+    return path
+
+
+@pytest.fixture
+def segments(tmp_path):
+    """factory: segmented file of n random cells (many sharing chromosome vectors) in tmp_path, returns its path"""
+    def make(n=40, width=30, seed=0, name="cells.CNV.txt"):
+        rng = np.random.default_rng(seed)
+        values = rng.integers(1, 4, size=(6, width))[rng.integers(0, 6, n)]
+        values[rng.random(values.shape) < 0.02] = 0
+        return write_segments(str(tmp_path / name), ["cell{}".format(i) for i in range(0, n)], values)
+    return make
+
+
+@pytest.fixture
+def cell_matrix(tmp_path):
+    """factory: genes x cells matrix file in tmp_path with duplicates {copy: original}, returns (path, DataFrame)"""
+    def make(duplicates):
+        rng = np.random.default_rng(0)
+        df = pd.DataFrame(rng.integers(0, 5, size=(25, 8)).astype(float),
+                          index=["gene{}".format(i) for i in range(0, 25)],
+                          columns=["cell{}".format(j) for j in range(0, 8)])
+        for (copy, original) in duplicates.items():
+            df[copy] = df[original]
+        path = str(tmp_path / "cells.txt")
+        df.to_csv(path, sep="\t")
+        return path, df
+    return make
@@ -0,0 +1,46 @@
+import os
+
+from ResultCache import ResultCache, local_modules, result_key
+
+
+def test_key_follows_file_settings_and_code(segments, tmp_path, monkeypatch):
+    code = tmp_path / "code"
+    code.mkdir()
+    (code / "cachesolver.py").write_text("def solve():\n    from cachehelper import helper\n")
+    (code / "cachehelper.py").write_text("def helper():\n    return 1\n")
+    monkeypatch.syspath_prepend(str(code))
+    path = segments()
+    modules = local_modules(["cachesolver"])
+    assert modules == ["cachehelper", "cachesolver"]
+    key = result_key(path, ("rdmst", "sp1"), modules)
+    assert result_key(path, ("rdmst", "sp1"), modules) == key
+    assert result_key(path, ("rdmst", "tarjan"), modules) != key
+    assert result_key(segments(seed=1, name="other.CNV.txt"), ("rdmst", "sp1"), modules) != key
+    with open(path, "a") as data:
+        data.write("cell99\t" + "\t".join(["2"] * 30) + "\n")
+    assert result_key(path, ("rdmst", "sp1"), modules) != key
+    changed = result_key(path, ("rdmst", "sp1"), modules)
+    (code / "cachehelper.py").write_text("def helper():\n    return 2\n")
+    assert result_key(path, ("rdmst", "sp1"), modules) != changed
+
+
+def test_tree_code_is_in_the_key():
+    modules = local_modules(["SP1_SCT_UTIL", "Solvers", "Kruskal"])
+    for name in ("Readfile", "Arborescence", "ParallelRDMST", "mdmst_copilot_rewrite3", "SparseRDMST", "DistanceMatrix"):
+        assert name in modules
+
+
+def test_least_recently_used_entries_are_evicted(segments, tmp_path):
+    paths = [segments(seed=i, name="cells{}.CNV.txt".format(i)) for i in range(0, 4)]
+    keys = ["key{}".format(i) for i in range(0, 4)]
+    cache = ResultCache(str(tmp_path / "cache"), max_bytes=3 * max(os.path.getsize(path) for path in paths))
+    out = str(tmp_path / "out.txt")
+    assert not cache.fetch(keys[0], {"tree": out})
+    for (i, key) in enumerate(keys[:3]):
+        cache.store(key, {"tree": paths[i]})
+        os.utime(os.path.join(cache.directory, key), (1000 + i, 1000 + i))
+    assert cache.fetch(keys[0], {"tree": out})
+    assert open(out).read() == open(paths[0]).read()
+    cache.store(keys[3], {"tree": paths[3]})
+    assert sorted(cache.entries()) == [keys[0], keys[2], keys[3]]
+    assert cache.lookup(keys[1]) is None
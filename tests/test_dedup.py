@@ -0,0 +1,22 @@
+from SP1_SCT_UTIL import attach_duplicates, dedup_cells, expand_segments
+
+
+def test_round_trip_restores_every_cell(cell_matrix, tmp_path):
+    (path, df) = cell_matrix({"copy0": "cell3", "copy1": "cell3", "copy2": "cell5"})
+    (cells, dup_relationship) = dedup_cells(df)
+    seg_path = str(tmp_path / "segments.txt")
+    with open(seg_path, "w") as data:
+        data.write("chr1_1\tchr1_2\n")
+        for (j, cell) in enumerate(cells):
+            data.write("{}\t{}\t{}\n".format(cell, j, j + 1))
+    out_path = str(tmp_path / "expanded.txt")
+    expand_segments(seg_path, out_path, dup_relationship)
+    lines = dict((line.split("\t", 1)[0], line.split("\t", 1)[1]) for line in open(out_path).read().splitlines()[1:])
+    assert sorted(lines) == sorted(df.columns)
+    for (par_cell, dup_cell) in zip(dup_relationship["par_cell"], dup_relationship["dup_cell"]):
+        assert lines[dup_cell] == lines[par_cell]
+    tree = {"root": {"cell3": 2, "cell1": 1}, "cell3": {"cell5": 1}}
+    assert attach_duplicates(tree, dup_relationship) == 3
+    assert tree["cell3"] == {"cell5": 1, "copy0": 0, "copy1": 0}
+    assert tree["cell5"] == {"copy2": 0}
+    assert attach_duplicates({"root": {}}, dup_relationship) == 0
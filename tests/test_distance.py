@@ -0,0 +1,92 @@
+import random
+
+import pytest
+
+import SP1_SCT_UTIL
+from ComputeDistance import (EXCEEDED, SegmentTable, best_parents, dist, dist_bounded, distcalc, distcalc_peeloff,
+                             disthelper, disthelper_peeloff, profile_extremes, random_segment, zerodisthelper,
+                             zerodisthelper_peeloff)
+
+
+def random_pairs(length, count=300, zero_rate=0.1, seed=0):
+    rng_state = random.getstate()
+    random.seed(seed * 1000 + length)
+    try:
+        return [(random_segment(length, zero_rate=zero_rate), random_segment(length, zero_rate=zero_rate))
+                for k in range(0, count)]
+    finally:
+        random.setstate(rng_state)
+
+
+@pytest.mark.parametrize("length", [1, 2, 3, 5, 10, 50])
+@pytest.mark.parametrize("zero_rate", [0.0, 0.1, 0.4])
+def test_closed_form_matches_peeloff_on_random_segments(length, zero_rate):
+    for (s1, s2) in random_pairs(length, zero_rate=zero_rate):
+        expected = distcalc_peeloff(s1, s2)
+        assert distcalc(s1, s2) == expected, (s1, s2)
+        assert SP1_SCT_UTIL.distcalc(s1, s2) == expected, (s1, s2)
+        assert zerodisthelper(s1, s2) == zerodisthelper_peeloff(s1, s2), (s1, s2)
+        assert disthelper(s1, s2) == disthelper_peeloff(s1, s2), (s1, s2)
+
+
+def test_lost_copy_is_never_regained():
+    assert zerodisthelper([2, 0, 2], [2, 1, 2]) == zerodisthelper_peeloff([2, 0, 2], [2, 1, 2]) == 1000000
+    assert zerodisthelper([2, 1, 2], [2, 0, 2]) == zerodisthelper_peeloff([2, 1, 2], [2, 0, 2]) == 1
+
+
+def test_closed_form_matches_peeloff_on_every_example_pair(example_nodes):
+    (name, nodes) = example_nodes
+    names = sorted(nodes)
+    for a in names:
+        for b in names:
+            for (s1, s2) in zip(nodes[a], nodes[b]):
+                assert distcalc(s1, s2) == distcalc_peeloff(s1, s2), (name, a, b)
+                assert zerodisthelper(s1, s2) == zerodisthelper_peeloff(s1, s2), (name, a, b)
+                assert disthelper(s1, s2) == disthelper_peeloff(s1, s2), (name, a, b)
+
+
+@pytest.mark.parametrize("chrom_dist", [disthelper, distcalc], ids=["sentinel", "no-sentinel"])
+def test_segment_table_matches_dist(example_nodes, chrom_dist):
+    (name, nodes) = example_nodes
+    names = sorted(nodes)
+    table = SegmentTable(chrom_dist=chrom_dist)
+    for a in names:
+        assert table.intern(a, nodes[a]) == nodes[a]
+    assert table.distinct_counts() == [len(set(tuple(nodes[a][c]) for a in names)) for c in range(0, len(nodes[names[0]]))]
+    for a in names:
+        for b in names:
+            expected = sum(chrom_dist(s1, s2) for (s1, s2) in zip(nodes[a], nodes[b]))
+            assert table.dist(a, b) == expected, (name, a, b)
+    # every distinct pair of vectors is computed once, every other lookup is a hit
+    assert table.misses == sum(len(cache) for cache in table.cache)
+    assert table.hits + table.misses == len(names) ** 2 * len(table.vectors)
+
+
+def test_dist_bounded_is_exact_up_to_the_bound(example_nodes):
+    (name, nodes) = example_nodes
+    names = sorted(nodes)[:20]
+    table = SegmentTable()
+    for a in names:
+        table.intern(a, nodes[a])
+    extremes = dict((a, profile_extremes(nodes[a])) for a in names)
+    for a in names:
+        for b in names:
+            d = dist(nodes[a], nodes[b])
+            for bound in (0, d - 1, d, d + 1, 2 * d + 10):
+                expected = d if d <= bound else EXCEEDED
+                assert dist_bounded(nodes[a], nodes[b], bound) == expected, (name, a, b, bound)
+                assert dist_bounded(nodes[a], nodes[b], bound, ext1=extremes[a], ext2=extremes[b]) == expected
+                assert table.dist_bounded(a, b, bound) == expected, (name, a, b, bound)
+                assert table.dist_bounded(a, b, bound, extremes[a], extremes[b]) == expected
+
+
+def test_best_parents_matches_brute_force(example_nodes):
+    (name, nodes) = example_nodes
+    names = sorted(nodes)
+    extremes = dict((a, profile_extremes(nodes[a])) for a in names)
+    for child in names:
+        expected = sorted(dist(nodes[parent], nodes[child]) for parent in names if parent != child)[:3]
+        found = best_parents(nodes, child, names, k=3, extremes=extremes)
+        assert [d for (d, parent) in found] == expected, (name, child)
+        for (d, parent) in found:
+            assert dist(nodes[parent], nodes[child]) == d
@@ -0,0 +1,41 @@
+import os
+
+import numpy as np
+import pytest
+
+from DistanceMatrix import StopRun, med_matrix, med_matrix_memmap
+
+
+@pytest.mark.parametrize("zero_sentinel", [False, True])
+def test_resume_after_interrupted_run(example_profiles, zero_sentinel, tmp_path):
+    (name, cells, cnv, bounds) = example_profiles
+    path = str(tmp_path / "med.npy")
+
+    def stop_halfway(done, total):
+        if done > total // 2:
+            raise StopRun()
+    with pytest.raises(StopRun):
+        med_matrix_memmap(cnv, bounds, path, zero_sentinel, tile_bytes=4096, progress=stop_halfway)
+    with open(path + ".tiles", "a") as log:
+        log.write("1")  # torn last line
+    computed = []
+    resumed = med_matrix_memmap(cnv, bounds, path, zero_sentinel, tile_bytes=4096,
+                                progress=lambda done, total: computed.append((done, total)))
+    assert (np.asarray(resumed) == med_matrix(cnv, bounds, zero_sentinel=zero_sentinel)).all()
+    # the tiles of the first run were kept: the resumed run starts past them
+    assert computed[0][0] > 1
+    assert computed[-1][0] == computed[-1][1]
+
+
+def test_changed_input_starts_over(example_profiles, tmp_path):
+    (name, cells, cnv, bounds) = example_profiles
+    path = str(tmp_path / "med.npy")
+    med_matrix_memmap(cnv, bounds, path, tile_bytes=4096)
+    changed = cnv.copy()
+    changed[0, 0] += 1
+    computed = []
+    result = med_matrix_memmap(changed, bounds, path, tile_bytes=4096,
+                               progress=lambda done, total: computed.append(done))
+    assert computed[0] == 1
+    assert (np.asarray(result) == med_matrix(changed, bounds)).all()
+    assert os.path.exists(path + ".tiles")
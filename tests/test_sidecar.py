@@ -0,0 +1,80 @@
+import os
+
+import numpy as np
+
+from ComputeDistance import SegmentTable
+from Readfile import cached_matrix, load_sidecar, read, read_matrix, with_root
+
+
+def parse(path):
+    return with_root(read_matrix(path))
+
+
+def sidecar_files(path):
+    folder = os.path.dirname(path)
+    return sorted(name for name in os.listdir(folder) if name.startswith(os.path.basename(path) + "."))
+
+
+def test_reload_matches_parse(segments):
+    path = segments()
+    (parsed, root) = cached_matrix(path, parse, "test")
+    (loaded, loaded_root) = load_sidecar(path, "test")
+    assert loaded_root == root and loaded.names == parsed.names and loaded.bounds == parsed.bounds
+    assert isinstance(loaded.values, np.memmap)
+    assert (loaded.values == parsed.values).all()
+    assert (loaded.vector_ids() == parsed.vector_ids()).all()
+
+
+def test_changed_file_is_parsed_again(segments):
+    path = segments()
+    cached_matrix(path, parse, "test")
+    before = os.stat(path)
+    segments(seed=1)  # same cells and size, other copy numbers
+    os.utime(path, (before.st_atime, before.st_mtime + 10))
+    assert load_sidecar(path, "test") is None
+    (matrix, root) = cached_matrix(path, parse, "test")
+    assert (matrix.values == parse(path)[0].values).all()
+    assert (load_sidecar(path, "test")[0].values == matrix.values).all()
+
+
+def test_touched_file_is_restamped(segments):
+    path = segments()
+    cached_matrix(path, parse, "test")
+    index = path + ".test.cnv.idx"
+    stamp = open(index).read().split("\n")[1]
+    os.utime(path, (1, 1))
+    assert load_sidecar(path, "test") is not None
+    assert open(index).read().split("\n")[1] != stamp
+    assert sidecar_files(path) == [os.path.basename(path) + ext for ext in (".test.cnv.ids.npy", ".test.cnv.idx", ".test.cnv.npy")]
+
+
+def test_old_sidecar_version_is_rebuilt(segments):
+    path = segments()
+    cached_matrix(path, parse, "test")
+    index = path + ".test.cnv.idx"
+    lines = open(index).read().split("\n")
+    lines[0] = "CNV sidecar 1 test"
+    with open(index, "w") as data:
+        data.write("\n".join(lines))
+    assert load_sidecar(path, "test") is None
+
+
+def test_read_once_writes_no_sidecar(segments):
+    path = segments()
+    read(path, SegmentTable(), sidecar=False)
+    assert sidecar_files(path) == []
+
+
+def test_interned_ids_survive_the_sidecar(segments):
+    path = segments()
+    cached_matrix(path, parse, "test")
+    (matrix, root) = cached_matrix(path, parse, "test")
+    table = SegmentTable()
+    table.intern("first", [[9] * (b - a) for (a, b) in matrix.bounds])
+    table.intern_matrix(matrix)
+    expected = SegmentTable()
+    expected.intern("first", [[9] * (b - a) for (a, b) in matrix.bounds])
+    for (i, name) in enumerate(matrix.names):
+        expected.intern(name, matrix.profile(i))
+    assert table.ids == expected.ids
+    assert table.vectors == expected.vectors
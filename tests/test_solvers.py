@@ -0,0 +1,15 @@
+import pytest
+
+from Solvers import available_solvers, check_tree, solve
+
+
+@pytest.mark.parametrize("solver", available_solvers() + ["auto"])
+def test_same_weight_as_tarjan(example_graph, solver):
+    (label, medgraph) = example_graph
+    root = medgraph.names[0]
+    g = dict((a, dict(medgraph[a].items())) for a in medgraph)
+    expected = solve(dict((a, dict(g[a])) for a in g), root, "tarjan", verbose=False)
+    result = solve(dict((a, dict(g[a])) for a in g), root, solver, verbose=False)
+    check_tree(g, root, result)
+    assert result.weight == expected.weight, (label, result.solver)
+
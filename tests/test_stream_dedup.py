@@ -0,0 +1,25 @@
+import pandas as pd
+
+from SP1_SCT_UTIL import dedup_cells, stream_dedup
+
+
+def test_stream_matches_in_memory(cell_matrix, tmp_path):
+    (path, df) = cell_matrix({"copy0": "cell3", "copy1": "cell3", "copy2": "cell5"})
+    (cells, dup_relationship) = dedup_cells(df)
+    out = str(tmp_path / "dedup.txt")
+    (n, streamed, streamed_relationship) = stream_dedup(path, out, chunk_rows=4)
+    assert n == df.shape[1]
+    assert streamed == cells == ["cell{}".format(j) for j in range(0, 8)]
+    assert streamed_relationship == dup_relationship
+    assert dup_relationship == {"par_cell": ["cell3", "cell3", "cell5"], "dup_cell": ["copy0", "copy1", "copy2"]}
+    unique = pd.read_csv(out, sep="\t", index_col=0)
+    assert list(unique.columns) == cells
+    assert (unique.to_numpy() == df[cells].to_numpy()).all()
+
+
+def test_no_duplicates_writes_nothing(cell_matrix, tmp_path):
+    (path, df) = cell_matrix({})
+    out = tmp_path / "dedup.txt"
+    (n, cells, dup_relationship) = stream_dedup(path, str(out), chunk_rows=4)
+    assert cells == list(df.columns) and dup_relationship == {"par_cell": [], "dup_cell": []}
+    assert not out.exists()
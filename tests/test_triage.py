@@ -0,0 +1,8 @@
+from Kruskal import triage_tree
+
+
+def test_matrix_and_dict_give_the_same_triage_tree(example_graph):
+    (label, medgraph) = example_graph
+    root = medgraph.names[0]
+    as_dict = dict((a, dict(medgraph[a].items())) for a in medgraph)
+    assert triage_tree(medgraph, root) == triage_tree(as_dict, root), label